@@ -1,52 +1,216 @@
+import hashlib
+import json
 import os
 import httpx
-from typing import List
-from anthropic import Anthropic
+from typing import Callable, List
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+
+from metrics import record_tokens
+from scheduler import DEFAULT_TENANT, Scheduler
+from singleflight import SingleFlight
 
 FILES_BETA = "files-api-2025-04-14"
+API_VERSION = "2023-06-01"
+DEFAULT_BASE_URL = "https://api.anthropic.com"
+
+def build_message_kwargs(model: str, temperature: float, max_tokens: int, system: str | None,
+                         prompts: List[dict], file_ids: List[str], cache: bool = True,
+                         context: List[str] | None = None, tools: List[dict] | None = None,
+                         titles: List[str | None] | None = None) -> dict:
+    """Assemble messages.create kwargs with the stable prefix first.
+
+    System prompt and documents are identical for every item of a checklist, so they
+    go first and the last of them carries a cache_control breakpoint; per-item context
+    (retrieved page excerpts) and the item text follow. Items 2..N then read the
+    prefix from the prompt cache.
+
+    With tools, the model must answer through one of them (tool_choice "any"); a
+    forced single tool would change the cached prefix from call to call. titles, aligned
+    with file_ids, name documents that are only part of a file.
+    """
+    content_blocks = []
+    for fid, title in zip(file_ids, titles or [None] * len(file_ids)):
+        block = {"type": "document", "source": {"type": "file", "file_id": fid}}
+        if title:
+            block["title"] = title
+        content_blocks.append(block)
+    if cache and content_blocks:
+        content_blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    for text in context or []:
+        content_blocks.append({"type": "text", "text": text})
+    for pr in prompts:
+        content_blocks.append({"type": "text", "text": pr["text"]})
+
+    kwargs = dict(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        messages=[{"role": "user", "content": content_blocks}],
+    )
+    if tools:
+        kwargs["tools"] = tools
+        kwargs["tool_choice"] = {"type": "any"}
+    if system:
+        if cache and not file_ids:
+            kwargs["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        else:
+            kwargs["system"] = system
+    return kwargs
+
+class AsyncAnthropicClient:
+    """Shared async client for the Messages, Files and Message Batches APIs.
+
+    Meant to be created once per process: the underlying HTTP/2 connection pool is
+    shared by the SDK and the file uploads, so keep-alive connections are reused
+    across requests. Call aclose() on shutdown.
+
+    Every upstream call goes through the (shared) scheduler, which owns rate limiting
+    and retries; the SDK's own retries are therefore disabled. `tenant` selects the
+    fair-queuing lane of a call.
 
-class AnthropicClient:
-    def __init__(self, api_key: str, model: str, temperature: float, max_tokens: int, system: str | None = None):
+    Identical uploads (same stored file) and identical non-streamed message calls (same
+    documents, prompt and model parameters) that overlap in time share one upstream
+    request; the call runs in the lane of the caller that started it.
+    """
+
+    def __init__(self, api_key: str, model: str, temperature: float, max_tokens: int, system: str | None = None,
+                 prompt_cache: bool = True, max_connections: int = 100, base_url: str = DEFAULT_BASE_URL,
+                 scheduler: Scheduler | None = None):
         self.api_key = api_key
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.system = system
-        self.client = Anthropic(
+        self.prompt_cache = prompt_cache
+        self.base_url = base_url.rstrip("/")
+        self.scheduler = scheduler or Scheduler(max_concurrency=max_connections)
+        self.flights = SingleFlight()
+        self.http = DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=60,
+            ),
+        )
+        self.client = AsyncAnthropic(
             api_key=api_key,
+            base_url=self.base_url,
             default_headers={
                 "anthropic-beta": FILES_BETA,
             },
+            http_client=self.http,
+            max_retries=0,
         )
 
-    def upload_files(self, file_paths: List[str]) -> List[str]:
-        file_ids: List[str] = []
-        headers = {
+    def _files_headers(self) -> dict:
+        return {
             "x-api-key": self.api_key,
-            "anthropic-version": "2023-06-01",
+            "anthropic-version": API_VERSION,
             "anthropic-beta": FILES_BETA,
         }
-        url = "https://api.anthropic.com/v1/files"
-        for p in file_paths:
-            with open(p, "rb") as f:
-                resp = httpx.post(url, headers=headers, files={"file": (os.path.basename(p), f)})
+
+    async def upload_file(self, file_path: str, tenant: str = DEFAULT_TENANT) -> str:
+        headers = self._files_headers()
+
+        async def send():
+            with open(file_path, "rb") as f:
+                resp = await self.http.post(f"{self.base_url}/v1/files", headers=headers,
+                                            files={"file": (os.path.basename(file_path), f)})
             resp.raise_for_status()
-            file_ids.append(resp.json()["id"])
-        return file_ids
-
-    def ask_with_files(self, prompts: List[dict], file_ids: List[str]):
-        content_blocks = []
-        for pr in prompts:
-            content_blocks.append({"type": "text", "text": pr["text"]})
-        for fid in file_ids:
-            content_blocks.append({"type": "document", "source": {"type": "file", "file_id": fid}})
-
-        kwargs = dict(
-            model=self.model,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            messages=[{"role": "user", "content": content_blocks}],
-        )
-        if self.system:
-            kwargs["system"] = self.system
-        return self.client.messages.create(**kwargs)
+            return resp.json()["id"], resp.headers
+
+        # Stored files are deduplicated by content, so the path identifies the content.
+        return await self.flights.do(("upload", os.path.abspath(file_path)),
+                                     lambda: self.scheduler.call(send, tenant, metered=False))
+
+    async def delete_file(self, file_id: str, tenant: str = DEFAULT_TENANT):
+        """Delete an uploaded file; a file that is already gone counts as deleted."""
+        async def send():
+            resp = await self.http.delete(f"{self.base_url}/v1/files/{file_id}", headers=self._files_headers())
+            if resp.status_code != 404:
+                resp.raise_for_status()
+            return None, resp.headers
+
+        await self.scheduler.call(send, tenant, metered=False)
+
+    def message_params(self, prompts: List[dict], file_ids: List[str], context: List[str] | None = None,
+                       max_tokens: int | None = None, system: str | None = None,
+                       tools: List[dict] | None = None, titles: List[str | None] | None = None) -> dict:
+        """messages.create kwargs; max_tokens and system override the client defaults for this call."""
+        return build_message_kwargs(self.model, self.temperature, max_tokens or self.max_tokens, system or self.system,
+                                    prompts, file_ids, cache=self.prompt_cache, context=context, tools=tools,
+                                    titles=titles)
+
+    async def ask_with_files(self, prompts: List[dict], file_ids: List[str], context: List[str] | None = None,
+                             tenant: str = DEFAULT_TENANT, options: dict | None = None):
+        """One model call; options are message_params overrides (max_tokens, system, tools, titles)."""
+        params = self.message_params(prompts, file_ids, context, **(options or {}))
+
+        async def send():
+            raw = await self.client.messages.with_raw_response.create(**params)
+            msg = raw.parse()
+            record_tokens(msg)
+            return msg, raw.headers
+
+        key = hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+        return await self.flights.do(("messages", key), lambda: self.scheduler.call(send, tenant))
+
+    async def stream_with_files(self, prompts: List[dict], file_ids: List[str], on_text: Callable[[str], bool],
+                                context: List[str] | None = None, tenant: str = DEFAULT_TENANT,
+                                options: dict | None = None):
+        """Like ask_with_files, but streamed: on_text gets every text delta as it arrives.
+
+        With tools, the deltas are those of the tool input JSON instead. When on_text
+        returns True the stream is closed right away and the message so far is returned
+        (its usage then only covers what was known at that point). Failures are only
+        retried until the first delta has been delivered.
+        """
+        params = self.message_params(prompts, file_ids, context, **(options or {}))
+        delivered = False
+
+        async def send():
+            nonlocal delivered
+            async with self.client.messages.stream(**params) as stream:
+                async for event in stream:
+                    if event.type == "text":
+                        delta = event.text
+                    elif event.type == "input_json":
+                        delta = event.partial_json
+                    else:
+                        continue
+                    delivered = True
+                    if on_text(delta):
+                        msg = stream.current_message_snapshot
+                        break
+                else:
+                    msg = await stream.get_final_message()
+                record_tokens(msg)
+                return msg, stream.response.headers
+
+        return await self.scheduler.call(send, tenant, can_retry=lambda: not delivered)
+
+    async def create_message_batch(self, requests: List[dict], tenant: str = DEFAULT_TENANT):
+        """Submit {"custom_id", "params"} requests to the Message Batches API."""
+        async def send():
+            raw = await self.client.messages.batches.with_raw_response.create(requests=requests)
+            return raw.parse(), raw.headers
+
+        return await self.scheduler.call(send, tenant, metered=False)
+
+    async def retrieve_message_batch(self, batch_id: str, tenant: str = DEFAULT_TENANT):
+        async def send():
+            raw = await self.client.messages.batches.with_raw_response.retrieve(batch_id)
+            return raw.parse(), raw.headers
+
+        return await self.scheduler.call(send, tenant, metered=False)
+
+    async def message_batch_results(self, batch_id: str, tenant: str = DEFAULT_TENANT):
+        """Async iterator over the individual results of an ended batch."""
+        async def send():
+            return await self.client.messages.batches.results(batch_id), None
+
+        return await self.scheduler.call(send, tenant, metered=False)
+
+    async def aclose(self):
+        await self.client.close()
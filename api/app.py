@@ -1,26 +1,70 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from typing import List, AsyncGenerator
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from typing import List, AsyncGenerator, AsyncIterator
 import json, asyncio, os
 import logging
 
 from config import load_config
-from anthropic_client import AnthropicClient
-from prompts import (
-    DEFAULT_SYSTEM,
-    JSON_ENFORCEMENT_HINT,
-    build_question_prompt,
-    build_condition_prompt,
+from anthropic_client import AsyncAnthropicClient
+from prompts import DEFAULT_SYSTEM, JSON_ENFORCEMENT_HINT
+from database import (
+    insert_file,
+    list_files,
+    discard_new_files,
+    EmptyFileError,
+    FileTooLargeError,
 )
-from database import insert_file, get_file_paths, fetch_all_files, get_file_paths_by_ids
-
-app = FastAPI(title="Forgent Checklist API", version="0.1.0")
+from checklist import run_from_payload
+from ingest import ingest_file, inspect_file
+from jobs import JobManager
+from runs import UnknownRunError, recorded_events, reevaluate, run_snapshot, start_run
+from metrics import timed
+from scheduler import Scheduler
+from storage import StorageManager, unlink_all
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# How often a streaming /ask checks whether its client is still connected.
+DISCONNECT_POLL_SECONDS = 0.5
+FILES_PAGE_MAX = 1000
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One config and one pooled Anthropic client for the lifetime of the worker.
+    config = load_config()
+    logger.info("Initializing Anthropic client")
+    app.state.config = config
+    app.state.client = AsyncAnthropicClient(
+        api_key=config.api_key,
+        model=config.model,
+        temperature=config.temperature,
+        max_tokens=config.max_output_tokens,
+        system=DEFAULT_SYSTEM + "\n" + JSON_ENFORCEMENT_HINT,
+        prompt_cache=config.prompt_cache,
+        base_url=config.base_url,
+        scheduler=Scheduler(config.upstream_concurrency, max_retries=config.upstream_max_retries),
+    )
+    app.state.ingest_pool = ProcessPoolExecutor(max_workers=config.ingest_workers)
+    app.state.jobs = JobManager(app.state.client, config, workers=config.job_workers)
+    await app.state.jobs.start()
+    app.state.storage = StorageManager(app.state.client, config)
+    await app.state.storage.start()
+    try:
+        yield
+    finally:
+        await app.state.storage.stop()
+        await app.state.jobs.stop()
+        app.state.ingest_pool.shutdown(cancel_futures=True)
+        await app.state.client.aclose()
+
+app = FastAPI(title="Forgent Checklist API", version="0.1.0", lifespan=lifespan)
+
 # Allow local frontend dev (Next.js on port 3000). Can override with comma separated ALLOWED_ORIGINS env.
 allowed_origins_env = os.getenv("ALLOWED_ORIGINS")
 if allowed_origins_env:
@@ -38,132 +82,207 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class UploadSizeLimit:
+    """Rejects oversized uploads by Content-Length before the multipart body is read and spooled.
+
+    Plain ASGI: an @app.middleware("http") function would wrap every response, including
+    the long streaming ones, and get in the way of disconnect detection.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/upload":
+            content_length = dict(scope["headers"]).get(b"content-length", b"").decode("latin-1")
+            limit = scope["app"].state.config.upload_max_request_bytes
+            if content_length.isdigit() and int(content_length) > limit:
+                logger.error("Upload request too large: %s bytes", content_length)
+                response = JSONResponse(status_code=413, content={"detail": f"Upload exceeds {limit} bytes"})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+app.add_middleware(UploadSizeLimit)
+
 @app.post("/upload")
-async def upload(files: List[UploadFile] = File(...)):
+async def upload(request: Request, background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)):
     logger.info("Received upload request with %d files", len(files))
-    stored = []
+    max_bytes = request.app.state.config.upload_max_bytes
+
+    # Reject what can be judged from the multipart headers before storing anything.
     for uf in files:
+        if uf.size is not None and uf.size > max_bytes:
+            logger.error("File too large: %s", uf.filename)
+            raise HTTPException(status_code=413, detail=f"{uf.filename} exceeds {max_bytes} bytes")
+        if uf.size == 0:
+            logger.error("Empty file: %s", uf.filename)
+            raise HTTPException(status_code=400, detail=f"Empty file: {uf.filename}")
+
+    async def store(uf: UploadFile) -> tuple[str, bool, float]:
         logger.info("Processing file: %s", uf.filename)
-        data = await uf.read()
-        if not data:
+        try:
+            with timed("upload_store"):
+                file_id, created, accessed_at = await asyncio.to_thread(insert_file, uf.filename, uf.file, max_bytes)
+        except EmptyFileError:
             logger.error("Empty file: %s", uf.filename)
             raise HTTPException(status_code=400, detail=f"Empty file: {uf.filename}")
-        file_id = insert_file(uf.filename, data)
+        except FileTooLargeError:
+            logger.error("File too large: %s", uf.filename)
+            raise HTTPException(status_code=413, detail=f"{uf.filename} exceeds {max_bytes} bytes")
         logger.info("File %s stored with ID: %s", uf.filename, file_id)
-        stored.append({"id": file_id, "filename": uf.filename})
+        return file_id, created, accessed_at
+
+    results = await asyncio.gather(*(store(uf) for uf in files), return_exceptions=True)
+    error = next((r for r in results if isinstance(r, BaseException)), None)
+    if error is not None:
+        # All or nothing: the client never learns the IDs of files stored by a failed request.
+        # Files handed out to a concurrent upload of the same content meanwhile are kept.
+        created = [(r[0], r[2]) for r in results if not isinstance(r, BaseException) and r[1]]
+        if created:
+            logger.info("Removing %d files stored by the failed upload", len(created))
+            paths = await asyncio.to_thread(discard_new_files, created)
+            await asyncio.to_thread(unlink_all, paths)
+        raise error
+
+    pool = request.app.state.ingest_pool
+    stats = await asyncio.gather(*(inspect_file(pool, file_id) for file_id, _, _ in results))
+    stored = [
+        {"id": file_id, "filename": uf.filename, **(s or {})}
+        for uf, (file_id, _, _), s in zip(files, results, stats)
+    ]
     logger.info("Successfully stored %d files", len(stored))
+    for f in stored:
+        background_tasks.add_task(ingest_file, pool, request.app.state.config, f["id"])
     return {"files": stored, "count": len(stored)}
 
 @app.post("/ask")
-async def ask(payload: dict):
-    logger.info("Received ask request with payload: %s", payload)
-    questions: List[dict] = payload.get("questions") or []
-    conditions: List[dict] = payload.get("conditions") or []
-    file_ids: List[str] = payload.get("file_ids") or []
-
-    if not questions and not conditions:
-        logger.error("No questions or conditions provided")
-        raise HTTPException(status_code=400, detail="Provide at least one question or condition")
-
-    if not file_ids:
-        logger.error("No file IDs provided")
-        raise HTTPException(status_code=400, detail="Provide file IDs for processing")
-
-    logger.info("Fetching file paths for provided file IDs")
-    paths = get_file_paths_by_ids(file_ids)
-    if not paths:
-        logger.error("No valid files found for provided file_ids")
-        raise HTTPException(status_code=400, detail="No valid files found for provided file_ids")
+async def ask(payload: dict, request: Request):
+    logger.info("Received ask request with %d questions, %d conditions, %d files",
+                len(payload.get("questions") or []), len(payload.get("conditions") or []),
+                len(payload.get("file_ids") or []))
+    try:
+        run = await run_from_payload(request.app.state.client, request.app.state.config, with_tenant(payload, request))
+    except ValueError as e:
+        logger.error("Invalid ask request: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    return stream_run(request, run, run.events())
 
-    logger.info("Initializing Anthropic client")
-    config = load_config()
-    system_prompt = DEFAULT_SYSTEM + "\n" + JSON_ENFORCEMENT_HINT
-    client = AnthropicClient(
-        api_key=config.api_key,
-        model=config.model,
-        temperature=config.temperature,
-        max_tokens=config.max_output_tokens,
-        system=system_prompt,
-    )
+@app.post("/runs")
+async def create_run(payload: dict, request: Request):
+    """Like /ask, but stored as version 1 of a checklist that can be re-evaluated later."""
+    logger.info("Received run request")
+    try:
+        record, run = await start_run(request.app.state.client, request.app.state.config, with_tenant(payload, request))
+    except ValueError as e:
+        logger.error("Invalid run request: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    return stream_run(request, run, recorded_events(record, run), headers={"X-Run-ID": record["id"]})
+
+@app.post("/runs/{run_id}/reevaluate")
+async def reevaluate_run(run_id: str, payload: dict, request: Request):
+    """Next version of a run: only items whose inputs changed are answered again, the rest is reused."""
+    logger.info("Received re-evaluation request for run %s", run_id)
+    try:
+        record, run, diff = await reevaluate(request.app.state.client, request.app.state.config,
+                                             request.app.state.ingest_pool, run_id, with_tenant(payload, request))
+    except UnknownRunError:
+        raise HTTPException(status_code=404, detail="Unknown run")
+    except ValueError as e:
+        logger.error("Invalid re-evaluation request: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    return stream_run(request, run, recorded_events(record, run, diff), headers={"X-Run-ID": record["id"]})
 
+@app.get("/runs/{run_id}")
+async def get_run(run_id: str):
+    snapshot = await asyncio.to_thread(run_snapshot, run_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Unknown run")
+    return snapshot
+
+def stream_run(request: Request, run, events: AsyncIterator[dict], headers: dict | None = None) -> StreamingResponse:
+    """Stream a run's events as JSON lines, cancelling the run when the client goes away."""
     async def stream() -> AsyncGenerator[bytes, None]:
-        logger.info("Uploading files to Anthropic")
-        anthropic_file_ids = client.upload_files(paths)
-        for q in questions:
-            logger.info("Processing question: %s", q["text"])
-            prompt = build_question_prompt(q["text"]) + "\nNur das JSON Objekt. Keine Erklärungen, KEINE Backticks."
-            res = client.ask_with_files([{"text": prompt}], anthropic_file_ids)
-            raw_txt = extract_text_blocks(res)
-            answer = parse_question_answer(raw_txt)
-            yield json.dumps({
-                "type": "question_result",
-                "id": q["id"],
-                "question": q["text"],
-                "answer": answer,
-                "raw": raw_txt,
-            }, ensure_ascii=False).encode() + b"\n"
-            await asyncio.sleep(0)
-        for c in conditions:
-            logger.info("Processing condition: %s", c["text"])
-            prompt = build_condition_prompt(c["text"]) + "\nNur das JSON Objekt. Keine Erklärungen, KEINE Backticks."
-            res = client.ask_with_files([{"text": prompt}], anthropic_file_ids)
-            raw_txt = extract_text_blocks(res)
-            result = parse_condition_answer(raw_txt)
-            yield json.dumps({
-                "type": "condition_result",
-                "id": c["id"],
-                "condition": c["text"],
-                "result": result,
-                "raw": raw_txt,
-            }, ensure_ascii=False).encode() + b"\n"
-            await asyncio.sleep(0)
+        watcher = asyncio.create_task(cancel_on_disconnect(request, run))
+        try:
+            async for event in events:
+                yield encode_event(event)
+        finally:
+            watcher.cancel()
+            run.cancel()
         logger.info("Streaming completed")
-        yield b"{\"type\": \"done\"}\n"
-
-    return StreamingResponse(stream(), media_type="application/jsonl")
-
-def extract_text_blocks(msg) -> str:
-    raw = "\n".join([
-        (getattr(blk, "text", None).text if hasattr(getattr(blk, "text", None), "text") else getattr(blk, "text", None))
-        for blk in getattr(msg, "content", [])
-        if getattr(blk, "type", None) == "text"
-    ]).strip()
-    if raw.startswith("```"):
-        lines = raw.splitlines()
-        if lines[0].startswith("```"):
-            lines = lines[1:]
-        if lines and lines[-1].strip().startswith("```"):
-            lines = lines[:-1]
-        raw = "\n".join(lines).strip()
-    if raw.lower().startswith("json\n"):
-        raw = raw[5:].strip()
-    return raw
-
-
-def parse_question_answer(raw: str) -> str:
-    """Extract the 'antwort' field if JSON, else fallback."""
-    try:
-        parsed = json.loads(raw)
-        if isinstance(parsed, dict):
-            val = parsed.get("antwort") or parsed.get("answer")
-            if isinstance(val, str) and val.strip():
-                return val.strip()
-    except Exception:
-        pass
-    return "Unklar"
 
+    return StreamingResponse(stream(), media_type="application/jsonl", headers=headers)
+
+async def cancel_on_disconnect(request: Request, run):
+    """Stop the run's model calls and uploads as soon as the client has gone away."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    logger.warning("Client disconnected, cancelling run")
+    run.cancel()
 
-def parse_condition_answer(raw: str) -> bool:
+def with_tenant(payload: dict, request: Request) -> dict:
+    """Take the fair-queuing tenant from the X-Tenant-ID header unless the payload names one."""
+    tenant = request.headers.get("x-tenant-id")
+    if tenant and not payload.get("tenant"):
+        return {**payload, "tenant": tenant}
+    return payload
+
+def encode_event(event: dict) -> bytes:
+    return json.dumps(event, ensure_ascii=False).encode() + b"\n"
+
+def encode_sse(seq: int, event: dict) -> bytes:
+    return f"id: {seq}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+
+@app.post("/jobs")
+async def create_job(payload: dict, request: Request):
+    logger.info("Received job request")
     try:
-        parsed = json.loads(raw)
-        if isinstance(parsed, dict):
-            if isinstance(parsed.get("result"), bool):
-                return parsed["result"]
-            if isinstance(parsed.get("answer"), bool):
-                return parsed["answer"]
-    except Exception:
-        pass
-    return False
+        job_id = await request.app.state.jobs.submit(with_tenant(payload, request))
+    except ValueError as e:
+        logger.error("Invalid job request: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"id": job_id, "status": "queued"}
+
+@app.post("/batches")
+async def create_batch_job(payload: dict, request: Request):
+    """Like POST /jobs, but answers all items through the Message Batches API (cheaper, slower)."""
+    logger.info("Received message batch job request")
+    try:
+        job_id = await request.app.state.jobs.submit({**with_tenant(payload, request), "mode": "message_batch"})
+    except ValueError as e:
+        logger.error("Invalid batch job request: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, request: Request):
+    snapshot = await request.app.state.jobs.snapshot(job_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return snapshot
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, offset: int = 0, format: str | None = None):
+    """Stream job events from `offset` on (JSONL with a `seq` per line, or SSE with `id:`)."""
+    jobs: JobManager = request.app.state.jobs
+    if await jobs.snapshot(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    sse = format == "sse" or (format is None and "text/event-stream" in request.headers.get("accept", ""))
+    last_event_id = request.headers.get("last-event-id")
+    if sse and last_event_id and last_event_id.isdigit():
+        offset = max(offset, int(last_event_id) + 1)
+    logger.info("Following job %s from offset %d", job_id, offset)
+
+    async def stream() -> AsyncGenerator[bytes, None]:
+        async for seq, event in jobs.follow(job_id, offset):
+            yield encode_sse(seq, event) if sse else encode_event({**event, "seq": seq})
+
+    return StreamingResponse(stream(), media_type="text/event-stream" if sse else "application/jsonl")
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health")
 async def health():
@@ -171,8 +290,16 @@ async def health():
     return {"status": "ok"}
 
 @app.get("/files")
-async def list_files():
+async def files(limit: int = Query(100, ge=1, le=FILES_PAGE_MAX), cursor: str | None = None,
+                filename: str | None = None, content_hash: str | None = None,
+                created_after: str | None = None, created_before: str | None = None):
+    """Stored files, newest first; pass next_cursor back as cursor for the next page."""
     logger.info("List files endpoint called")
-    files = fetch_all_files()
-    logger.info("Fetched %d files", len(files))
-    return {"files": [{"id": fid, "filename": fname} for fid, fname, _ in files]}
+    try:
+        page, next_cursor = await asyncio.to_thread(
+            list_files, limit, cursor, filename, content_hash, created_after, created_before
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("Fetched %d files", len(page))
+    return {"files": page, "next_cursor": next_cursor}
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import random
+from typing import AsyncIterator
+
+from checklist import ChecklistRun, usage_event
+from metrics import record_tokens
+from parsing import extract_answer_text
+
+logger = logging.getLogger(__name__)
+
+
+def custom_id_for(index: int) -> str:
+    # Item ids are user-supplied and may not match the Batches API custom_id pattern.
+    return f"item-{index}"
+
+
+async def submit_message_batch(run: ChecklistRun, skip_ids: set | None = None) -> str:
+    """Submit the run's items (minus skip_ids) as one Message Batch and return the batch ID."""
+    file_ids = await run.ensure_file_ids()
+    requests = [
+        {
+            "custom_id": custom_id_for(i),
+            "params": run.client.message_params([{"text": run.item_prompt(kind, item)}], file_ids,
+                                                **run.message_options(kind)),
+        }
+        for i, (kind, item) in enumerate(run.items)
+        if not skip_ids or item["id"] not in skip_ids
+    ]
+    batch = await run.client.create_message_batch(requests, run.tenant)
+    logger.info("Submitted message batch %s with %d requests", batch.id, len(requests))
+    return batch.id
+
+
+async def wait_for_batch(run: ChecklistRun, batch_id: str, initial_delay: float, max_delay: float):
+    """Poll until the batch has ended, backing off exponentially with jitter."""
+    delay = initial_delay
+    while True:
+        batch = await run.client.retrieve_message_batch(batch_id, run.tenant)
+        if batch.processing_status == "ended":
+            return batch
+        counts = batch.request_counts
+        logger.info("Batch %s %s: %d processing, %d succeeded, %d errored", batch_id, batch.processing_status,
+                    counts.processing, counts.succeeded, counts.errored)
+        await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+        delay = min(delay * 2, max_delay)
+
+
+async def batch_result_events(run: ChecklistRun, batch_id: str, skip_ids: set | None = None) -> AsyncIterator[dict]:
+    """Map the results of an ended batch back to result events for the run's items."""
+    by_custom_id = {custom_id_for(i): pair for i, pair in enumerate(run.items)}
+    async for entry in await run.client.message_batch_results(batch_id, run.tenant):
+        pair = by_custom_id.get(entry.custom_id)
+        if pair is None:
+            continue
+        kind, item = pair
+        if skip_ids and item["id"] in skip_ids:
+            continue
+        if entry.result.type != "succeeded":
+            yield {"type": "error", "id": item["id"], "message": f"Batch request {entry.result.type}"}
+            continue
+        message = entry.result.message
+        record_tokens(message)
+        yield run.event_from_raw(kind, item, extract_answer_text(message))
+        yield usage_event([item], message)
@@ -0,0 +1,678 @@
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Callable, List
+
+import anthropic
+
+from anthropic_client import AsyncAnthropicClient
+from config import Config
+from database import (
+    get_documents,
+    get_remote_file_id,
+    set_remote_file_id,
+    forget_remote_file_ids,
+    workspace_key,
+    answer_cache_key,
+    get_cached_answers,
+    put_cached_answer,
+    count_indexed_pages,
+    search_pages,
+)
+from ingest import build_fts_query
+from metrics import (
+    ABANDONED_ITEMS,
+    ANSWER_CACHE_HITS,
+    ITEMS_PER_RUN,
+    PARSE_FAILURES,
+    RUNS_IN_PROGRESS,
+    TIME_TO_FIRST_RESULT,
+    timed,
+)
+from parsing import (
+    extract_answer_text,
+    parse_question_answer,
+    parse_condition_answer,
+    parse_batch_answer,
+    question_answer_from,
+    condition_result_from,
+    loads_or_none,
+    usage_from,
+    StreamingAnswerParser,
+)
+from scheduler import DEFAULT_TENANT
+from prompts import (
+    BATCH_OUTPUT_OVERHEAD_TOKENS,
+    BELEG_MODES,
+    PROMPT_VERSION,
+    RETRIEVAL_HINT,
+    STRUCTURED_SYSTEM,
+    answer_tools,
+    format_page_excerpt,
+    build_question_prompt,
+    build_condition_prompt,
+    build_batch_prompt,
+    estimate_output_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+# Options of /ask that the Message Batches mode cannot honour.
+MESSAGE_BATCH_UNSUPPORTED = ("retrieval", "batch", "stream_tokens")
+
+SINGLE_ITEM_SUFFIX = "\nNur das JSON Objekt. Keine Erklärungen, KEINE Backticks."
+# Queue marker that wakes events() after cancel().
+CANCELLED = -1
+RESULT_TYPES = ("question_result", "condition_result")
+
+
+async def resolve_remote_file_ids(client: AsyncAnthropicClient, files: List[tuple], workspace: str,
+                                  ttl_seconds: float, tenant: str = DEFAULT_TENANT) -> List[str]:
+    """Map local files to remote file IDs, uploading only content not yet known to this workspace."""
+    remote_ids = []
+    for path, content_hash in files:
+        remote_id = await asyncio.to_thread(get_remote_file_id, content_hash, workspace) if content_hash else None
+        if remote_id is None:
+            logger.info("Uploading file to Anthropic: %s", path)
+            remote_id = await client.upload_file(path, tenant)
+            if content_hash:
+                await asyncio.to_thread(set_remote_file_id, content_hash, workspace, remote_id, ttl_seconds)
+        else:
+            logger.info("Reusing remote file %s for %s", remote_id, path)
+        remote_ids.append(remote_id)
+    return remote_ids
+
+
+def question_event(item: dict, answer: str, raw: str) -> dict:
+    return {
+        "type": "question_result",
+        "id": item["id"],
+        "question": item["text"],
+        "answer": answer,
+        "raw": raw,
+    }
+
+
+def condition_event(item: dict, result: bool, raw: str) -> dict:
+    return {
+        "type": "condition_result",
+        "id": item["id"],
+        "condition": item["text"],
+        "result": result,
+        "raw": raw,
+    }
+
+
+def usage_event(items: List[dict], msg) -> dict:
+    return {"type": "usage", "ids": [item["id"] for item in items], "usage": usage_from(msg)}
+
+
+def split_batches(items: List[tuple], output_budget: int, max_items: int) -> List[List[tuple]]:
+    """Greedily pack (kind, item) pairs into batches whose estimated output fits the budget."""
+    batches: List[List[tuple]] = []
+    current: List[tuple] = []
+    used = BATCH_OUTPUT_OVERHEAD_TOKENS
+    for kind, item in items:
+        cost = estimate_output_tokens(kind)
+        if current and (used + cost > output_budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], BATCH_OUTPUT_OVERHEAD_TOKENS
+        current.append((kind, item))
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def log_cache_write_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Could not store answer in cache: %s", future.exception())
+
+
+class ChecklistRun:
+    """Answers a checklist (questions + conditions) against a set of stored files.
+
+    Items with a fresh entry in the answer cache are served from it. The rest is split
+    into units (a single item, or a batch of items in batch mode) that run concurrently
+    up to `concurrency`. events() yields one result event per item, in input order or
+    completion order, followed by a final "done" event.
+
+    In retrieval mode each unit gets only the top-k indexed pages matching its items
+    instead of the whole documents; units without any match fall back to the documents.
+
+    With stream_tokens, single items are streamed from the model and "question_partial"
+    (answer text as it arrives) and "condition_partial" events are yielded as soon as
+    possible, regardless of order. With beleg "none", a stream is closed once the answer
+    or result is complete; such truncated answers are not written to the answer cache.
+
+    In structured mode the model answers through a tool per item type (see
+    prompts.answer_tools) instead of free JSON text. Single items get their own output
+    budget per type; `beleg` ("full", "terse", "none") sets how much evidence is asked for.
+
+    cancel() (e.g. on client disconnect) stops the run: in-flight and pending model calls
+    and uploads are cancelled, events() ends without "done", and `skipped` records how
+    many items were finished, cancelled in flight, or never started.
+
+    Stage latencies go to the Prometheus metrics; with timings, a {"type": "timings"}
+    event with the run's own per-stage totals precedes "done".
+
+    `reuse` maps item IDs to result events of an earlier run (see runs.py); those items
+    are served like cache hits.
+
+    `files` are the documents actually sent: with variant "normalized", the normalized
+    parts of a file where there are any (see ingest.normalize_pdf). `titles` (aligned
+    with files) label parts of split files.
+    """
+
+    def __init__(self, client: AsyncAnthropicClient, config: Config, files: List[tuple],
+                 questions: List[dict], conditions: List[dict], concurrency: int = 1,
+                 order: str = "input", batch: bool = False, batch_max_items: int | None = None,
+                 bypass_cache: bool = False, file_ids: List[str] | None = None,
+                 retrieval: bool = False, top_k: int | None = None, stream_tokens: bool = False,
+                 beleg: str = "full", tenant: str = DEFAULT_TENANT, timings: bool = False,
+                 structured: bool = False, variant: str = "original", titles: List[str | None] | None = None):
+        self.client = client
+        self.config = config
+        self.files = files
+        self.variant = variant
+        self.titles = titles if titles and any(titles) else None
+        self.items = [("question", q) for q in questions] + [("condition", c) for c in conditions]
+        self.concurrency = concurrency
+        self.order = order
+        self.batch = batch
+        self.batch_max_items = batch_max_items or config.ask_batch_max_items
+        self.workspace = workspace_key(config.api_key, config.base_url)
+        self.anthropic_file_ids: List[str] | None = None
+        self._reupload_lock = asyncio.Lock()
+        self.file_ids = file_ids or []
+        self.retrieval = retrieval
+        self.top_k = top_k or config.retrieval_top_k
+        self.content_hashes = [h for _, h in files]
+        self.cache_enabled = config.answer_cache_ttl_seconds > 0 and all(self.content_hashes)
+        self.bypass_cache = bypass_cache
+        self.stream_tokens = stream_tokens
+        self.beleg = beleg
+        self.structured = structured
+        self.tools = answer_tools(beleg) if structured else None
+        self.tenant = tenant
+        self.reuse: dict[str, dict] = {}
+        self.report_timings = timings
+        self.timings: dict[str, float] = {}
+        self.finished = False
+        self.skipped: dict | None = None
+        self._tasks: List[asyncio.Task] = []
+        self._queue: asyncio.Queue | None = None
+
+    def prompt_version(self) -> str:
+        version = PROMPT_VERSION + (":retrieval" if self.retrieval else "")
+        if self.structured:
+            version += ":structured"
+        if self.beleg != "full":
+            version += ":beleg-" + self.beleg
+        if self.variant != "original":
+            version += ":" + self.variant
+        return version
+
+    def cache_key(self, kind: str, item: dict) -> str:
+        return answer_cache_key(self.content_hashes, kind, item["text"], self.client.model,
+                                self.client.temperature, self.prompt_version())
+
+    def item_key(self, kind: str, item: dict) -> str:
+        """cache_key without the documents: the inputs of an item that are not shared by all items."""
+        return answer_cache_key([], kind, item["text"], self.client.model, self.client.temperature,
+                                self.prompt_version())
+
+    async def cached_events(self, pairs: List[tuple]) -> List[dict | None]:
+        """Answer cache hits for (kind, item) pairs, None where there is none; one lookup for all."""
+        if not self.cache_enabled or self.bypass_cache:
+            return [None] * len(pairs)
+        keys = [self.cache_key(kind, item) for kind, item in pairs]
+        with timed("cache_lookup", self.timings):
+            hits = await asyncio.to_thread(get_cached_answers, keys, self.config.answer_cache_ttl_seconds)
+        events = []
+        for key, (kind, item) in zip(keys, pairs):
+            hit = hits.get(key)
+            if hit is not None:
+                ANSWER_CACHE_HITS.inc()
+                hit = {**hit, "id": item["id"], kind: item["text"], "cached": True}
+            events.append(hit)
+        return events
+
+    def remember(self, kind: str, item: dict, event: dict):
+        """Store a successfully parsed result in the answer cache (in the background, off the event loop)."""
+        if not self.cache_enabled:
+            return
+        result = {k: v for k, v in event.items() if k not in ("id", kind)}
+        future = asyncio.get_running_loop().run_in_executor(
+            None, put_cached_answer, self.cache_key(kind, item), result, self.config.answer_cache_max_bytes
+        )
+        future.add_done_callback(log_cache_write_failure)
+
+    async def ensure_file_ids(self) -> List[str]:
+        async with self._reupload_lock:
+            if self.anthropic_file_ids is None:
+                logger.info("Resolving Anthropic file IDs")
+                with timed("remote_upload", self.timings):
+                    self.anthropic_file_ids = await resolve_remote_file_ids(
+                        self.client, self.files, self.workspace, self.config.file_id_ttl_seconds, self.tenant
+                    )
+        return self.anthropic_file_ids
+
+    async def context_for(self, pairs: List[tuple]) -> List[str] | None:
+        """Top-k page excerpts for the given items, or None to send whole documents."""
+        if not self.retrieval:
+            return None
+        seen, excerpts = set(), []
+        with timed("retrieval", self.timings):
+            for _, item in pairs:
+                matches = await asyncio.to_thread(search_pages, self.file_ids, build_fts_query(item["text"]), self.top_k)
+                for file_id, filename, page_no, text in matches:
+                    if (file_id, page_no) not in seen:
+                        seen.add((file_id, page_no))
+                        excerpts.append(format_page_excerpt(filename, page_no, text))
+        return excerpts or None
+
+    def message_options(self, kind: str | None = None) -> dict:
+        """Per-call overrides of the client defaults; kind None is a batch of items."""
+        options = {}
+        if kind is not None:
+            budget = self.config.question_max_tokens if kind == "question" else self.config.condition_max_tokens
+            options["max_tokens"] = min(budget, self.config.max_output_tokens)
+        if self.structured:
+            options["system"] = STRUCTURED_SYSTEM
+            options["tools"] = self.tools
+        if self.titles:
+            options["titles"] = self.titles
+        return options
+
+    async def ask_model(self, prompt: str, context: List[str] | None = None,
+                        on_text: Callable[[str], bool] | None = None, options: dict | None = None):
+        """One model call; streamed through on_text (see stream_with_files) when given."""
+        async def request(prompts: List[dict], file_ids: List[str], context: List[str] | None = None):
+            with timed("model_call", self.timings):
+                if on_text is None:
+                    return await self.client.ask_with_files(prompts, file_ids, context=context, tenant=self.tenant,
+                                                            options=options)
+                return await self.client.stream_with_files(prompts, file_ids, on_text, context=context,
+                                                           tenant=self.tenant, options=options)
+
+        if context is not None:
+            return await request([{"text": prompt + "\n" + RETRIEVAL_HINT}], [], context=context)
+        # A cached remote file may have been deleted upstream; re-upload once and retry.
+        used_ids = await self.ensure_file_ids()
+        try:
+            return await request([{"text": prompt}], used_ids)
+        except anthropic.NotFoundError:
+            async with self._reupload_lock:
+                if self.anthropic_file_ids is used_ids:
+                    logger.warning("Remote file missing, re-uploading %d files", len(self.files))
+                    await asyncio.to_thread(forget_remote_file_ids, [h for _, h in self.files if h], self.workspace)
+                    self.anthropic_file_ids = await resolve_remote_file_ids(
+                        self.client, self.files, self.workspace, self.config.file_id_ttl_seconds, self.tenant
+                    )
+            return await request([{"text": prompt}], self.anthropic_file_ids)
+
+    def item_prompt(self, kind: str, item: dict) -> str:
+        build = build_question_prompt if kind == "question" else build_condition_prompt
+        prompt = build(item["text"], self.beleg, self.structured)
+        return prompt if self.structured else prompt + SINGLE_ITEM_SUFFIX
+
+    def event_from_raw(self, kind: str, item: dict, raw_txt: str) -> dict:
+        """Result event for a single-item answer; cleanly parsed answers go to the answer cache."""
+        if kind == "question":
+            event = question_event(item, parse_question_answer(raw_txt), raw_txt)
+            clean = question_answer_from(loads_or_none(raw_txt)) is not None
+        else:
+            event = condition_event(item, parse_condition_answer(raw_txt), raw_txt)
+            clean = condition_result_from(loads_or_none(raw_txt)) is not None
+        if clean:
+            self.remember(kind, item, event)
+        else:
+            PARSE_FAILURES.labels(kind).inc()
+        return event
+
+    def hit_item_budget(self, res, options: dict) -> bool:
+        """Whether a single-item answer was cut off by its per-type budget rather than the full one."""
+        return getattr(res, "stop_reason", None) == "max_tokens" and options["max_tokens"] < self.config.max_output_tokens
+
+    async def ask_with_full_budget(self, kind: str, item: dict, prompt: str, context: List[str] | None,
+                                   options: dict):
+        """Ask again, not streamed, with ANTHROPIC_MAX_TOKENS after the per-type budget was too small."""
+        logger.warning("%s %s hit its max_tokens budget, retrying with %d", kind, item["id"],
+                       self.config.max_output_tokens)
+        return await self.ask_model(prompt, context, options={**options, "max_tokens": self.config.max_output_tokens})
+
+    async def run_item(self, kind: str, item: dict) -> List[dict]:
+        logger.info("Processing %s: %s", kind, item["text"])
+        prompt, options = self.item_prompt(kind, item), self.message_options(kind)
+        context = await self.context_for([(kind, item)])
+        res = await self.ask_model(prompt, context, options=options)
+        events = [usage_event([item], res)]
+        if self.hit_item_budget(res, options):
+            res = await self.ask_with_full_budget(kind, item, prompt, context, options)
+            events.append(usage_event([item], res))
+        with timed("parse", self.timings):
+            event = self.event_from_raw(kind, item, extract_answer_text(res))
+        return [event, *events]
+
+    async def stream_item(self, kind: str, item: dict, emit: Callable[[dict], None]) -> List[dict]:
+        """run_item, but emits partial events while the answer is being generated."""
+        logger.info("Streaming %s: %s", kind, item["text"])
+        parser = StreamingAnswerParser()
+        sent = {"answer": "", "result": None}
+
+        def on_text(text: str) -> bool:
+            parser.feed(text)
+            if kind == "question":
+                answer = parser.answer()
+                if answer is None:
+                    return False
+                if len(answer[0]) > len(sent["answer"]):
+                    emit({"type": "question_partial", "id": item["id"], "delta": answer[0][len(sent["answer"]):]})
+                    sent["answer"] = answer[0]
+                return answer[1] and self.beleg == "none"
+            result = parser.result()
+            if result is not None and sent["result"] is None:
+                emit({"type": "condition_partial", "id": item["id"], "result": result})
+                sent["result"] = result
+            return result is not None and self.beleg == "none"
+
+        prompt, options = self.item_prompt(kind, item), self.message_options(kind)
+        context = await self.context_for([(kind, item)])
+        res = await self.ask_model(prompt, context, on_text, options)
+        usage = usage_event([item], res)
+        if parser.closed:
+            return [self.event_from_raw(kind, item, parser.raw()), usage]
+        answer, result = parser.answer(), parser.result()
+        if kind == "question" and answer is not None and answer[1] and answer[0].strip():
+            return [question_event(item, answer[0].strip(), parser.raw()), usage]
+        if kind == "condition" and result is not None:
+            return [condition_event(item, result, parser.raw()), usage]
+        if self.hit_item_budget(res, options):
+            # Cut off before the answer was complete; the retry's result replaces the partials.
+            res = await self.ask_with_full_budget(kind, item, prompt, context, options)
+            return [self.event_from_raw(kind, item, extract_answer_text(res)), usage, usage_event([item], res)]
+        return [self.event_from_raw(kind, item, extract_answer_text(res)), usage]
+
+    async def run_batch(self, batch: List[tuple], emit: Callable[[dict], None] | None = None) -> List[dict]:
+        if len(batch) == 1:
+            if emit is not None:
+                return await self.stream_item(*batch[0], emit)
+            return await self.run_item(*batch[0])
+        logger.info("Processing batch of %d items", len(batch))
+        prompt = build_batch_prompt([{"id": item["id"], "type": kind, "text": item["text"]} for kind, item in batch],
+                                    self.beleg, self.structured)
+        res = await self.ask_model(prompt, await self.context_for(batch), options=self.message_options())
+        events = [usage_event([item for _, item in batch], res)]
+        if getattr(res, "stop_reason", None) == "max_tokens":
+            # The estimate was too optimistic for these items; halve and try again.
+            mid = len(batch) // 2
+            logger.warning("Batch of %d items hit max_tokens, splitting", len(batch))
+            return events + await self.run_batch(batch[:mid]) + await self.run_batch(batch[mid:])
+        with timed("parse", self.timings):
+            answers = parse_batch_answer(extract_answer_text(res))
+        for kind, item in batch:
+            obj = answers.get(str(item["id"]))
+            if kind == "question" and question_answer_from(obj) is not None:
+                event = question_event(item, question_answer_from(obj), json.dumps(obj, ensure_ascii=False))
+            elif kind == "condition" and condition_result_from(obj) is not None:
+                event = condition_event(item, condition_result_from(obj), json.dumps(obj, ensure_ascii=False))
+            else:
+                logger.warning("No usable batched answer for %s %s, asking individually", kind, item["id"])
+                PARSE_FAILURES.labels("batch").inc()
+                events.extend(await self.run_item(kind, item))
+                continue
+            self.remember(kind, item, event)
+            events.append(event)
+        return events
+
+    def units(self, pairs: List[tuple]) -> List[List[tuple]]:
+        if self.batch:
+            return split_batches(pairs, self.config.max_output_tokens, self.batch_max_items)
+        return [[pair] for pair in pairs]
+
+    async def plan(self) -> List[tuple]:
+        """Ordered entries: ("ready", events) for reused results and cache hits, ("unit", pairs) for model work.
+
+        In input order, hits keep their position and batches do not span across them;
+        in completion order, all hits come first.
+        """
+        entries: List[tuple] = []
+        pending: List[tuple] = []
+
+        def flush():
+            entries.extend(("unit", unit) for unit in self.units(pending))
+            pending.clear()
+
+        cached = iter(await self.cached_events([(k, i) for k, i in self.items if i["id"] not in self.reuse]))
+        for kind, item in self.items:
+            event = self.reuse.get(item["id"]) or next(cached)
+            if event is None:
+                pending.append((kind, item))
+                continue
+            if self.order == "input":
+                flush()
+            entries.append(("ready", [event]))
+        flush()
+        return entries
+
+    def cancel(self):
+        """Abandon the run; a no-op once it has finished."""
+        if self.finished or self._queue is None:
+            return
+        for t in self._tasks:
+            t.cancel()
+        self._queue.put_nowait((CANCELLED, []))
+
+    async def events(self) -> AsyncIterator[dict]:
+        """_events() plus run-level metrics and the optional timings event."""
+        started = time.perf_counter()
+        first_result = None
+        ITEMS_PER_RUN.observe(len(self.items))
+        RUNS_IN_PROGRESS.inc()
+        inner = self._events()
+        try:
+            async for event in inner:
+                if first_result is None and event["type"] in RESULT_TYPES:
+                    first_result = time.perf_counter() - started
+                    TIME_TO_FIRST_RESULT.observe(first_result)
+                if event["type"] == "done" and self.report_timings:
+                    yield {
+                        "type": "timings",
+                        "total": round(time.perf_counter() - started, 3),
+                        "time_to_first_result": round(first_result, 3) if first_result is not None else None,
+                        "stages": {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+                    }
+                yield event
+        finally:
+            # Close the inner generator right away so its tasks are cancelled on disconnect.
+            await inner.aclose()
+            RUNS_IN_PROGRESS.dec()
+
+    async def _events(self) -> AsyncIterator[dict]:
+        if self.retrieval and await asyncio.to_thread(count_indexed_pages, self.file_ids) == 0:
+            logger.warning("No indexed page text for these files, sending whole documents")
+            self.retrieval = False
+        entries = await self.plan()
+        units = [unit for what, unit in entries if what == "unit"]
+        logger.info("Serving %d items from cache, %d items in %d units with concurrency %d (%s order)",
+                    len(entries) - len(units), sum(len(u) for u in units), len(units),
+                    self.concurrency, self.order)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        primed = asyncio.Event()
+        if not (len(units) > 1 and self.concurrency > 1 and self.config.prompt_cache and not self.retrieval):
+            primed.set()
+
+        # Finished units arrive as (unit index, events), partial events as (None, [event]).
+        queue: asyncio.Queue[tuple[int | None, List[dict]]] = asyncio.Queue()
+        self._queue = queue
+        emit = (lambda event: queue.put_nowait((None, [event]))) if self.stream_tokens else None
+        state = ["pending"] * len(units)
+
+        async def run_bounded(index: int, unit: List[tuple]):
+            if index > 0:
+                # Let the first call write the prompt cache before fanning out, otherwise
+                # every concurrent call pays for its own cache write.
+                await primed.wait()
+            async with semaphore:
+                state[index] = "running"
+                try:
+                    events = await self.run_batch(unit, emit)
+                except Exception as e:
+                    logger.exception("Failed to process %d items", len(unit))
+                    events = [{"type": "error", "id": item["id"], "message": str(e)} for _, item in unit]
+                finally:
+                    primed.set()
+            state[index] = "done"
+            queue.put_nowait((index, events))
+
+        tasks = [asyncio.create_task(run_bounded(i, unit)) for i, unit in enumerate(units)]
+        self._tasks = tasks
+        try:
+            if self.order == "completion":
+                for what, ready in entries:
+                    if what == "ready":
+                        for event in ready:
+                            yield event
+                remaining = len(units)
+                while remaining:
+                    index, events = await queue.get()
+                    if index == CANCELLED:
+                        return
+                    if index is not None:
+                        remaining -= 1
+                    for event in events:
+                        yield event
+            else:
+                finished: dict[int, List[dict]] = {}
+                next_unit = 0
+                for what, ready in entries:
+                    if what == "unit":
+                        while next_unit not in finished:
+                            index, events = await queue.get()
+                            if index == CANCELLED:
+                                return
+                            if index is None:
+                                for event in events:
+                                    yield event
+                            else:
+                                finished[index] = events
+                        ready = finished.pop(next_unit)
+                        next_unit += 1
+                    for event in ready:
+                        yield event
+            self.finished = True
+        finally:
+            for t in tasks:
+                t.cancel()
+            if not self.finished:
+                self.skipped = {
+                    "finished": len(self.items) - sum(len(u) for u, st in zip(units, state) if st != "done"),
+                    "cancelled_in_flight": sum(len(u) for u, st in zip(units, state) if st == "running"),
+                    "not_started": sum(len(u) for u, st in zip(units, state) if st == "pending"),
+                }
+                logger.warning("Run abandoned: %d items finished, %d cancelled in flight, %d never started",
+                               self.skipped["finished"], self.skipped["cancelled_in_flight"],
+                               self.skipped["not_started"])
+                for state_name in ("cancelled_in_flight", "not_started"):
+                    ABANDONED_ITEMS.labels(state_name).inc(self.skipped[state_name])
+        yield {"type": "done"}
+
+
+def checklist_item(item) -> dict:
+    """A question or condition with its id as a string; raises ValueError for anything else."""
+    if not isinstance(item, dict) or not isinstance(item.get("text"), str):
+        raise ValueError('Questions and conditions must be objects with "id" and "text"')
+    item_id = item.get("id")
+    if isinstance(item_id, bool) or not isinstance(item_id, (str, int)):
+        raise ValueError('Question and condition ids must be strings or integers')
+    return {**item, "id": str(item_id)}
+
+
+def positive_int_option(payload: dict, name: str) -> int | None:
+    """payload[name] if it is a positive integer, None if unset; raises ValueError otherwise."""
+    value = payload.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return value
+
+
+async def run_from_payload(client: AsyncAnthropicClient, config: Config, payload: dict,
+                           skip_ids: set | None = None) -> ChecklistRun:
+    """Validate an /ask style payload and build the run; raises ValueError on bad input.
+
+    Items whose id is in skip_ids are left out, e.g. when resuming a partially finished job.
+    """
+    questions: List[dict] = payload.get("questions") or []
+    conditions: List[dict] = payload.get("conditions") or []
+    file_ids: List[str] = payload.get("file_ids") or []
+
+    if not questions and not conditions:
+        raise ValueError("Provide at least one question or condition")
+    if not file_ids:
+        raise ValueError("Provide file IDs for processing")
+    questions = [checklist_item(q) for q in questions]
+    conditions = [checklist_item(c) for c in conditions]
+    if payload.get("mode") == "message_batch":
+        # Message batches send whole documents, one item per request, and deliver results at the end.
+        unsupported = [option for option in MESSAGE_BATCH_UNSUPPORTED if payload.get(option)]
+        if unsupported:
+            raise ValueError("Not supported for message batches: " + ", ".join(unsupported))
+
+    variant = payload.get("variant") or config.document_variant
+    if variant not in ("original", "normalized"):
+        raise ValueError("variant must be 'original' or 'normalized'")
+
+    logger.info("Fetching file paths for provided file IDs")
+    documents = await asyncio.to_thread(get_documents, file_ids, variant == "normalized")
+    if not documents:
+        raise ValueError("No valid files found for provided file_ids")
+
+    concurrency = min(positive_int_option(payload, "concurrency") or config.ask_concurrency, config.ask_concurrency)
+    order = payload.get("order") or "input"
+    if order not in ("input", "completion"):
+        raise ValueError("order must be 'input' or 'completion'")
+
+    tenant = payload.get("tenant") or DEFAULT_TENANT
+    if not isinstance(tenant, str):
+        raise ValueError("tenant must be a string")
+
+    batch_max_items = positive_int_option(payload, "batch_max_items")
+    top_k = positive_int_option(payload, "top_k")
+
+    beleg = payload.get("beleg")
+    if beleg is None or isinstance(beleg, bool):
+        # true/false are the original spellings of "full"/"none".
+        beleg = "none" if beleg is False else "full"
+    if beleg not in BELEG_MODES:
+        raise ValueError("beleg must be one of " + ", ".join(BELEG_MODES))
+
+    if skip_ids:
+        questions = [q for q in questions if q["id"] not in skip_ids]
+        conditions = [c for c in conditions if c["id"] not in skip_ids]
+
+    return ChecklistRun(
+        client,
+        config,
+        [(path, content_hash) for path, content_hash, _ in documents],
+        questions,
+        conditions,
+        concurrency=concurrency,
+        order=order,
+        batch=bool(payload.get("batch")),
+        batch_max_items=batch_max_items,
+        bypass_cache=bool(payload.get("bypass_cache")),
+        file_ids=file_ids,
+        retrieval=bool(payload.get("retrieval")),
+        top_k=top_k,
+        stream_tokens=bool(payload.get("stream_tokens")),
+        beleg=beleg,
+        tenant=tenant,
+        timings=bool(payload.get("timings")),
+        structured=bool(payload.get("structured", config.structured_output)),
+        variant=variant,
+        titles=[title for _, _, title in documents],
+    )
@@ -5,16 +5,72 @@ from dotenv import load_dotenv
 @dataclass(frozen=True)
 class Config:
     api_key: str
+    base_url: str
     model: str
     max_output_tokens: int
     temperature: float
+    file_id_ttl_seconds: float
+    ask_concurrency: int
+    ask_batch_max_items: int
+    prompt_cache: bool
+    answer_cache_ttl_seconds: float
+    answer_cache_max_bytes: int
+    upload_max_bytes: int
+    upload_max_request_bytes: int
+    ingest_workers: int
+    retrieval_top_k: int
+    job_workers: int
+    batch_poll_initial_seconds: float
+    batch_poll_max_seconds: float
+    upstream_concurrency: int
+    upstream_max_retries: int
+    structured_output: bool
+    question_max_tokens: int
+    condition_max_tokens: int
+    storage_max_bytes: int
+    remote_max_files: int
+    storage_sweep_seconds: float
+    storage_grace_seconds: float
+    document_variant: str
+    pdf_image_max_px: int
+    pdf_image_quality: int
+    pdf_max_part_pages: int
+    pdf_max_part_bytes: int
 
 
 def load_config() -> Config:
     load_dotenv()
     return Config(
         api_key=os.getenv("ANTHROPIC_API_KEY", ""),
+        base_url=os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com"),
         model=os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-latest"),
         max_output_tokens=int(os.getenv("ANTHROPIC_MAX_TOKENS", "1024")),
         temperature=float(os.getenv("ANTHROPIC_TEMP", "0")),
+        file_id_ttl_seconds=float(os.getenv("ANTHROPIC_FILE_ID_TTL", str(7 * 24 * 3600))),
+        ask_concurrency=int(os.getenv("ASK_CONCURRENCY", "4")),
+        ask_batch_max_items=int(os.getenv("ASK_BATCH_MAX_ITEMS", "20")),
+        prompt_cache=os.getenv("ANTHROPIC_PROMPT_CACHE", "1").lower() not in ("0", "false", "no"),
+        answer_cache_ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600))),
+        answer_cache_max_bytes=int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+        upload_max_bytes=int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024))),
+        upload_max_request_bytes=int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(1024 * 1024 * 1024))),
+        ingest_workers=int(os.getenv("INGEST_WORKERS", "2")),
+        retrieval_top_k=int(os.getenv("RETRIEVAL_TOP_K", "8")),
+        job_workers=int(os.getenv("JOB_WORKERS", "2")),
+        batch_poll_initial_seconds=float(os.getenv("BATCH_POLL_INITIAL", "10")),
+        batch_poll_max_seconds=float(os.getenv("BATCH_POLL_MAX", "300")),
+        upstream_concurrency=int(os.getenv("UPSTREAM_CONCURRENCY", "16")),
+        upstream_max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "6")),
+        structured_output=os.getenv("STRUCTURED_OUTPUT", "1").lower() not in ("0", "false", "no"),
+        question_max_tokens=int(os.getenv("QUESTION_MAX_TOKENS", "1024")),
+        condition_max_tokens=int(os.getenv("CONDITION_MAX_TOKENS", "256")),
+        storage_max_bytes=int(os.getenv("STORAGE_MAX_BYTES", "0")),
+        remote_max_files=int(os.getenv("REMOTE_MAX_FILES", "500")),
+        storage_sweep_seconds=float(os.getenv("STORAGE_SWEEP_SECONDS", "300")),
+        storage_grace_seconds=float(os.getenv("STORAGE_GRACE_SECONDS", "3600")),
+        document_variant=os.getenv("DOCUMENT_VARIANT", "original"),
+        pdf_image_max_px=int(os.getenv("PDF_IMAGE_MAX_PX", "0")),
+        pdf_image_quality=int(os.getenv("PDF_IMAGE_QUALITY", "75")),
+        pdf_max_part_pages=int(os.getenv("PDF_MAX_PART_PAGES", "100")),
+        pdf_max_part_bytes=int(os.getenv("PDF_MAX_PART_BYTES", str(30 * 1024 * 1024))),
     )
@@ -1,13 +1,43 @@
+import base64
+import hashlib
+import io
+import json
+import os
 import sqlite3
+import threading
+import time
 import uuid
 from pathlib import Path
-from typing import Iterable
+from typing import BinaryIO, Iterable
 
-DB_PATH = Path(__file__).parent / "files.db"
-FILES_DIR = Path(__file__).parent / "uploaded_files"
+# Defaults to the API directory; point API_DATA_DIR elsewhere for a throwaway instance (e.g. benchmarks).
+DATA_DIR = Path(os.getenv("API_DATA_DIR") or Path(__file__).parent)
+DB_PATH = DATA_DIR / "files.db"
+FILES_DIR = DATA_DIR / "uploaded_files"
 
 # Create uploads directory
-FILES_DIR.mkdir(exist_ok=True)
+FILES_DIR.mkdir(parents=True, exist_ok=True)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Per-connection tuning. In WAL mode synchronous=NORMAL only fsyncs at checkpoints: a
+# commit survives an application crash, though not necessarily a power loss.
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "32"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+SQLITE_BUSY_TIMEOUT_SECONDS = 10.0
+PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}",
+    f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+class EmptyFileError(ValueError):
+    pass
+
+class FileTooLargeError(ValueError):
+    pass
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS uploaded_files (
@@ -16,56 +46,747 @@ CREATE TABLE IF NOT EXISTS uploaded_files (
     file_path TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE TABLE IF NOT EXISTS remote_files (
+    content_hash TEXT NOT NULL,
+    workspace TEXT NOT NULL,
+    remote_file_id TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (content_hash, workspace)
+);
+CREATE TABLE IF NOT EXISTS answer_cache (
+    cache_key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answer_cache_last_access ON answer_cache (last_access);
+CREATE VIRTUAL TABLE IF NOT EXISTS file_pages USING fts5(
+    text,
+    file_id UNINDEXED,
+    page_no UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS file_variants (
+    file_id TEXT NOT NULL,
+    part_no INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    first_page INTEGER NOT NULL,
+    last_page INTEGER NOT NULL,
+    PRIMARY KEY (file_id, part_no)
+);
+CREATE TABLE IF NOT EXISTS checklist_runs (
+    id TEXT PRIMARY KEY,
+    checklist_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    parent_id TEXT,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    content_hashes TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checklist_run_results (
+    run_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    event TEXT NOT NULL,
+    PRIMARY KEY (run_id, item_id)
+);
 """
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA journal_mode=WAL;")
+_local = threading.local()
+
+def get_conn() -> sqlite3.Connection:
+    """The calling thread's connection, opened and tuned on first use.
+
+    Use it as `with get_conn() as c:` for a transaction; the connection stays open for
+    the next call from the same thread. A forked child (process pool) opens its own.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _local.conn, _local.pid = conn, os.getpid()
     return conn
 
+def _ensure_column(conn, table: str, column: str, decl: str):
+    cols = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
 with get_conn() as c:
+    # Persistent in the database file, so once is enough.
+    c.execute("PRAGMA journal_mode=WAL")
     c.executescript(SCHEMA)
+    _ensure_column(c, "uploaded_files", "content_hash", "TEXT")
+    _ensure_column(c, "uploaded_files", "page_count", "INTEGER")
+    _ensure_column(c, "uploaded_files", "text_indexed_at", "REAL")
+    _ensure_column(c, "uploaded_files", "size_bytes", "INTEGER")
+    _ensure_column(c, "uploaded_files", "last_access", "REAL")
+    _ensure_column(c, "remote_files", "last_access", "REAL")
+    _ensure_column(c, "uploaded_files", "has_text_layer", "INTEGER")
+    _ensure_column(c, "uploaded_files", "normalized_at", "REAL")
+    _ensure_column(c, "uploaded_files", "normalized_bytes", "INTEGER")
+    _ensure_column(c, "uploaded_files", "normalized_parts", "INTEGER")
+    c.execute(
+        "UPDATE uploaded_files SET last_access = CAST(strftime('%s', created_at) AS REAL) WHERE last_access IS NULL"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_files_created_at ON uploaded_files (created_at, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_files_content_hash ON uploaded_files (content_hash)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_files_last_access ON uploaded_files (last_access)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_checklist_runs_checklist ON checklist_runs (checklist_id, version)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_file_variants_content_hash ON file_variants (content_hash)")
+
+def hash_file(path: str) -> str:
+    """Return the SHA-256 hex digest of a file on disk, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def workspace_key(api_key: str, base_url: str) -> str:
+    """Stable, non-reversible identifier for the workspace behind an API key on one server."""
+    return hashlib.sha256(f"{base_url}|{api_key}".encode()).hexdigest()[:16]
+
+def _find_by_hash(c, content_hash: str) -> str | None:
+    cur = c.execute(
+        "SELECT id, file_path FROM uploaded_files WHERE content_hash = ? ORDER BY created_at ASC",
+        (content_hash,),
+    )
+    for fid, path in cur.fetchall():
+        if Path(path).exists():
+            return fid
+    return None
 
-def insert_file(filename: str, content: bytes) -> str:
-    """Store file on disk and return generated ID."""
+def insert_file(filename: str, content: bytes | BinaryIO, max_bytes: int | None = None) -> tuple[str, bool, float]:
+    """Stream file to disk and return (ID, created, last_access); identical content reuses the existing ID.
+
+    Content is copied in fixed-size chunks and hashed on the way, so memory use does
+    not depend on the file size. The duplicate check and the insert share one write
+    transaction, so concurrent uploads of the same content end up with one row. Raises
+    EmptyFileError or FileTooLargeError (as soon as the limit is crossed) and leaves
+    nothing behind in that case.
+    """
+    src = io.BytesIO(content) if isinstance(content, (bytes, bytearray)) else content
     file_id = str(uuid.uuid4())
     file_extension = Path(filename).suffix
     disk_filename = f"{file_id}{file_extension}"
     file_path = FILES_DIR / disk_filename
-    
+    tmp_path = FILES_DIR / f".{file_id}.part"
+
     # Write to disk
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    # Store metadata in DB
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise FileTooLargeError(f"{filename} exceeds {max_bytes} bytes")
+                h.update(chunk)
+                f.write(chunk)
+        if size == 0:
+            raise EmptyFileError(f"Empty file: {filename}")
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    content_hash = h.hexdigest()
+    try:
+        accessed_at = time.time()
+        with get_conn() as c:
+            c.execute("BEGIN IMMEDIATE")
+            existing = _find_by_hash(c, content_hash)
+            if existing:
+                c.execute("UPDATE uploaded_files SET last_access = ? WHERE id = ?", (accessed_at, existing))
+            else:
+                os.replace(tmp_path, file_path)
+                c.execute(
+                    "INSERT INTO uploaded_files (id, filename, file_path, content_hash, size_bytes, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_id, filename, str(file_path), content_hash, size, accessed_at),
+                )
+    except BaseException:
+        file_path.unlink(missing_ok=True)
+        raise
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    if existing:
+        return existing, False, accessed_at
+    return file_id, True, accessed_at
+
+def encode_cursor(created_at: str, file_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, file_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce."""
+    try:
+        created_at, file_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(file_id, str):
+        raise ValueError("Invalid cursor")
+    return created_at, file_id
+
+def list_files(limit: int = 100, cursor: str | None = None, filename: str | None = None,
+               content_hash: str | None = None, created_after: str | None = None,
+               created_before: str | None = None) -> tuple[list[dict], str | None]:
+    """One page of files, newest first, and the cursor of the next page (None on the last).
+
+    Keyset pagination over (created_at, id), so every page costs the same however deep
+    it is. filename matches a case-insensitive substring; created_after/created_before
+    compare against created_at ("YYYY-MM-DD HH:MM:SS", UTC).
+    """
+    where, params = [], []
+    if cursor:
+        where.append("(created_at, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    if filename:
+        escaped = filename.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where.append("filename LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+    if content_hash:
+        where.append("content_hash = ?")
+        params.append(content_hash)
+    if created_after:
+        where.append("created_at >= ?")
+        params.append(created_after.replace("T", " "))
+    if created_before:
+        where.append("created_at < ?")
+        params.append(created_before.replace("T", " "))
+    sql = ("SELECT id, filename, created_at, page_count, size_bytes, has_text_layer, normalized_bytes, "
+           "normalized_parts FROM uploaded_files")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    with get_conn() as c:
+        rows = c.execute(sql, [*params, limit + 1]).fetchall()
+    keys = ("id", "filename", "created_at", "page_count", "size_bytes", "has_text_layer", "normalized_bytes",
+            "normalized_parts")
+    files = [dict(zip(keys, row)) for row in rows[:limit]]
+    for f in files:
+        if f["has_text_layer"] is not None:
+            f["has_text_layer"] = bool(f["has_text_layer"])
+    next_cursor = encode_cursor(files[-1]["created_at"], files[-1]["id"]) if len(rows) > limit else None
+    return files, next_cursor
+
+def get_files_by_ids(file_ids: list[str]) -> list[tuple[str, str]]:
+    """Return (file_path, content_hash) for specific file IDs, backfilling missing hashes.
+
+    Counts as an access for the storage LRU. Missing hashes are computed outside any
+    transaction, so reading a whole file never holds the write lock.
+    """
+    if not file_ids:
+        return []
+
+    placeholders = ",".join(["?" for _ in file_ids])
+    with get_conn() as c:
+        c.execute(f"UPDATE uploaded_files SET last_access = ? WHERE id IN ({placeholders})", [time.time(), *file_ids])
+        rows = c.execute(
+            f"SELECT id, file_path, content_hash FROM uploaded_files WHERE id IN ({placeholders}) ORDER BY id ASC",
+            file_ids
+        ).fetchall()
+    out, backfilled = [], []
+    for fid, path, content_hash in rows:
+        if content_hash is None and Path(path).exists():
+            content_hash = hash_file(path)
+            backfilled.append((content_hash, fid))
+        out.append((path, content_hash))
+    if backfilled:
+        with get_conn() as c:
+            c.executemany("UPDATE uploaded_files SET content_hash = ? WHERE id = ?", backfilled)
+    return out
+
+def get_documents(file_ids: list[str], normalized: bool) -> list[tuple[str, str, str | None]]:
+    """(file_path, content_hash, title) of the documents to send for the given files.
+
+    With normalized, files with a normalized variant are replaced by its parts; the
+    parts of a split file are titled with the file name and their page range.
+    """
+    files = get_files_by_ids(file_ids)
+    if not files or not normalized:
+        return [(path, content_hash, None) for path, content_hash in files]
+    placeholders = ",".join(["?" for _ in file_ids])
+    with get_conn() as c:
+        rows = c.execute(
+            f"""
+            SELECT u.file_path, u.filename, u.normalized_parts, v.file_path, v.content_hash, v.first_page, v.last_page
+            FROM file_variants v JOIN uploaded_files u ON u.id = v.file_id
+            WHERE v.file_id IN ({placeholders}) ORDER BY v.file_id, v.part_no
+            """,
+            file_ids,
+        ).fetchall()
+    parts: dict[str, list] = {}
+    for original, filename, count, path, content_hash, first, last in rows:
+        title = f"{filename} (Seiten {first}-{last})" if count > 1 else None
+        parts.setdefault(original, []).append((path, content_hash, title))
+    return [doc for path, content_hash in files for doc in parts.get(path, [(path, content_hash, None)])]
+
+def get_remote_file_id(content_hash: str, workspace: str) -> str | None:
+    """Return the cached remote file ID for this content in this workspace, if not expired."""
+    now = time.time()
+    with get_conn() as c:
+        cur = c.execute(
+            "SELECT remote_file_id FROM remote_files WHERE content_hash = ? AND workspace = ? AND expires_at > ?",
+            (content_hash, workspace, now),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        c.execute("UPDATE remote_files SET last_access = ? WHERE content_hash = ? AND workspace = ?",
+                  (now, content_hash, workspace))
+        return row[0]
+
+def set_remote_file_id(content_hash: str, workspace: str, remote_file_id: str, ttl_seconds: float):
+    """Remember the remote file ID for this content in this workspace."""
     with get_conn() as c:
+        now = time.time()
         c.execute(
-            "INSERT INTO uploaded_files (id, filename, file_path) VALUES (?, ?, ?)",
-            (file_id, filename, str(file_path)),
+            "INSERT OR REPLACE INTO remote_files (content_hash, workspace, remote_file_id, expires_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (content_hash, workspace, remote_file_id, now + ttl_seconds, now),
         )
-    return file_id
 
-def fetch_all_files() -> list[tuple[str, str, str]]:
-    """Return (id, filename, file_path) for all files."""
+def forget_remote_file_ids(content_hashes: Iterable[str], workspace: str):
+    """Drop cached remote file IDs, e.g. after the remote copy turned out to be gone."""
     with get_conn() as c:
-        cur = c.execute("SELECT id, filename, file_path FROM uploaded_files ORDER BY id ASC")
-        return cur.fetchall()
+        c.executemany(
+            "DELETE FROM remote_files WHERE content_hash = ? AND workspace = ?",
+            [(h, workspace) for h in content_hashes],
+        )
 
-def get_file_paths() -> list[str]:
-    """Return list of file paths on disk for all uploaded files."""
+def stored_bytes() -> int:
+    """Total size of the stored uploads and their variants, measuring files recorded before sizes were tracked."""
     with get_conn() as c:
-        cur = c.execute("SELECT file_path FROM uploaded_files ORDER BY id ASC")
+        unknown = c.execute("SELECT id, file_path FROM uploaded_files WHERE size_bytes IS NULL").fetchall()
+        c.executemany(
+            "UPDATE uploaded_files SET size_bytes = ? WHERE id = ?",
+            [(os.path.getsize(path) if os.path.exists(path) else 0, fid) for fid, path in unknown],
+        )
+        return c.execute(
+            "SELECT COALESCE(SUM(size_bytes + COALESCE(normalized_bytes, 0)), 0) FROM uploaded_files"
+        ).fetchone()[0]
+
+def least_recently_used_files(limit: int, accessed_before: float,
+                              exclude_ids: Iterable[str] = ()) -> list[tuple[str, str, int]]:
+    """(id, file_path, size in bytes incl. variants) of the files not accessed since accessed_before, oldest first."""
+    exclude = list(exclude_ids)
+    sql = ("SELECT id, file_path, COALESCE(size_bytes, 0) + COALESCE(normalized_bytes, 0) FROM uploaded_files "
+           "WHERE last_access < ?")
+    if exclude:
+        sql += f" AND id NOT IN ({','.join(['?' for _ in exclude])})"
+    sql += " ORDER BY last_access ASC LIMIT ?"
+    with get_conn() as c:
+        return c.execute(sql, [accessed_before, *exclude, limit]).fetchall()
+
+def delete_files(file_ids: list[str], accessed_before: float) -> list[str]:
+    """Remove files from the database (rows, variants, page index) and return their paths; unlinking is up to the caller.
+
+    Files accessed since accessed_before, e.g. by an upload of the same content in the
+    meantime, are kept.
+    """
+    if not file_ids:
+        return []
+    placeholders = ",".join(["?" for _ in file_ids])
+    with get_conn() as c:
+        rows = c.execute(
+            f"SELECT id, file_path FROM uploaded_files WHERE id IN ({placeholders}) AND last_access < ?",
+            [*file_ids, accessed_before],
+        ).fetchall()
+        return _delete_file_rows(c, rows)
+
+def discard_new_files(files: list[tuple[str, float]]) -> list[str]:
+    """Undo insert_file for (ID, last_access) pairs it returned; returns the paths to unlink.
+
+    A file whose last_access has changed since, i.e. that an upload of the same content
+    has been given in the meantime, is kept.
+    """
+    with get_conn() as c:
+        rows = [
+            row for file_id, accessed_at in files
+            for row in c.execute(
+                "SELECT id, file_path FROM uploaded_files WHERE id = ? AND last_access = ?", (file_id, accessed_at)
+            )
+        ]
+        return _delete_file_rows(c, rows)
+
+def _delete_file_rows(c, rows: list[tuple[str, str]]) -> list[str]:
+    """Delete (id, file_path) rows with their variants and page index; returns all their paths."""
+    ids = [row[0] for row in rows]
+    placeholders = ",".join(["?" for _ in ids])
+    variants = [row[0] for row in c.execute(
+        f"SELECT file_path FROM file_variants WHERE file_id IN ({placeholders})", ids
+    )]
+    c.execute(f"DELETE FROM file_variants WHERE file_id IN ({placeholders})", ids)
+    c.execute(f"DELETE FROM file_pages WHERE file_id IN ({placeholders})", ids)
+    c.execute(f"DELETE FROM uploaded_files WHERE id IN ({placeholders})", ids)
+    return [row[1] for row in rows] + variants
+
+def existing_file_ids(file_ids: list[str]) -> set[str]:
+    if not file_ids:
+        return set()
+    placeholders = ",".join(["?" for _ in file_ids])
+    with get_conn() as c:
+        return {row[0] for row in c.execute(f"SELECT id FROM uploaded_files WHERE id IN ({placeholders})", file_ids)}
+
+def unfinished_job_file_ids() -> set[str]:
+    """File IDs referenced by queued or running jobs."""
+    with get_conn() as c:
+        rows = c.execute("SELECT payload FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+    return {fid for (payload,) in rows for fid in json.loads(payload).get("file_ids") or []}
+
+def count_remote_files(workspace: str) -> int:
+    with get_conn() as c:
+        return c.execute("SELECT COUNT(*) FROM remote_files WHERE workspace = ?", (workspace,)).fetchone()[0]
+
+def unfinished_batch_content_hashes() -> set[str]:
+    """Content hashes (originals and variants) of the files of queued or running message batch jobs.
+
+    Their remote copies are referenced by a batch that may still be processed upstream.
+    """
+    with get_conn() as c:
+        rows = c.execute("SELECT payload FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        file_ids = list({
+            fid for (payload,) in rows if (job := json.loads(payload)).get("mode") == "message_batch"
+            for fid in job.get("file_ids") or []
+        })
+        if not file_ids:
+            return set()
+        placeholders = ",".join(["?" for _ in file_ids])
+        hashes = {row[0] for row in c.execute(
+            f"SELECT content_hash FROM uploaded_files WHERE id IN ({placeholders}) AND content_hash IS NOT NULL",
+            file_ids,
+        )}
+        hashes.update(row[0] for row in c.execute(
+            f"SELECT content_hash FROM file_variants WHERE file_id IN ({placeholders})", file_ids
+        ))
+    return hashes
+
+def _excluding_hashes(exclude: list[str]) -> str:
+    return f" AND content_hash NOT IN ({','.join(['?' for _ in exclude])})" if exclude else ""
+
+def stale_remote_files(workspace: str, limit: int, exclude_hashes: Iterable[str] = ()) -> list[str]:
+    """Remote file IDs that are expired here or whose content (original or variant) is no longer stored locally."""
+    exclude = list(exclude_hashes)
+    with get_conn() as c:
+        cur = c.execute(
+            """
+            SELECT remote_file_id FROM remote_files
+            WHERE workspace = ? AND (
+                expires_at <= ?
+                OR (content_hash NOT IN (SELECT content_hash FROM uploaded_files WHERE content_hash IS NOT NULL)
+                    AND content_hash NOT IN (SELECT content_hash FROM file_variants))
+            )"""
+            + _excluding_hashes(exclude)
+            + " LIMIT ?",
+            (workspace, time.time(), *exclude, limit),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+def least_recently_used_remote_files(workspace: str, limit: int, accessed_before: float,
+                                     exclude_hashes: Iterable[str] = ()) -> list[str]:
+    exclude = list(exclude_hashes)
+    with get_conn() as c:
+        cur = c.execute(
+            "SELECT remote_file_id FROM remote_files WHERE workspace = ? AND COALESCE(last_access, 0) < ?"
+            + _excluding_hashes(exclude)
+            + " ORDER BY COALESCE(last_access, 0) ASC LIMIT ?",
+            (workspace, accessed_before, *exclude, limit),
+        )
         return [row[0] for row in cur.fetchall()]
 
-def get_file_paths_by_ids(file_ids: list[str]) -> list[str]:
-    """Return list of file paths on disk for specific file IDs."""
+def forget_remote_files(workspace: str, remote_file_ids: list[str]):
+    """Drop cache rows by remote file ID, after the remote copies have been deleted."""
+    with get_conn() as c:
+        c.executemany(
+            "DELETE FROM remote_files WHERE workspace = ? AND remote_file_id = ?",
+            [(workspace, fid) for fid in remote_file_ids],
+        )
+
+def answer_cache_key(content_hashes: Iterable[str], item_type: str, text: str, model: str,
+                     temperature: float, prompt_version: str) -> str:
+    """Key for a cached answer: same documents, same (normalized) item and same model settings."""
+    normalized = " ".join(text.split()).lower()
+    parts = [",".join(sorted(content_hashes)), item_type, normalized, model, repr(float(temperature)), prompt_version]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+def get_cached_answers(cache_keys: list[str], ttl_seconds: float) -> dict[str, dict]:
+    """Cached results younger than ttl_seconds, as {key: result} for the hits.
+
+    Looked up in one transaction; expired entries are deleted and hits move to the front
+    of the LRU.
+    """
+    if not cache_keys:
+        return {}
+    now = time.time()
+    placeholders = ",".join(["?" for _ in cache_keys])
+    with get_conn() as c:
+        rows = c.execute(
+            f"SELECT cache_key, result, created_at FROM answer_cache WHERE cache_key IN ({placeholders})", cache_keys
+        ).fetchall()
+        expired = [(key,) for key, _, created_at in rows if created_at + ttl_seconds <= now]
+        hits = {key: json.loads(result) for key, result, created_at in rows if created_at + ttl_seconds > now}
+        c.executemany("DELETE FROM answer_cache WHERE cache_key = ?", expired)
+        c.executemany("UPDATE answer_cache SET last_access = ? WHERE cache_key = ?", [(now, key) for key in hits])
+    return hits
+
+def put_cached_answer(cache_key: str, result: dict, max_bytes: int):
+    """Store a result and evict least recently used entries while the cache exceeds max_bytes."""
+    now = time.time()
+    data = json.dumps(result, ensure_ascii=False)
+    with get_conn() as c:
+        c.execute(
+            "INSERT OR REPLACE INTO answer_cache (cache_key, result, size_bytes, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (cache_key, data, len(data.encode()), now, now),
+        )
+        total = c.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM answer_cache").fetchone()[0]
+        while total > max_bytes:
+            victims = c.execute(
+                "SELECT cache_key, size_bytes FROM answer_cache ORDER BY last_access ASC LIMIT 100"
+            ).fetchall()
+            if not victims:
+                break
+            for key, size in victims:
+                c.execute("DELETE FROM answer_cache WHERE cache_key = ?", (key,))
+                total -= size
+                if total <= max_bytes:
+                    break
+
+def get_file_path(file_id: str) -> str | None:
+    with get_conn() as c:
+        row = c.execute("SELECT file_path FROM uploaded_files WHERE id = ?", (file_id,)).fetchone()
+        return row[0] if row else None
+
+def get_file_stats(file_id: str) -> dict | None:
+    with get_conn() as c:
+        row = c.execute(
+            "SELECT size_bytes, page_count, has_text_layer FROM uploaded_files WHERE id = ?", (file_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    size, pages, has_text = row
+    return {"size_bytes": size, "page_count": pages, "has_text_layer": None if has_text is None else bool(has_text)}
+
+def store_file_stats(file_id: str, page_count: int, has_text_layer: bool):
+    with get_conn() as c:
+        c.execute(
+            "UPDATE uploaded_files SET page_count = ?, has_text_layer = ? WHERE id = ?",
+            (page_count, int(has_text_layer), file_id),
+        )
+
+def is_normalized(file_id: str) -> bool:
+    with get_conn() as c:
+        row = c.execute("SELECT normalized_at FROM uploaded_files WHERE id = ?", (file_id,)).fetchone()
+        return bool(row and row[0])
+
+def store_variants(file_id: str, parts: list[dict]):
+    """Replace the normalized variant of a file; no parts means the original is sent as is."""
+    with get_conn() as c:
+        c.execute("DELETE FROM file_variants WHERE file_id = ?", (file_id,))
+        c.executemany(
+            "INSERT INTO file_variants (file_id, part_no, file_path, content_hash, size_bytes, first_page, last_page) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(file_id, no, p["path"], p["content_hash"], p["size_bytes"], p["first_page"], p["last_page"])
+             for no, p in enumerate(parts, start=1)],
+        )
+        c.execute(
+            "UPDATE uploaded_files SET normalized_at = ?, normalized_bytes = ?, normalized_parts = ? WHERE id = ?",
+            (time.time(), sum(p["size_bytes"] for p in parts) if parts else None, len(parts), file_id),
+        )
+
+def is_text_indexed(file_id: str) -> bool:
+    with get_conn() as c:
+        row = c.execute("SELECT text_indexed_at FROM uploaded_files WHERE id = ?", (file_id,)).fetchone()
+        return bool(row and row[0])
+
+def store_pages(file_id: str, pages: list[str]):
+    """Replace the page text index of a file; pages[0] is page 1."""
+    with get_conn() as c:
+        c.execute("DELETE FROM file_pages WHERE file_id = ?", (file_id,))
+        c.executemany(
+            "INSERT INTO file_pages (text, file_id, page_no) VALUES (?, ?, ?)",
+            [(text, file_id, no) for no, text in enumerate(pages, start=1) if text.strip()],
+        )
+        c.execute(
+            "UPDATE uploaded_files SET page_count = ?, has_text_layer = ?, text_indexed_at = ? WHERE id = ?",
+            (len(pages), int(any(text.strip() for text in pages)), time.time(), file_id),
+        )
+
+def count_indexed_pages(file_ids: list[str]) -> int:
+    """Number of pages with extracted text across the given files."""
+    if not file_ids:
+        return 0
+    placeholders = ",".join(["?" for _ in file_ids])
+    with get_conn() as c:
+        return c.execute(
+            f"SELECT COUNT(*) FROM file_pages WHERE file_id IN ({placeholders})", file_ids
+        ).fetchone()[0]
+
+def get_content_hashes(file_ids: list[str]) -> dict[str, str]:
+    """{file ID: content hash} for the given files that exist and have a hash."""
     if not file_ids:
+        return {}
+    placeholders = ",".join(["?" for _ in file_ids])
+    with get_conn() as c:
+        cur = c.execute(
+            f"SELECT id, content_hash FROM uploaded_files WHERE id IN ({placeholders}) AND content_hash IS NOT NULL",
+            file_ids,
+        )
+        return dict(cur.fetchall())
+
+def search_pages(file_ids: list[str], fts_query: str, limit: int) -> list[tuple[str, str, int, str]]:
+    """Return the best matching (file_id, filename, page_no, text) by BM25 within the given files."""
+    if not file_ids or not fts_query:
         return []
-    
     placeholders = ",".join(["?" for _ in file_ids])
     with get_conn() as c:
         cur = c.execute(
-            f"SELECT file_path FROM uploaded_files WHERE id IN ({placeholders}) ORDER BY id ASC",
-            file_ids
+            f"""
+            SELECT p.file_id, u.filename, p.page_no, p.text
+            FROM file_pages p JOIN uploaded_files u ON u.id = p.file_id
+            WHERE file_pages MATCH ? AND p.file_id IN ({placeholders})
+            ORDER BY bm25(file_pages) LIMIT ?
+            """,
+            [fts_query, *file_ids, limit],
+        )
+        return cur.fetchall()
+
+def create_job(payload: dict, total: int) -> str:
+    job_id = str(uuid.uuid4())
+    now = time.time()
+    with get_conn() as c:
+        c.execute(
+            "INSERT INTO jobs (id, status, payload, total, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, json.dumps(payload, ensure_ascii=False), total, now, now),
+        )
+    return job_id
+
+def set_job_status(job_id: str, status: str, error: str | None = None):
+    with get_conn() as c:
+        c.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id),
         )
+
+def get_job(job_id: str) -> dict | None:
+    with get_conn() as c:
+        row = c.execute(
+            "SELECT id, status, payload, total, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    keys = ("id", "status", "payload", "total", "error", "created_at", "updated_at")
+    job = dict(zip(keys, row))
+    job["payload"] = json.loads(job["payload"])
+    return job
+
+def list_unfinished_job_ids() -> list[str]:
+    with get_conn() as c:
+        cur = c.execute("SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at ASC")
         return [row[0] for row in cur.fetchall()]
+
+def append_job_event(job_id: str, event: dict) -> int:
+    """Persist the next event of a job and return its sequence number (0-based)."""
+    with get_conn() as c:
+        seq = c.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        c.execute(
+            "INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+            (job_id, seq, json.dumps(event, ensure_ascii=False)),
+        )
+        c.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+    return seq
+
+def get_job_events(job_id: str, offset: int = 0) -> list[tuple[int, dict]]:
+    """Return (seq, event) for all events of a job with seq >= offset."""
+    with get_conn() as c:
+        cur = c.execute(
+            "SELECT seq, event FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq ASC", (job_id, offset)
+        )
+        return [(seq, json.loads(event)) for seq, event in cur.fetchall()]
+
+def create_checklist_run(payload: dict, content_hashes: list[str], parent_id: str | None = None) -> dict:
+    """Store a new run; a run with a parent becomes the next version of the parent's checklist."""
+    run_id = str(uuid.uuid4())
+    now = time.time()
+    with get_conn() as c:
+        checklist_id, version = run_id, 1
+        if parent_id is not None:
+            row = c.execute("SELECT checklist_id FROM checklist_runs WHERE id = ?", (parent_id,)).fetchone()
+            if row is None:
+                raise KeyError(parent_id)
+            checklist_id = row[0]
+            version = c.execute(
+                "SELECT MAX(version) + 1 FROM checklist_runs WHERE checklist_id = ?", (checklist_id,)
+            ).fetchone()[0]
+        c.execute(
+            "INSERT INTO checklist_runs (id, checklist_id, version, parent_id, status, payload, content_hashes, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, 'running', ?, ?, ?, ?)",
+            (run_id, checklist_id, version, parent_id, json.dumps(payload, ensure_ascii=False),
+             json.dumps(sorted(content_hashes)), now, now),
+        )
+    return {"id": run_id, "checklist_id": checklist_id, "version": version, "parent_id": parent_id}
+
+def get_checklist_run(run_id: str) -> dict | None:
+    with get_conn() as c:
+        row = c.execute(
+            "SELECT id, checklist_id, version, parent_id, status, payload, content_hashes, created_at, updated_at "
+            "FROM checklist_runs WHERE id = ?",
+            (run_id,),
+        ).fetchone()
+    if row is None:
+        return None
+    keys = ("id", "checklist_id", "version", "parent_id", "status", "payload", "content_hashes",
+            "created_at", "updated_at")
+    run = dict(zip(keys, row))
+    run["payload"] = json.loads(run["payload"])
+    run["content_hashes"] = json.loads(run["content_hashes"])
+    return run
+
+def list_checklist_versions(checklist_id: str) -> list[dict]:
+    with get_conn() as c:
+        cur = c.execute(
+            "SELECT id, version, parent_id, status, created_at FROM checklist_runs "
+            "WHERE checklist_id = ? ORDER BY version ASC",
+            (checklist_id,),
+        )
+        return [dict(zip(("id", "version", "parent_id", "status", "created_at"), row)) for row in cur.fetchall()]
+
+def set_checklist_run_status(run_id: str, status: str):
+    with get_conn() as c:
+        c.execute("UPDATE checklist_runs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), run_id))
+
+def put_run_result(run_id: str, item_id: str, kind: str, item_key: str, event: dict):
+    with get_conn() as c:
+        c.execute(
+            "INSERT OR REPLACE INTO checklist_run_results (run_id, item_id, kind, item_key, event) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (run_id, item_id, kind, item_key, json.dumps(event, ensure_ascii=False)),
+        )
+
+def get_run_results(run_id: str) -> dict[str, tuple[str, str, dict]]:
+    """{item ID: (kind, item key, result event)} of a run."""
+    with get_conn() as c:
+        cur = c.execute("SELECT item_id, kind, item_key, event FROM checklist_run_results WHERE run_id = ?", (run_id,))
+        return {item_id: (kind, key, json.loads(event)) for item_id, kind, key, event in cur.fetchall()}
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+from concurrent.futures import Executor
+from pathlib import Path
+
+from config import Config
+from database import (
+    get_file_path,
+    get_file_stats,
+    is_normalized,
+    is_text_indexed,
+    store_file_stats,
+    store_pages,
+    store_variants,
+)
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Frequent German (and a few English) words that only add noise to a BM25 query.
+STOPWORDS = {
+    "der", "die", "das", "den", "dem", "des", "ein", "eine", "einer", "eines", "einem", "einen",
+    "und", "oder", "aber", "ist", "sind", "wird", "werden", "wurde", "sein", "hat", "haben",
+    "mit", "von", "vom", "für", "auf", "aus", "bei", "bis", "zum", "zur", "nach", "über", "unter",
+    "als", "auch", "nicht", "kein", "keine", "wie", "was", "wer", "wann", "welche", "welcher",
+    "welches", "gibt", "sich", "dass", "durch", "noch", "nur", "the", "and", "what", "when", "which",
+}
+
+# A normalized variant is only kept if it is at least this much smaller than the original.
+MIN_SAVING = 0.05
+
+
+def extract_pages(path: str) -> list[str]:
+    """Text of every page of a PDF. Runs in a worker process."""
+    from pypdf import PdfReader
+
+    # pypdf logs a warning for every malformed xref entry, which scanned tenders are full of.
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    reader = PdfReader(path)
+    pages = []
+    for page in reader.pages:
+        try:
+            pages.append(page.extract_text() or "")
+        except Exception:
+            pages.append("")
+    return pages
+
+
+def inspect_pdf(path: str) -> dict:
+    """Page count and whether any page has fonts (a text layer), without extracting text. Runs in a worker process."""
+    from pypdf import PdfReader
+
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    reader = PdfReader(path)
+    has_text_layer = False
+    for page in reader.pages:
+        resources = page.get("/Resources")
+        if resources is not None and resources.get_object().get("/Font"):
+            has_text_layer = True
+            break
+    return {"page_count": len(reader.pages), "has_text_layer": has_text_layer}
+
+
+def downsample_images(writer, max_px: int, quality: int) -> int:
+    """Re-encode embedded images larger than max_px on their long side as JPEG; returns how many."""
+    count = 0
+    for page in writer.pages:
+        for image in page.images:
+            try:
+                img = image.image
+                # Bilevel scans are smaller as CCITT/JBIG2 than any JPEG.
+                if img is None or img.mode == "1" or max(img.size) <= max_px:
+                    continue
+                img.thumbnail((max_px, max_px))
+                if img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                image.replace(img, quality=quality)
+                count += 1
+            except Exception as e:
+                logger.debug("Skipping image %s: %s", image.name, e)
+    return count
+
+
+def _pdf_bytes(writer) -> bytes:
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+def _split(writer, start: int, end: int, max_pages: int, max_bytes: int) -> list[tuple[int, int, bytes]]:
+    """(first page, last page, PDF bytes) of parts of pages [start, end) within the limits; 1-based pages."""
+    from pypdf import PdfWriter
+
+    parts = []
+    for part_start in range(start, end, max_pages):
+        part_end = min(part_start + max_pages, end)
+        part = PdfWriter()
+        for i in range(part_start, part_end):
+            part.add_page(writer.pages[i])
+        part.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+        data = _pdf_bytes(part)
+        if len(data) > max_bytes and part_end - part_start > 1:
+            mid = (part_end - part_start + 1) // 2
+            parts.extend(_split(writer, part_start, part_end, mid, max_bytes))
+        else:
+            parts.append((part_start + 1, part_end, data))
+    return parts
+
+
+def normalize_pdf(path: str, out_prefix: str, image_max_px: int, image_quality: int,
+                  max_part_pages: int, max_part_bytes: int) -> list[dict]:
+    """Write a cheaper variant of a PDF next to it, split into page ranges if needed. Runs in a worker process.
+
+    Content streams are compressed, identical objects (fonts and images repeated on
+    every page) merged and, with image_max_px, larger embedded images downsampled.
+    Pages are kept, so page numbers still match the original. Variants with more than
+    max_part_pages pages or max_part_bytes bytes are split into parts, written as
+    <out_prefix>.n<part>.pdf. Returns the parts as {"path", "content_hash", "size_bytes",
+    "first_page", "last_page"}, or [] if the original is better sent as is (no split
+    needed and less than MIN_SAVING smaller).
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    writer = PdfWriter(clone_from=PdfReader(path))
+    if image_max_px:
+        downsample_images(writer, image_max_px, image_quality)
+    for page in writer.pages:
+        page.compress_content_streams()
+    writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+    data = _pdf_bytes(writer)
+    page_count = len(writer.pages)
+    if page_count <= max_part_pages and len(data) <= max_part_bytes:
+        if len(data) > os.path.getsize(path) * (1 - MIN_SAVING):
+            return []
+        chunks = [(1, page_count, data)]
+    else:
+        chunks = _split(writer, 0, page_count, max_part_pages, max_part_bytes)
+
+    parts = []
+    directory, name = os.path.split(out_prefix)
+    for no, (first, last, chunk) in enumerate(chunks, start=1):
+        part_path = os.path.join(directory, f"{name}.n{no}.pdf")
+        # Partial writes end in .part, which the storage manager cleans up.
+        tmp_path = os.path.join(directory, f".{name}.n{no}.pdf.part")
+        with open(tmp_path, "wb") as f:
+            f.write(chunk)
+        os.replace(tmp_path, part_path)
+        parts.append({
+            "path": part_path,
+            "content_hash": hashlib.sha256(chunk).hexdigest(),
+            "size_bytes": len(chunk),
+            "first_page": first,
+            "last_page": last,
+        })
+    return parts
+
+
+def is_pdf(path: str) -> bool:
+    return Path(path).suffix.lower() == ".pdf"
+
+
+async def inspect_file(pool: Executor, file_id: str) -> dict:
+    """Size, page count and text layer presence of a stored file, inspected once; None values if not a PDF."""
+    stats = await asyncio.to_thread(get_file_stats, file_id)
+    if stats is None or stats["page_count"] is not None:
+        return stats
+    path = await asyncio.to_thread(get_file_path, file_id)
+    if not is_pdf(path):
+        return stats
+    loop = asyncio.get_running_loop()
+    try:
+        with timed("pdf_inspect"):
+            found = await loop.run_in_executor(pool, inspect_pdf, path)
+    except Exception as e:
+        logger.warning("Could not inspect %s: %s", file_id, e)
+        return stats
+    await asyncio.to_thread(store_file_stats, file_id, found["page_count"], found["has_text_layer"])
+    return {**stats, **found}
+
+
+async def normalize_file(pool: Executor, config: Config, file_id: str):
+    """Store the normalized variant of a stored PDF once (see normalize_pdf)."""
+    if await asyncio.to_thread(is_normalized, file_id):
+        return
+    path = await asyncio.to_thread(get_file_path, file_id)
+    if path is None:
+        return
+    if not is_pdf(path):
+        await asyncio.to_thread(store_variants, file_id, [])
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        with timed("normalization"):
+            parts = await loop.run_in_executor(
+                pool, normalize_pdf, path, str(Path(path).with_suffix("")), config.pdf_image_max_px,
+                config.pdf_image_quality, config.pdf_max_part_pages, config.pdf_max_part_bytes,
+            )
+    except Exception as e:
+        logger.warning("Normalization failed for %s: %s", file_id, e)
+        parts = []
+    await asyncio.to_thread(store_variants, file_id, parts)
+    if parts:
+        logger.info("Normalized %s: %d bytes in %d part(s)", file_id, sum(p["size_bytes"] for p in parts), len(parts))
+
+
+async def ingest_file(pool: Executor, config: Config, file_id: str):
+    """Post-upload pipeline: page index and normalized variant, in parallel in the pool."""
+    await asyncio.gather(index_file(pool, file_id), normalize_file(pool, config, file_id))
+
+
+async def index_file(pool: Executor, file_id: str):
+    """Extract page text of a stored file once and add it to the page index."""
+    if await asyncio.to_thread(is_text_indexed, file_id):
+        return
+    path = await asyncio.to_thread(get_file_path, file_id)
+    if path is None:
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        with timed("text_extraction"):
+            pages = await loop.run_in_executor(pool, extract_pages, path)
+    except Exception as e:
+        logger.warning("Text extraction failed for %s: %s", file_id, e)
+        return
+    await asyncio.to_thread(store_pages, file_id, pages)
+    logger.info("Indexed %d pages of %s", len(pages), file_id)
+
+
+def build_fts_query(text: str) -> str:
+    """FTS5 query matching any significant word of the item text (prefix match for inflections)."""
+    words = []
+    for word in re.findall(r"\w{3,}", text.lower()):
+        if word not in STOPWORDS and not word.isdigit() and word not in words:
+            words.append(word)
+    return " OR ".join(f'"{w}"*' for w in words)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+
+from anthropic_client import AsyncAnthropicClient
+from bulk import submit_message_batch, wait_for_batch, batch_result_events
+from checklist import RESULT_TYPES, run_from_payload
+from config import Config
+from database import (
+    create_job,
+    set_job_status,
+    get_job,
+    list_unfinished_job_ids,
+    append_job_event,
+    get_job_events,
+)
+
+logger = logging.getLogger(__name__)
+
+FINAL_TYPES = ("done", "failed")
+# Token-level progress is only useful live; persisting every delta would bloat job_events.
+PARTIAL_TYPES = ("question_partial", "condition_partial")
+# Followers re-check the database at least this often, e.g. for jobs run by another process.
+POLL_SECONDS = 1.0
+
+
+class JobManager:
+    """Runs checklist jobs on a fixed number of in-process workers.
+
+    Every event of a job is persisted as it happens, so followers can attach at any
+    offset and jobs interrupted by a restart are resumed without repeating the items
+    that already have a result.
+
+    Jobs with "mode": "message_batch" go through the Message Batches API instead: one
+    submission, polled with backoff; the batch ID is persisted so a restart keeps
+    polling the same batch instead of paying for a second one.
+    """
+
+    def __init__(self, client: AsyncAnthropicClient, config: Config, workers: int):
+        self.client = client
+        self.config = config
+        self.workers = workers
+        self.queue: asyncio.Queue[str] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._changed: dict[str, asyncio.Event] = {}
+
+    async def start(self):
+        for job_id in await asyncio.to_thread(list_unfinished_job_ids):
+            logger.info("Resuming job %s", job_id)
+            self.queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def submit(self, payload: dict) -> str:
+        """Validate and enqueue a job; raises ValueError like run_from_payload."""
+        await run_from_payload(self.client, self.config, payload)
+        total = len(payload.get("questions") or []) + len(payload.get("conditions") or [])
+        job_id = await asyncio.to_thread(create_job, payload, total)
+        self.queue.put_nowait(job_id)
+        logger.info("Queued job %s with %d items", job_id, total)
+        return job_id
+
+    async def _append(self, job_id: str, event: dict) -> int:
+        seq = await asyncio.to_thread(append_job_event, job_id, event)
+        changed = self._changed.pop(job_id, None)
+        if changed:
+            changed.set()
+        return seq
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self.run_job(job_id)
+            except Exception as e:
+                logger.exception("Job %s failed", job_id)
+                await asyncio.to_thread(set_job_status, job_id, "failed", str(e))
+                await self._append(job_id, {"type": "failed", "message": str(e)})
+            finally:
+                self.queue.task_done()
+
+    async def run_job(self, job_id: str):
+        job = await asyncio.to_thread(get_job, job_id)
+        if job is None or job["status"] in ("done", "failed"):
+            return
+        done_ids = {e["id"] for _, e in await asyncio.to_thread(get_job_events, job_id) if e["type"] in RESULT_TYPES}
+        await asyncio.to_thread(set_job_status, job_id, "running")
+        if job["payload"].get("mode") == "message_batch":
+            await self.run_message_batch(job_id, job, done_ids)
+        elif len(done_ids) < job["total"]:
+            if done_ids:
+                logger.info("Job %s: skipping %d finished items", job_id, len(done_ids))
+            run = await run_from_payload(self.client, self.config, job["payload"], skip_ids=done_ids)
+            async for event in run.events():
+                if event["type"] != "done" and event["type"] not in PARTIAL_TYPES:
+                    await self._append(job_id, event)
+        await asyncio.to_thread(set_job_status, job_id, "done")
+        await self._append(job_id, {"type": "done"})
+        logger.info("Job %s done", job_id)
+
+    async def run_message_batch(self, job_id: str, job: dict, done_ids: set):
+        run = await run_from_payload(self.client, self.config, job["payload"])
+        events = await asyncio.to_thread(get_job_events, job_id)
+        batch_id = next((e["batch_id"] for _, e in events if e["type"] == "batch_submitted"), None)
+        if batch_id is None:
+            pending = [(kind, item) for kind, item in run.items if item["id"] not in done_ids]
+            for (kind, item), cached in zip(pending, await run.cached_events(pending)):
+                if cached is not None:
+                    await self._append(job_id, cached)
+                    done_ids.add(item["id"])
+            if len(done_ids) >= job["total"]:
+                return
+            batch_id = await submit_message_batch(run, skip_ids=done_ids)
+            await self._append(job_id, {"type": "batch_submitted", "batch_id": batch_id})
+        await wait_for_batch(run, batch_id, self.config.batch_poll_initial_seconds, self.config.batch_poll_max_seconds)
+        async for event in batch_result_events(run, batch_id, skip_ids=done_ids):
+            await self._append(job_id, event)
+
+    async def follow(self, job_id: str, offset: int = 0) -> AsyncIterator[tuple[int, dict]]:
+        """Yield (seq, event) from offset on, waiting for new events until the job finishes."""
+        while True:
+            # Grab the wakeup event before reading so an append in between is not missed.
+            changed = self._changed.setdefault(job_id, asyncio.Event())
+            for seq, event in await asyncio.to_thread(get_job_events, job_id, offset):
+                yield seq, event
+                offset = seq + 1
+                if event["type"] in FINAL_TYPES:
+                    self._changed.pop(job_id, None)
+                    return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def snapshot(self, job_id: str) -> dict | None:
+        job = await asyncio.to_thread(get_job, job_id)
+        if job is None:
+            return None
+        events = await asyncio.to_thread(get_job_events, job_id)
+        results = {}
+        for _, event in events:
+            if event["type"] in RESULT_TYPES:
+                results[event["id"]] = event
+        return {
+            "id": job["id"],
+            "status": job["status"],
+            "total": job["total"],
+            "completed": len(results),
+            "events": len(events),
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "results": list(results.values()),
+        }
@@ -0,0 +1,80 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latency of the individual stages of an upload or checklist run.
+#   upload_store     streaming an upload to disk (insert_file)
+#   pdf_inspect      page count / text layer check of an upload in the process pool
+#   text_extraction  PDF text extraction in the process pool
+#   normalization    writing the normalized PDF variant in the process pool
+#   cache_lookup     answer cache lookup
+#   retrieval        page search for retrieval mode
+#   remote_upload    resolving / uploading the Anthropic file IDs of a run
+#   scheduler_wait   waiting for a scheduler slot and rate-limit budget
+#   model_call       one model call as seen by the run (includes scheduler_wait and retries)
+#   parse            extracting and parsing the answer text
+STAGE_SECONDS = Histogram(
+    "checklist_stage_seconds",
+    "Time spent per processing stage",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+TOKENS = Counter("anthropic_tokens_total", "Tokens reported by the Anthropic API", ["model", "kind"])
+TIME_TO_FIRST_RESULT = Histogram(
+    "checklist_time_to_first_result_seconds",
+    "Time from the start of a run to its first result event",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+ITEMS_PER_RUN = Histogram(
+    "checklist_items_per_run", "Questions plus conditions per run", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+PARSE_FAILURES = Counter(
+    "checklist_parse_failures_total", "Answers that fell back to 'Unklar' / False", ["kind"]
+)
+ANSWER_CACHE_HITS = Counter("checklist_answer_cache_hits_total", "Items served from the answer cache")
+ABANDONED_ITEMS = Counter(
+    "checklist_abandoned_items_total", "Items of cancelled runs, by how far they got", ["state"]
+)
+RUNS_IN_PROGRESS = Gauge("checklist_runs_in_progress", "Checklist runs currently producing events")
+UPSTREAM_IN_FLIGHT = Gauge("anthropic_requests_in_flight", "Anthropic calls holding a scheduler slot")
+UPSTREAM_WINDOW = Gauge("anthropic_concurrency_window", "Current AIMD concurrency window of the scheduler")
+UPSTREAM_RETRIES = Counter("anthropic_retries_total", "Retried Anthropic calls", ["status"])
+COALESCED_CALLS = Counter("anthropic_coalesced_calls_total", "Calls that joined an identical in-flight call", ["operation"])
+STORED_BYTES = Gauge("storage_uploaded_bytes", "Size of the stored uploads as of the last storage sweep")
+REMOTE_FILES = Gauge("storage_remote_files", "Files in the Anthropic workspace as of the last storage sweep")
+# reason: quota (LRU over STORAGE_MAX_BYTES / REMOTE_MAX_FILES), orphan (on disk without a row),
+# stale (remote copy expired or without local content)
+EVICTIONS = Counter("storage_evictions_total", "Files deleted by the storage manager", ["location", "reason"])
+
+USAGE_KINDS = {
+    "input_tokens": "input",
+    "output_tokens": "output",
+    "cache_read_input_tokens": "cache_read",
+    "cache_creation_input_tokens": "cache_creation",
+}
+
+
+@contextmanager
+def timed(stage: str, totals: dict | None = None):
+    """Observe the duration of the block for `stage`, and add it to totals[stage] if given."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        if totals is not None:
+            totals[stage] = totals.get(stage, 0.0) + elapsed
+
+
+def record_tokens(msg):
+    """Count the token usage of one model response."""
+    usage = getattr(msg, "usage", None)
+    if usage is None:
+        return
+    model = getattr(msg, "model", None) or "unknown"
+    for field, kind in USAGE_KINDS.items():
+        value = getattr(usage, field, None)
+        if value:
+            TOKENS.labels(model, kind).inc(value)
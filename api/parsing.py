@@ -0,0 +1,182 @@
+import json
+import re
+
+def extract_text_blocks(msg) -> str:
+    raw = "\n".join([
+        (getattr(blk, "text", None).text if hasattr(getattr(blk, "text", None), "text") else getattr(blk, "text", None))
+        for blk in getattr(msg, "content", [])
+        if getattr(blk, "type", None) == "text"
+    ]).strip()
+    if raw.startswith("```"):
+        lines = raw.splitlines()
+        if lines[0].startswith("```"):
+            lines = lines[1:]
+        if lines and lines[-1].strip().startswith("```"):
+            lines = lines[:-1]
+        raw = "\n".join(lines).strip()
+    if raw.lower().startswith("json\n"):
+        raw = raw[5:].strip()
+    return raw
+
+
+def extract_answer_text(msg) -> str:
+    """JSON text of the answer: the input of a tool_use block (structured output), else the text blocks."""
+    for blk in getattr(msg, "content", None) or []:
+        if getattr(blk, "type", None) == "tool_use" and isinstance(getattr(blk, "input", None), dict):
+            return json.dumps(blk.input, ensure_ascii=False)
+    return extract_text_blocks(msg)
+
+
+def loads_or_none(raw: str):
+    try:
+        return json.loads(raw)
+    except Exception:
+        return None
+
+
+def question_answer_from(parsed) -> str | None:
+    """Return the 'antwort' value of an already decoded answer object, or None."""
+    if isinstance(parsed, dict):
+        val = parsed.get("antwort") or parsed.get("answer")
+        if isinstance(val, str) and val.strip():
+            return val.strip()
+    return None
+
+
+def condition_result_from(parsed) -> bool | None:
+    """Return the boolean 'result' of an already decoded answer object, or None."""
+    if isinstance(parsed, dict):
+        if isinstance(parsed.get("result"), bool):
+            return parsed["result"]
+        if isinstance(parsed.get("answer"), bool):
+            return parsed["answer"]
+    return None
+
+
+def parse_question_answer(raw: str) -> str:
+    """Extract the 'antwort' field if JSON, else fallback."""
+    try:
+        val = question_answer_from(json.loads(raw))
+        if val is not None:
+            return val
+    except Exception:
+        pass
+    return "Unklar"
+
+
+def parse_condition_answer(raw: str) -> bool:
+    try:
+        val = condition_result_from(json.loads(raw))
+        if val is not None:
+            return val
+    except Exception:
+        pass
+    return False
+
+
+def parse_batch_answer(raw: str) -> dict[str, dict]:
+    """Map item id -> answer object from a batched JSON array; empty if unparseable."""
+    try:
+        parsed = json.loads(raw)
+    except Exception:
+        return {}
+    if isinstance(parsed, dict):
+        # Structured output wraps the array as {"items": [...]}.
+        parsed = parsed["items"] if isinstance(parsed.get("items"), list) else [parsed]
+    if not isinstance(parsed, list):
+        return {}
+    return {str(obj["id"]): obj for obj in parsed if isinstance(obj, dict) and "id" in obj}
+
+
+def decode_string_prefix(body: str) -> str:
+    """Decode the body of a JSON string that may end in the middle of an escape sequence."""
+    for trim in range(7):
+        try:
+            return json.loads('"' + body[:len(body) - trim] + '"', strict=False)
+        except ValueError:
+            continue
+    return ""
+
+
+class StreamingAnswerParser:
+    """Scans a single-item answer object while its text is still being streamed.
+
+    feed() takes text deltas as they arrive. answer() returns the decoded part of the
+    "antwort" string received so far plus whether the string is complete, result() the
+    "result" boolean once its literal has arrived, and closed turns True as soon as the
+    outermost object's closing brace has been seen (text after it is ignored).
+    """
+
+    ANSWER_RE = re.compile(r'"(?:antwort|answer)"\s*:\s*"')
+    RESULT_RE = re.compile(r'"(?:result|answer)"\s*:\s*(true|false)')
+
+    def __init__(self):
+        self.text = ""
+        self.closed = False
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, delta: str):
+        if self.closed:
+            return
+        self.text += delta
+        while self._pos < len(self.text):
+            ch = self.text[self._pos]
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and self._depth:
+                self._in_string = True
+            elif ch == "{":
+                if self._start is None:
+                    self._start = self._pos - 1
+                self._depth += 1
+            elif ch == "}" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.closed = True
+                    return
+
+    def raw(self) -> str:
+        """The answer object once closed, else everything received so far."""
+        if self.closed:
+            return self.text[self._start:self._pos]
+        return self.text
+
+    def answer(self) -> tuple[str, bool] | None:
+        m = self.ANSWER_RE.search(self.text)
+        if m is None:
+            return None
+        escape = False
+        for i in range(m.end(), len(self.text)):
+            ch = self.text[i]
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                return decode_string_prefix(self.text[m.end():i]), True
+        return decode_string_prefix(self.text[m.end():]), False
+
+    def result(self) -> bool | None:
+        m = self.RESULT_RE.search(self.text)
+        if m is None:
+            return None
+        return m.group(1) == "true"
+
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+
+def usage_from(msg) -> dict:
+    """Token usage of a model response, with missing counters reported as 0."""
+    usage = getattr(msg, "usage", None)
+    return {field: getattr(usage, field, None) or 0 for field in USAGE_FIELDS}
@@ -1,3 +1,8 @@
+import json
+
+# Bump whenever a prompt below changes in a way that can change answers; part of the answer cache key.
+PROMPT_VERSION = "1"
+
 DEFAULT_SYSTEM = (
     "Du beantwortest Fragen zu deutschen Ausschreibungsdokumenten ausschließlich anhand der bereitgestellten Dateien. "
     "WICHTIG: Du gibst AUSSCHLIESSLICH ROHES gültiges JSON zurück – KEINE Erklärungen, KEIN Markdown, KEINE Code-Blöcke. "
@@ -10,17 +15,133 @@ JSON_ENFORCEMENT_HINT = (
     "Falls du versucht bist ```json zu benutzen: TU ES NICHT. Nur das Array."
 )
 
-def build_condition_prompt(condition_text: str) -> str:
+# How much evidence ("beleg") an answer carries: "full" (short location), "terse"
+# (file and page only) or "none" (left out, fewest output tokens).
+BELEG_MODES = ("full", "terse", "none")
+BELEG_HINTS = {"full": "kurzer Fundort", "terse": "nur Datei und Seite, höchstens 10 Wörter"}
+TERSE_BELEG_MAX_LENGTH = 80
+
+QUESTION_TOOL = "frage_beantworten"
+CONDITION_TOOL = "bedingung_pruefen"
+BATCH_TOOL = "eintraege_bearbeiten"
+
+STRUCTURED_SYSTEM = (
+    "Du beantwortest Fragen zu deutschen Ausschreibungsdokumenten ausschließlich anhand der bereitgestellten Dateien. "
+    "Antworte immer über das im Auftrag genannte Werkzeug, ohne weiteren Text. "
+    "Wenn etwas unklar ist, antworte an der entsprechenden Stelle mit einem kurzen string 'Unklar'."
+)
+
+
+def beleg_format(beleg: str) -> str:
+    return "" if beleg == "none" else f', "beleg": "{BELEG_HINTS[beleg]}"'
+
+
+def build_condition_prompt(condition_text: str, beleg: str = "full", structured: bool = False) -> str:
+    if structured:
+        instruction = f"Antworte mit dem Werkzeug {CONDITION_TOOL}."
+    else:
+        instruction = "Gib nur JSON im Format: {\"result\": true|false" + beleg_format(beleg) + "}."
     return (
         "Prüfe die Bedingung ausschließlich anhand der Dokumente. "
-        "Gib nur JSON im Format: {\"result\": true|false, \"beleg\": \"kurzer Fundort\"}.\n"
+        f"{instruction}\n"
         f"Bedingung: {condition_text}"
     )
 
 
-def build_question_prompt(question_text: str) -> str:
+def build_question_prompt(question_text: str, beleg: str = "full", structured: bool = False) -> str:
+    if structured:
+        instruction = f"Antworte mit dem Werkzeug {QUESTION_TOOL}."
+    else:
+        instruction = "Gib nur JSON im Format: {\"antwort\": \"string\"" + beleg_format(beleg) + "}."
     return (
         "Beantworte die Frage ausschließlich anhand der Dokumente. "
-        "Gib nur JSON im Format: {\"antwort\": \"string\", \"beleg\": \"kurzer Fundort\"}.\n"
+        f"{instruction}\n"
         f"Frage: {question_text}"
     )
+
+
+def beleg_schema(beleg: str) -> dict:
+    if beleg == "none":
+        return {}
+    schema = {"type": "string", "description": BELEG_HINTS[beleg]}
+    if beleg == "terse":
+        schema["maxLength"] = TERSE_BELEG_MAX_LENGTH
+    return {"beleg": schema}
+
+
+def answer_tools(beleg: str = "full") -> list[dict]:
+    """Tool definitions for structured answers.
+
+    Every call carries all three (with tool_choice "any") so that tools, system prompt
+    and documents form the same prompt-cache prefix for questions, conditions and batches.
+    """
+    belegs = beleg_schema(beleg)
+    required = ["beleg"] if belegs else []
+    question = {"antwort": {"type": "string", "description": "Antwort auf die Frage, oder 'Unklar'"}, **belegs}
+    condition = {"result": {"type": "boolean", "description": "Ob die Bedingung erfüllt ist"}, **belegs}
+    batch_item = {
+        "type": "object",
+        "properties": {
+            "id": {"type": "string"},
+            "antwort": question["antwort"],
+            "result": condition["result"],
+            **belegs,
+        },
+        "required": ["id"],
+    }
+    return [
+        {
+            "name": QUESTION_TOOL,
+            "description": "Antwort auf eine Frage zu den Dokumenten.",
+            "input_schema": {"type": "object", "properties": question, "required": ["antwort", *required]},
+        },
+        {
+            "name": CONDITION_TOOL,
+            "description": "Ergebnis der Prüfung einer Bedingung anhand der Dokumente.",
+            "input_schema": {"type": "object", "properties": condition, "required": ["result", *required]},
+        },
+        {
+            "name": BATCH_TOOL,
+            "description": "Antworten auf mehrere Einträge: antwort für Fragen, result für Bedingungen.",
+            "input_schema": {
+                "type": "object",
+                "properties": {"items": {"type": "array", "items": batch_item}},
+                "required": ["items"],
+            },
+        },
+    ]
+
+RETRIEVAL_HINT = (
+    "Die Dokumente liegen nur als Seitenauszüge vor, jeweils mit [Datei, Seite N] gekennzeichnet. "
+    "Gib im beleg Datei und Seite an."
+)
+
+def format_page_excerpt(filename: str, page_no: int, text: str) -> str:
+    return f"[{filename}, Seite {page_no}]\n{text.strip()}"
+
+# Rough output-token cost of one item inside a batched answer, used to size batches.
+QUESTION_OUTPUT_TOKENS = 250
+CONDITION_OUTPUT_TOKENS = 100
+BATCH_OUTPUT_OVERHEAD_TOKENS = 50
+
+def build_batch_prompt(items: list[dict], beleg: str = "full", structured: bool = False) -> str:
+    """Prompt for several questions/conditions at once; items are dicts with id, type and text."""
+    lines = []
+    for it in items:
+        label = "Frage" if it["type"] == "question" else "Bedingung"
+        lines.append(f"- id {json.dumps(str(it['id']), ensure_ascii=False)} ({label}): {it['text']}")
+    if structured:
+        instruction = (
+            f"Antworte mit dem Werkzeug {BATCH_TOOL}, mit genau einem Element in items pro Eintrag und der jeweils angegebenen id. "
+            "Für eine Frage antwort, für eine Bedingung result angeben.\n"
+        )
+    else:
+        instruction = (
+            "Gib ein JSON Array mit genau einem Objekt pro Eintrag zurück und übernimm jeweils die angegebene id. "
+            "Für eine Frage: {\"id\": \"...\", \"antwort\": \"string\"" + beleg_format(beleg) + "}. "
+            "Für eine Bedingung: {\"id\": \"...\", \"result\": true|false" + beleg_format(beleg) + "}.\n"
+        )
+    return "Bearbeite alle folgenden Einträge ausschließlich anhand der Dokumente. " + instruction + "\n".join(lines)
+
+def estimate_output_tokens(item_type: str) -> int:
+    return QUESTION_OUTPUT_TOKENS if item_type == "question" else CONDITION_OUTPUT_TOKENS
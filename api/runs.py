@@ -0,0 +1,190 @@
+"""Versioned checklist runs and incremental re-evaluation.
+
+Every run started through /runs is stored with its payload, the content hashes of its
+documents and each item's result. Re-evaluating a run creates the next version of the
+same checklist with changed documents and/or items, and only asks the model again for
+items whose inputs changed; the others are served from the previous run.
+"""
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import AsyncIterator, List
+
+from anthropic_client import AsyncAnthropicClient
+from checklist import RESULT_TYPES, ChecklistRun, run_from_payload
+from config import Config
+from database import (
+    count_indexed_pages,
+    create_checklist_run,
+    get_checklist_run,
+    get_content_hashes,
+    get_run_results,
+    list_checklist_versions,
+    put_run_result,
+    search_pages,
+    set_checklist_run_status,
+)
+from ingest import build_fts_query, index_file
+
+logger = logging.getLogger(__name__)
+
+# Request options that apply to one request only and are not carried over to later versions.
+TRANSIENT_OPTIONS = ("tenant", "bypass_cache", "timings", "full_recheck")
+
+
+class UnknownRunError(Exception):
+    pass
+
+
+def stored_payload(payload: dict) -> dict:
+    return {k: v for k, v in payload.items() if k not in TRANSIENT_OPTIONS}
+
+
+def checklist_item_ids(payload: dict) -> List[str]:
+    return [str(item["id"]) for item in (payload.get("questions") or []) + (payload.get("conditions") or [])]
+
+
+async def start_run(client: AsyncAnthropicClient, config: Config, payload: dict) -> tuple[dict, ChecklistRun]:
+    """Validate an /ask style payload and store it as version 1 of a new checklist."""
+    run = await run_from_payload(client, config, payload)
+    # Hashes of the uploaded files, not of the (normalized) documents sent for them.
+    hashes = await asyncio.to_thread(get_content_hashes, run.file_ids)
+    record = await asyncio.to_thread(create_checklist_run, stored_payload(payload), list(hashes.values()))
+    return record, run
+
+
+async def affected_by_added_files(run: ChecklistRun, pairs: List[tuple], added_ids: List[str]) -> set | None:
+    """IDs of the items that have a page of an added file among their top-k pages in the new document set.
+
+    None if the added files have no page text to judge by (e.g. scans).
+    """
+    if await asyncio.to_thread(count_indexed_pages, added_ids) == 0:
+        return None
+    affected = set()
+    for _, item in pairs:
+        matches = await asyncio.to_thread(search_pages, run.file_ids, build_fts_query(item["text"]), run.top_k)
+        if any(file_id in added_ids for file_id, *_ in matches):
+            affected.add(item["id"])
+    return affected
+
+
+async def reevaluate(client: AsyncAnthropicClient, config: Config, pool: Executor, previous_id: str,
+                     changes: dict) -> tuple[dict, ChecklistRun, dict]:
+    """Build the next version of a stored run; returns (run record, run, diff).
+
+    `changes` overrides fields of the previous payload (file_ids, questions, conditions,
+    options). An item is answered again if it is new, its text, type or the model
+    settings changed, the previous run has no result for it, a document was removed,
+    or an added document is among the best matching pages for it (all items if the
+    added documents have no page text). "full_recheck": true answers every item again,
+    bypassing the answer cache. Raises UnknownRunError or, on bad input, ValueError.
+    """
+    previous = await asyncio.to_thread(get_checklist_run, previous_id)
+    if previous is None:
+        raise UnknownRunError(previous_id)
+    full_recheck = bool(changes.get("full_recheck"))
+    payload = {**previous["payload"], **changes}
+    if full_recheck:
+        payload["bypass_cache"] = True
+    run = await run_from_payload(client, config, payload)
+    results = await asyncio.to_thread(get_run_results, previous_id)
+    hashes = await asyncio.to_thread(get_content_hashes, run.file_ids)
+
+    old_hashes = set(previous["content_hashes"])
+    added_ids = [fid for fid, h in hashes.items() if h not in old_hashes]
+    documents_removed = bool(old_hashes - set(hashes.values()))
+    previous_items = set(checklist_item_ids(previous["payload"]))
+
+    recomputed: dict[str, str] = {}
+    unchanged: List[tuple] = []
+    for kind, item in run.items:
+        result = results.get(item["id"])
+        if item["id"] not in previous_items:
+            recomputed[item["id"]] = "new"
+        elif result is None:
+            recomputed[item["id"]] = "no_previous_result"
+        elif result[:2] != (kind, run.item_key(kind, item)):
+            recomputed[item["id"]] = "changed"
+        elif full_recheck:
+            recomputed[item["id"]] = "full_recheck"
+        elif documents_removed:
+            recomputed[item["id"]] = "documents_removed"
+        else:
+            unchanged.append((kind, item))
+
+    if unchanged and added_ids:
+        # Usually indexed right after the upload already; make sure before judging by page text.
+        for file_id in added_ids:
+            await index_file(pool, file_id)
+        affected = await affected_by_added_files(run, unchanged, added_ids)
+        if affected is None:
+            logger.info("Added files have no page text, checking all %d unchanged items again", len(unchanged))
+        for kind, item in list(unchanged):
+            if affected is None or item["id"] in affected:
+                recomputed[item["id"]] = "documents_added" if affected is None else "added_document_matches"
+                unchanged.remove((kind, item))
+
+    for _, item in unchanged:
+        event = {k: v for k, v in results[item["id"]][2].items() if k != "cached"}
+        run.reuse[item["id"]] = {**event, "reused_from": event.get("reused_from", previous_id)}
+
+    diff = {
+        "previous_run_id": previous_id,
+        "full_recheck": full_recheck,
+        "added_files": added_ids,
+        "removed_files": [fid for fid in previous["payload"].get("file_ids") or [] if fid not in hashes],
+        "removed_items": sorted(previous_items - set(checklist_item_ids(payload))),
+        "reused": [item["id"] for _, item in unchanged],
+        "recomputed": recomputed,
+    }
+    logger.info("Re-evaluating run %s: %d items reused, %d recomputed", previous_id, len(unchanged), len(recomputed))
+    record = await asyncio.to_thread(create_checklist_run, stored_payload(payload), list(hashes.values()), previous_id)
+    return record, run, diff
+
+
+async def recorded_events(record: dict, run: ChecklistRun, diff: dict | None = None) -> AsyncIterator[dict]:
+    """run.events(), preceded by a "run" event and with every result stored under the run."""
+    # Keys are taken before the run starts, i.e. from the requested settings.
+    keys = {item["id"]: (kind, run.item_key(kind, item)) for kind, item in run.items}
+    status = "cancelled"
+    try:
+        yield {
+            "type": "run",
+            "run_id": record["id"],
+            "checklist_id": record["checklist_id"],
+            "version": record["version"],
+            **({"diff": diff} if diff is not None else {}),
+        }
+        async for event in run.events():
+            if event["type"] in RESULT_TYPES:
+                kind, key = keys[event["id"]]
+                await asyncio.to_thread(put_run_result, record["id"], event["id"], kind, key, event)
+            elif event["type"] == "done":
+                status = "done"
+            yield event
+    finally:
+        # Not awaited: on a client disconnect the stream is being torn down.
+        asyncio.get_running_loop().run_in_executor(None, set_checklist_run_status, record["id"], status)
+
+
+def run_snapshot(run_id: str) -> dict | None:
+    """A stored run with its results in checklist order and all versions of its checklist."""
+    record = get_checklist_run(run_id)
+    if record is None:
+        return None
+    results = get_run_results(run_id)
+    item_ids = checklist_item_ids(record["payload"])
+    return {
+        "id": record["id"],
+        "checklist_id": record["checklist_id"],
+        "version": record["version"],
+        "parent_id": record["parent_id"],
+        "status": record["status"],
+        "created_at": record["created_at"],
+        "updated_at": record["updated_at"],
+        "payload": record["payload"],
+        "total": len(item_ids),
+        "completed": sum(1 for i in item_ids if i in results),
+        "results": [results[i][2] for i in item_ids if i in results],
+        "versions": list_checklist_versions(record["checklist_id"]),
+    }
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Awaitable, Callable, TypeVar
+
+import anthropic
+import httpx
+
+from metrics import STAGE_SECONDS, UPSTREAM_IN_FLIGHT, UPSTREAM_RETRIES, UPSTREAM_WINDOW
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_TENANT = "default"
+# Rate limited, overloaded, or a transient server error: worth another attempt.
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+THROTTLE_STATUSES = {429, 529}
+# Smoothing factor for the per-call token estimates.
+ESTIMATE_WEIGHT = 0.2
+
+
+class TokenBucket:
+    """Continuously refilling bucket for one per-minute limit.
+
+    Unlimited until resize() has been called with the limits from a response; the
+    server's "remaining" is authoritative, our own debits keep it conservative in between.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.capacity: float | None = None
+        self.rate = 0.0
+        self.level = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def resize(self, limit: float, remaining: float, reset_in: float | None):
+        self._refill()
+        first = self.capacity is None
+        self.capacity = limit
+        # The bucket is full again at "reset"; without it assume a linear per-minute refill.
+        if reset_in and reset_in > 0 and remaining < limit:
+            self.rate = max((limit - remaining) / reset_in, limit / 60)
+        else:
+            self.rate = limit / 60
+        self.level = remaining if first else min(self.level, remaining)
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        if self.capacity is None or amount <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        """Debit without waiting (the level may go negative when an estimate was too low)."""
+        self._refill()
+        if self.capacity is not None:
+            self.level -= amount
+
+
+def parse_reset(value: str | None) -> float | None:
+    """Seconds until an RFC 3339 reset timestamp, or None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() - time.time()
+    except ValueError:
+        return None
+
+
+def status_and_headers(exc: Exception) -> tuple[int | None, httpx.Headers | None]:
+    """HTTP status and response headers of a failed SDK or httpx call; (None, None) for network errors."""
+    if isinstance(exc, anthropic.APIStatusError):
+        return exc.status_code, exc.response.headers
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code, exc.response.headers
+    return None, None
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (anthropic.APIConnectionError, httpx.TransportError)):
+        return True
+    status, _ = status_and_headers(exc)
+    return status in RETRY_STATUSES
+
+
+class Scheduler:
+    """Shared gate in front of every upstream call of the process.
+
+    - Concurrency is an AIMD window: +1 per window of successful calls, halved (at most
+      once per round trip) when the API answers 429/529.
+    - Request, input-token and output-token buckets are sized from the
+      anthropic-ratelimit-* response headers; token costs are estimated from recent
+      calls and corrected with the actual usage afterwards.
+    - Free slots are handed out round-robin across tenants, so one tenant's large
+      checklist cannot starve the others.
+    - Failed calls are retried with jittered exponential backoff, honouring retry-after.
+    """
+
+    def __init__(self, max_concurrency: int, max_retries: int = 6, base_delay: float = 1.0,
+                 max_delay: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.window = float(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.waiting: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        self.requests = TokenBucket("requests")
+        self.input_tokens = TokenBucket("input_tokens")
+        self.output_tokens = TokenBucket("output_tokens")
+        self.input_estimate = 0.0
+        self.output_estimate = 0.0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        UPSTREAM_WINDOW.set(self.window)
+
+    async def acquire(self, tenant: str):
+        if self.in_flight < int(self.window) and not self.waiting:
+            self.in_flight += 1
+            UPSTREAM_IN_FLIGHT.set(self.in_flight)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(tenant, deque()).append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # The slot was granted just before the cancellation; give it back.
+                self.release()
+            else:
+                queue = self.waiting.get(tenant)
+                if queue is not None and fut in queue:
+                    queue.remove(fut)
+                    if not queue:
+                        del self.waiting[tenant]
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+        UPSTREAM_IN_FLIGHT.set(self.in_flight)
+
+    def _dispatch(self):
+        while self.waiting and self.in_flight < int(self.window):
+            tenant, queue = next(iter(self.waiting.items()))
+            fut = queue.popleft()
+            # Rotate: the tenant that was just served goes to the back of the line.
+            del self.waiting[tenant]
+            if queue:
+                self.waiting[tenant] = queue
+            if not fut.done():
+                self.in_flight += 1
+                UPSTREAM_IN_FLIGHT.set(self.in_flight)
+                fut.set_result(None)
+
+    async def _wait_for_budget(self, metered: bool):
+        while True:
+            wait = self.paused_until - time.monotonic()
+            if metered:
+                wait = max(
+                    wait,
+                    self.requests.wait_time(1),
+                    self.input_tokens.wait_time(self.input_estimate),
+                    self.output_tokens.wait_time(self.output_estimate),
+                )
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        if metered:
+            self.requests.take(1)
+            self.input_tokens.take(self.input_estimate)
+            self.output_tokens.take(self.output_estimate)
+
+    def update_limits(self, headers: httpx.Headers | None):
+        if headers is None:
+            return
+        for bucket in (self.requests, self.input_tokens, self.output_tokens):
+            prefix = "anthropic-ratelimit-" + bucket.name.replace("_", "-")
+            limit, remaining = headers.get(prefix + "-limit"), headers.get(prefix + "-remaining")
+            if limit and remaining and limit.isdigit() and remaining.isdigit():
+                bucket.resize(float(limit), float(remaining), parse_reset(headers.get(prefix + "-reset")))
+
+    def record_usage(self, usage):
+        """Correct the token buckets and estimates with the actual usage of a call."""
+        if usage is None:
+            return
+        used_in = (getattr(usage, "input_tokens", None) or 0) + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+        used_out = getattr(usage, "output_tokens", None) or 0
+        self.input_tokens.take(used_in - self.input_estimate)
+        self.output_tokens.take(used_out - self.output_estimate)
+        if self.input_estimate == 0:
+            self.input_estimate, self.output_estimate = used_in, used_out
+        else:
+            self.input_estimate += ESTIMATE_WEIGHT * (used_in - self.input_estimate)
+            self.output_estimate += ESTIMATE_WEIGHT * (used_out - self.output_estimate)
+
+    def on_success(self):
+        if self.window < self.max_concurrency:
+            self.window = min(self.max_concurrency, self.window + 1 / self.window)
+            UPSTREAM_WINDOW.set(self.window)
+            self._dispatch()
+
+    def on_throttled(self, started: float):
+        # Calls that were already in flight when we backed off must not halve the window again.
+        if started > self.last_decrease:
+            self.window = max(1.0, self.window / 2)
+            UPSTREAM_WINDOW.set(self.window)
+            self.last_decrease = time.monotonic()
+            logger.warning("Upstream throttled, concurrency window now %d", int(self.window))
+
+    def backoff(self, attempt: int, headers: httpx.Headers | None) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        retry_after = headers.get("retry-after") if headers is not None else None
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+    async def call(self, send: Callable[[], Awaitable[tuple[T, httpx.Headers | None]]], tenant: str = DEFAULT_TENANT,
+                   metered: bool = True, can_retry: Callable[[], bool] | None = None) -> T:
+        """Run send() under the scheduler and return its result.
+
+        send() performs one attempt and returns (result, response headers). metered calls
+        (messages) draw from the rate-limit buckets; others (files, batches) only take a
+        slot. can_retry() may veto a retry, e.g. once a stream has delivered text.
+        """
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            await self.acquire(tenant)
+            try:
+                await self._wait_for_budget(metered)
+                STAGE_SECONDS.labels("scheduler_wait").observe(time.perf_counter() - queued)
+                started = time.monotonic()
+                result, headers = await send()
+            except Exception as e:
+                status, headers = status_and_headers(e)
+                if metered:
+                    # Failed calls are not billed by token; the request itself still counted.
+                    self.input_tokens.take(-self.input_estimate)
+                    self.output_tokens.take(-self.output_estimate)
+                self.update_limits(headers)
+                if status in THROTTLE_STATUSES:
+                    self.on_throttled(started)
+                if not is_retryable(e) or attempt >= self.max_retries or (can_retry is not None and not can_retry()):
+                    raise
+                delay = self.backoff(attempt, headers)
+                if status in THROTTLE_STATUSES:
+                    # Everyone waits, not just this call; the limit is shared.
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                logger.warning("Upstream call failed (%s), retry %d in %.1fs", status or type(e).__name__,
+                               attempt + 1, delay)
+                UPSTREAM_RETRIES.labels(str(status or type(e).__name__)).inc()
+            else:
+                if metered:
+                    self.record_usage(getattr(result, "usage", None))
+                self.update_limits(headers)
+                self.on_success()
+                return result
+            finally:
+                self.release()
+            attempt += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from metrics import COALESCED_CALLS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent identical operations into one.
+
+    The first caller for a key starts the operation; callers arriving while it is still
+    running wait for the same result (or exception). Nothing is kept once it finishes,
+    so this only removes duplicate work that overlaps in time. A waiter that is
+    cancelled does not cancel the shared operation unless it was the last one waiting.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        self.shared = 0
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # Mark the exception as retrieved when every waiter has gone away.
+            call.task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None or call.task.done():
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.shared += 1
+            operation = key[0] if isinstance(key, tuple) else str(key)
+            logger.info("Joining in-flight call %s", operation)
+            COALESCED_CALLS.labels(operation).inc()
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.task.cancelled() and not asyncio.current_task().cancelling():
+                # Abandoned by its last waiter right before we joined; run it afresh.
+                return await self.do(key, fn)
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
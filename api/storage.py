@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import time
+
+from anthropic_client import AsyncAnthropicClient
+from config import Config
+from database import (
+    FILES_DIR,
+    workspace_key,
+    stored_bytes,
+    least_recently_used_files,
+    delete_files,
+    existing_file_ids,
+    unfinished_job_file_ids,
+    unfinished_batch_content_hashes,
+    count_remote_files,
+    stale_remote_files,
+    least_recently_used_remote_files,
+    forget_remote_files,
+)
+from metrics import EVICTIONS, REMOTE_FILES, STORED_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Files deleted per database transaction / per round of remote deletes.
+DELETE_BATCH = 100
+# Remote deletes go through the scheduler in their own lane, so fair queuing keeps them
+# from delaying request traffic.
+STORAGE_TENANT = "storage"
+
+
+def remove_orphans(grace_seconds: float) -> int:
+    """Delete files in FILES_DIR without a database row, and abandoned partial uploads.
+
+    Only files untouched for grace_seconds are considered: an upload is moved into place
+    just before its row is inserted.
+    """
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    with os.scandir(FILES_DIR) as entries:
+        candidates = [e for e in entries if e.is_file() and e.stat().st_mtime < cutoff]
+    for start in range(0, len(candidates), DELETE_BATCH):
+        batch = candidates[start:start + DELETE_BATCH]
+        # Stored as "<id><ext>", partial uploads as ".<id>.part".
+        ids = {e.path: e.name.lstrip(".").split(".")[0] for e in batch}
+        known = existing_file_ids(list(set(ids.values())))
+        for e in batch:
+            if e.name.endswith(".part") or ids[e.path] not in known:
+                try:
+                    os.unlink(e.path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+    return removed
+
+
+def unlink_all(paths: list[str]):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class StorageManager:
+    """Keeps uploaded_files/ and the Anthropic Files workspace within their quotas.
+
+    Every STORAGE_SWEEP_SECONDS it removes orphaned files on disk, evicts the least
+    recently used uploads while their total size exceeds STORAGE_MAX_BYTES, and deletes
+    remote copies that are expired or no longer backed by a local file, then the least
+    recently used ones beyond REMOTE_MAX_FILES. Files accessed within
+    STORAGE_GRACE_SECONDS and files of unfinished jobs are never evicted, nor are the
+    remote copies used by unfinished message batch jobs. Deletes run in batches off the
+    event loop.
+    """
+
+    def __init__(self, client: AsyncAnthropicClient, config: Config):
+        self.client = client
+        self.config = config
+        self.workspace = workspace_key(config.api_key, config.base_url)
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Storage sweep failed")
+            await asyncio.sleep(self.config.storage_sweep_seconds)
+
+    async def sweep(self) -> dict:
+        """One pass over disk and workspace; returns the number of deleted files per kind."""
+        counts = {
+            "orphans": await self.remove_orphans(),
+            "local": await self.enforce_disk_quota(),
+            "remote": await self.enforce_remote_quota(),
+        }
+        if any(counts.values()):
+            logger.info("Storage sweep removed %d orphaned, %d local and %d remote files",
+                        counts["orphans"], counts["local"], counts["remote"])
+        return counts
+
+    async def remove_orphans(self) -> int:
+        removed = await asyncio.to_thread(remove_orphans, self.config.storage_grace_seconds)
+        EVICTIONS.labels("local", "orphan").inc(removed)
+        return removed
+
+    async def enforce_disk_quota(self) -> int:
+        total = await asyncio.to_thread(stored_bytes)
+        quota = self.config.storage_max_bytes
+        evicted = 0
+        while quota and total > quota:
+            protected = await asyncio.to_thread(unfinished_job_file_ids)
+            cutoff = time.time() - self.config.storage_grace_seconds
+            candidates = await asyncio.to_thread(least_recently_used_files, DELETE_BATCH, cutoff, protected)
+            if not candidates:
+                logger.warning("Uploads use %d bytes (quota %d), but all of them are in use", total, quota)
+                break
+            victims, excess = [], total - quota
+            for file_id, _, size in candidates:
+                if excess <= 0:
+                    break
+                victims.append(file_id)
+                excess -= size
+            paths = await asyncio.to_thread(delete_files, victims, cutoff)
+            if not paths:
+                break  # all of them were used again meanwhile; next sweep
+            await asyncio.to_thread(unlink_all, paths)
+            EVICTIONS.labels("local", "quota").inc(len(paths))
+            evicted += len(paths)
+            total = await asyncio.to_thread(stored_bytes)
+        STORED_BYTES.set(total)
+        return evicted
+
+    async def _delete_remote(self, remote_file_ids: list[str], reason: str) -> bool:
+        """Delete remote files and their cache rows; False if any delete failed."""
+        results = await asyncio.gather(
+            *(self.client.delete_file(fid, STORAGE_TENANT) for fid in remote_file_ids), return_exceptions=True
+        )
+        deleted = [fid for fid, r in zip(remote_file_ids, results) if not isinstance(r, Exception)]
+        await asyncio.to_thread(forget_remote_files, self.workspace, deleted)
+        EVICTIONS.labels("remote", reason).inc(len(deleted))
+        if len(deleted) < len(remote_file_ids):
+            error = next(r for r in results if isinstance(r, Exception))
+            logger.warning("Could not delete %d remote files: %s", len(remote_file_ids) - len(deleted), error)
+            return False
+        return True
+
+    async def enforce_remote_quota(self) -> int:
+        evicted = 0
+        # Message batches still being processed upstream cannot re-upload a deleted file.
+        protected = await asyncio.to_thread(unfinished_batch_content_hashes)
+        while stale := await asyncio.to_thread(stale_remote_files, self.workspace, DELETE_BATCH, protected):
+            if not await self._delete_remote(stale, "stale"):
+                return evicted
+            evicted += len(stale)
+        count = await asyncio.to_thread(count_remote_files, self.workspace)
+        quota = self.config.remote_max_files
+        while quota and count > quota:
+            candidates = await asyncio.to_thread(
+                least_recently_used_remote_files, self.workspace, min(DELETE_BATCH, count - quota),
+                time.time() - self.config.storage_grace_seconds, protected,
+            )
+            if not candidates:
+                logger.warning("%d remote files (quota %d), but all of them are in use", count, quota)
+                break
+            if not await self._delete_remote(candidates, "quota"):
+                break
+            evicted += len(candidates)
+            count -= len(candidates)
+        REMOTE_FILES.set(count)
+        return evicted
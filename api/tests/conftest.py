@@ -0,0 +1,14 @@
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# database.py opens its SQLite file when imported; give the tests a throwaway one.
+DATA_DIR = tempfile.mkdtemp(prefix="api-tests-")
+os.environ["API_DATA_DIR"] = DATA_DIR
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
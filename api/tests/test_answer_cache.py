@@ -0,0 +1,95 @@
+import asyncio
+import dataclasses
+import time
+import uuid
+from types import SimpleNamespace
+
+from checklist import ChecklistRun, question_event
+from config import load_config
+from database import answer_cache_key, get_cached_answers, get_conn, put_cached_answer
+
+# Has no model methods: every run here must be served from the cache.
+CLIENT = SimpleNamespace(model="test-model", temperature=0.0)
+CONFIG = dataclasses.replace(load_config(), answer_cache_ttl_seconds=3600)
+
+QUESTION = {"id": "q1", "text": "Wann endet die Angebotsfrist?"}
+
+
+def checklist_run(files: list[tuple], **kwargs) -> ChecklistRun:
+    return ChecklistRun(CLIENT, CONFIG, files, [QUESTION], [], **kwargs)
+
+
+def remember(run: ChecklistRun, event: dict):
+    """run.remember(), waiting for the background write to land."""
+    key = run.cache_key("question", QUESTION)
+
+    async def main():
+        run.remember("question", QUESTION, event)
+        deadline = time.monotonic() + 5
+        while not await asyncio.to_thread(get_cached_answers, [key], CONFIG.answer_cache_ttl_seconds):
+            assert time.monotonic() < deadline, "cache write did not land"
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+
+
+async def collect(run: ChecklistRun) -> list[dict]:
+    return [event async for event in run.events()]
+
+
+def test_key_covers_documents_item_and_model_settings():
+    key = answer_cache_key(["b", "a"], "question", "Wann  endet die Frist?", "m", 0, "v1")
+    # Document order, whitespace and case do not matter.
+    assert key == answer_cache_key(["a", "b"], "question", "wann endet die frist?", "m", 0.0, "v1")
+    assert key != answer_cache_key(["a"], "question", "Wann endet die Frist?", "m", 0, "v1")
+    assert key != answer_cache_key(["a", "b"], "condition", "Wann endet die Frist?", "m", 0, "v1")
+    assert key != answer_cache_key(["a", "b"], "question", "Wann endet die Frist?", "other", 0, "v1")
+    assert key != answer_cache_key(["a", "b"], "question", "Wann endet die Frist?", "m", 0.5, "v1")
+    assert key != answer_cache_key(["a", "b"], "question", "Wann endet die Frist?", "m", 0, "v2")
+
+
+def test_remembered_answer_is_served_from_cache():
+    files = [("/nonexistent.pdf", uuid.uuid4().hex)]
+    remember(checklist_run(files), question_event(QUESTION, "1. Mai", '{"antwort": "1. Mai"}'))
+
+    events = asyncio.run(collect(checklist_run(files)))
+    assert [e["type"] for e in events] == ["question_result", "done"]
+    assert events[0]["id"] == "q1"
+    assert events[0]["answer"] == "1. Mai"
+    assert events[0]["cached"] is True
+
+
+def test_other_documents_miss_the_cache():
+    remember(checklist_run([("/a.pdf", uuid.uuid4().hex)]), question_event(QUESTION, "1. Mai", "{}"))
+    run = checklist_run([("/b.pdf", uuid.uuid4().hex)])
+    assert asyncio.run(run.cached_events(run.items)) == [None]
+
+
+def test_bypass_cache_skips_lookup():
+    files = [("/nonexistent.pdf", uuid.uuid4().hex)]
+    remember(checklist_run(files), question_event(QUESTION, "1. Mai", "{}"))
+    run = checklist_run(files, bypass_cache=True)
+    assert asyncio.run(run.cached_events(run.items)) == [None]
+
+
+def test_expired_entries_are_dropped():
+    key = uuid.uuid4().hex
+    put_cached_answer(key, {"answer": "x"}, max_bytes=10 ** 9)
+    with get_conn() as c:
+        c.execute("UPDATE answer_cache SET created_at = ? WHERE cache_key = ?", (time.time() - 100, key))
+    assert get_cached_answers([key], ttl_seconds=50) == {}
+    # Deleted on the expired lookup, not just hidden.
+    assert get_cached_answers([key], ttl_seconds=10 ** 6) == {}
+
+
+def test_least_recently_used_entries_are_evicted():
+    old, recent, new = (uuid.uuid4().hex for _ in range(3))
+    put_cached_answer(old, {"answer": "a" * 100}, max_bytes=10 ** 9)
+    put_cached_answer(recent, {"answer": "b" * 100}, max_bytes=10 ** 9)
+    with get_conn() as c:
+        c.execute("UPDATE answer_cache SET last_access = 0 WHERE cache_key = ?", (old,))
+        others = c.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM answer_cache WHERE cache_key NOT IN (?, ?)",
+                           (old, recent)).fetchone()[0]
+    # Room for two of the three entries besides whatever other tests stored.
+    put_cached_answer(new, {"answer": "c" * 100}, max_bytes=others + 250)
+    assert set(get_cached_answers([old, recent, new], ttl_seconds=3600)) == {recent, new}
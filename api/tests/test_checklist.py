@@ -0,0 +1,97 @@
+import asyncio
+import dataclasses
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from checklist import ChecklistRun, run_from_payload
+from config import load_config
+from database import insert_file
+
+CLIENT = SimpleNamespace(model="test-model", temperature=0.0)
+CONFIG = dataclasses.replace(load_config(), document_variant="original", ask_concurrency=4)
+
+
+@pytest.fixture(scope="module")
+def file_ids():
+    return [insert_file(f"{uuid.uuid4().hex}.pdf", uuid.uuid4().bytes)[0]]
+
+
+def build(file_ids, **payload):
+    return asyncio.run(run_from_payload(CLIENT, CONFIG, {"file_ids": file_ids, **payload}))
+
+
+def test_integer_item_ids_are_normalised(file_ids):
+    run = build(file_ids, questions=[{"id": 1, "text": "Frist?"}], conditions=[{"id": "c1", "text": "Lose"}])
+    assert [item["id"] for _, item in run.items] == ["1", "c1"]
+
+
+@pytest.mark.parametrize("item", ["Frist?", {"text": "Frist?"}, {"id": 1.5, "text": "Frist?"},
+                                  {"id": True, "text": "Frist?"}, {"id": "q1"}, {"id": "q1", "text": 3}])
+def test_malformed_items_are_rejected(file_ids, item):
+    with pytest.raises(ValueError):
+        build(file_ids, questions=[item])
+
+
+@pytest.mark.parametrize("option", ["concurrency", "top_k", "batch_max_items"])
+@pytest.mark.parametrize("value", ["5", -1, 0, [1], True])
+def test_integer_options_must_be_positive_integers(file_ids, option, value):
+    with pytest.raises(ValueError):
+        build(file_ids, questions=[{"id": "q1", "text": "Frist?"}], **{option: value})
+
+
+def test_concurrency_is_capped(file_ids):
+    assert build(file_ids, questions=[{"id": "q1", "text": "Frist?"}], concurrency=100).concurrency == 4
+
+
+@pytest.mark.parametrize("option", ["retrieval", "batch", "stream_tokens"])
+def test_message_batches_reject_options_they_ignore(file_ids, option):
+    with pytest.raises(ValueError, match=option):
+        build(file_ids, questions=[{"id": "q1", "text": "Frist?"}], mode="message_batch", **{option: True})
+
+
+def message(text: str, stop_reason: str = "end_turn") -> SimpleNamespace:
+    return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)], stop_reason=stop_reason, usage=None)
+
+
+class BudgetClient:
+    """Streams an answer cut off by max_tokens; the unstreamed retry gets the full answer."""
+
+    model, temperature = "test-model", 0.0
+
+    def __init__(self):
+        self.calls = []
+
+    async def upload_file(self, path, tenant=None):
+        return "file-remote"
+
+    async def stream_with_files(self, prompts, file_ids, on_text, context=None, tenant=None, options=None):
+        self.calls.append(("stream", options["max_tokens"]))
+        truncated = '{"antwort": "Der 1. M'
+        for delta in (truncated[:10], truncated[10:]):
+            on_text(delta)
+        return message(truncated, "max_tokens")
+
+    async def ask_with_files(self, prompts, file_ids, context=None, tenant=None, options=None):
+        self.calls.append(("ask", options["max_tokens"]))
+        return message('{"antwort": "Der 1. Mai", "beleg": "Seite 3"}')
+
+
+def test_streamed_item_cut_off_by_its_budget_is_asked_again(file_ids):
+    client = BudgetClient()
+    config = dataclasses.replace(CONFIG, question_max_tokens=64, max_output_tokens=1024, structured_output=False,
+                                 answer_cache_ttl_seconds=0)
+    run = asyncio.run(run_from_payload(client, config, {
+        "file_ids": file_ids, "questions": [{"id": "q1", "text": "Frist?"}], "stream_tokens": True,
+    }))
+    assert isinstance(run, ChecklistRun)
+
+    async def collect():
+        return [event async for event in run.events()]
+
+    events = asyncio.run(collect())
+    result = next(e for e in events if e["type"] == "question_result")
+    assert result["answer"] == "Der 1. Mai"
+    assert client.calls == [("stream", 64), ("ask", 1024)]
+    assert any(e["type"] == "question_partial" for e in events)
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from database import (
+    decode_cursor,
+    discard_new_files,
+    encode_cursor,
+    existing_file_ids,
+    get_conn,
+    get_files_by_ids,
+    insert_file,
+    list_files,
+)
+
+
+def test_list_files_cursor_round_trip():
+    tag = uuid.uuid4().hex
+    ids = {insert_file(f"{tag}-{i}.pdf", f"{tag} {i}".encode())[0] for i in range(7)}
+    # Noise that the filename filter must skip.
+    insert_file("other.pdf", uuid.uuid4().bytes)
+
+    pages, cursor = [], None
+    while True:
+        files, cursor = list_files(limit=3, cursor=cursor, filename=tag)
+        pages.append(files)
+        if cursor is None:
+            break
+
+    assert [len(p) for p in pages] == [3, 3, 1]
+    listed = [f["id"] for page in pages for f in page]
+    assert sorted(listed) == sorted(ids)
+    keys = [(f["created_at"], f["id"]) for page in pages for f in page]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_list_files_last_page_has_no_cursor():
+    tag = uuid.uuid4().hex
+    insert_file(f"{tag}.pdf", tag.encode())
+    files, cursor = list_files(limit=1, filename=tag)
+    assert len(files) == 1 and cursor is None
+
+
+def test_cursor_encoding():
+    assert decode_cursor(encode_cursor("2026-01-02 03:04:05", "abc")) == ("2026-01-02 03:04:05", "abc")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_insert_file_deduplicates_content():
+    content = uuid.uuid4().bytes
+    first, created, _ = insert_file("a.pdf", content)
+    second, created_again, _ = insert_file("b.pdf", content)
+    assert created and not created_again
+    assert first == second
+
+
+def test_concurrent_identical_uploads_share_one_row():
+    content = uuid.uuid4().bytes
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda i: insert_file(f"copy-{i}.pdf", content), range(16)))
+    assert len({file_id for file_id, _, _ in results}) == 1
+    assert sum(created for _, created, _ in results) == 1
+    with get_conn() as c:
+        rows = c.execute("SELECT file_path FROM uploaded_files WHERE id = ?", (results[0][0],)).fetchall()
+    assert len(rows) == 1 and os.path.exists(rows[0][0])
+
+
+def test_discard_new_files_removes_untouched_files():
+    file_id, created, accessed_at = insert_file("new.pdf", uuid.uuid4().bytes)
+    assert created
+    paths = discard_new_files([(file_id, accessed_at)])
+    assert len(paths) == 1
+    assert existing_file_ids([file_id]) == set()
+
+
+def test_discard_new_files_keeps_files_handed_out_meanwhile():
+    content = uuid.uuid4().bytes
+    file_id, _, accessed_at = insert_file("mine.pdf", content)
+    # A concurrent upload of the same content is given the same ID before the rollback.
+    other_id, created, _ = insert_file("theirs.pdf", content)
+    assert other_id == file_id and not created
+    assert discard_new_files([(file_id, accessed_at)]) == []
+    assert existing_file_ids([file_id]) == {file_id}
+
+
+def test_get_files_by_ids_backfills_missing_hashes():
+    content = uuid.uuid4().bytes
+    file_id, _, _ = insert_file("legacy.pdf", content)
+    with get_conn() as c:
+        c.execute("UPDATE uploaded_files SET content_hash = NULL WHERE id = ?", (file_id,))
+    [(path, content_hash)] = get_files_by_ids([file_id])
+    assert content_hash == hashlib.sha256(content).hexdigest()
+    with get_conn() as c:
+        assert c.execute("SELECT content_hash FROM uploaded_files WHERE id = ?", (file_id,)).fetchone()[0] == content_hash
+        # The transaction was committed, not left open.
+        assert not c.in_transaction
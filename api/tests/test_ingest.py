@@ -0,0 +1,88 @@
+import asyncio
+import dataclasses
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+from pypdf import PdfReader
+
+from config import load_config
+from database import get_documents, insert_file
+from ingest import inspect_pdf, normalize_file, normalize_pdf
+
+NO_LIMIT = 10**9
+SAMPLE = Path(__file__).resolve().parents[2] / "data" / "Fragebogen zur Eignungspruefung.pdf"
+
+
+def scan(path: Path, pages: int, px: int) -> Path:
+    """A PDF of scanned pages: one noisy px*px JPEG per page and no fonts."""
+    images = [Image.effect_noise((px, px), 60).convert("RGB") for _ in range(pages)]
+    images[0].save(path, save_all=True, append_images=images[1:], quality=95)
+    return path
+
+
+def ranges(parts: list[dict]) -> list[tuple[int, int]]:
+    return [(p["first_page"], p["last_page"]) for p in parts]
+
+
+def test_inspect_pdf_detects_text_layer(tmp_path):
+    assert inspect_pdf(str(scan(tmp_path / "scan.pdf", 2, 50))) == {"page_count": 2, "has_text_layer": False}
+    assert inspect_pdf(str(SAMPLE)) == {"page_count": 7, "has_text_layer": True}
+
+
+def test_large_images_are_downsampled(tmp_path):
+    path = scan(tmp_path / "scan.pdf", 1, 1600)
+    [part] = normalize_pdf(str(path), str(tmp_path / "scan"), 400, 75, NO_LIMIT, NO_LIMIT)
+
+    data = Path(part["path"]).read_bytes()
+    assert part["path"] == str(tmp_path / "scan.n1.pdf")
+    assert (part["first_page"], part["last_page"]) == (1, 1)
+    assert part["size_bytes"] == len(data) < path.stat().st_size / 10
+    assert part["content_hash"] == hashlib.sha256(data).hexdigest()
+    [image] = PdfReader(part["path"]).pages[0].images
+    assert max(image.image.size) <= 400
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_original_is_kept_without_saving(tmp_path):
+    path = scan(tmp_path / "scan.pdf", 1, 1600)
+    [part] = normalize_pdf(str(path), str(tmp_path / "scan"), 400, 75, NO_LIMIT, NO_LIMIT)
+    # Already normalized: nothing left to save.
+    assert normalize_pdf(part["path"], str(tmp_path / "again"), 400, 75, NO_LIMIT, NO_LIMIT) == []
+    assert not list(tmp_path.glob("again*"))
+
+
+def test_split_by_page_count(tmp_path):
+    path = scan(tmp_path / "scan.pdf", 5, 100)
+    parts = normalize_pdf(str(path), str(tmp_path / "scan"), 0, 75, 2, NO_LIMIT)
+    assert ranges(parts) == [(1, 2), (3, 4), (5, 5)]
+    assert [len(PdfReader(p["path"]).pages) for p in parts] == [2, 2, 1]
+    assert [p["path"] for p in parts] == [str(tmp_path / f"scan.n{no}.pdf") for no in (1, 2, 3)]
+
+
+def test_split_by_size_halves_parts_until_they_fit(tmp_path):
+    path = scan(tmp_path / "scan.pdf", 4, 100)
+    page_bytes = max(p["size_bytes"] for p in normalize_pdf(str(path), str(tmp_path / "pages"), 0, 75, 1, NO_LIMIT))
+    parts = normalize_pdf(str(path), str(tmp_path / "scan"), 0, 75, NO_LIMIT, 2 * page_bytes + 1000)
+    assert ranges(parts) == [(1, 2), (3, 4)]
+    # A single page over the limit is still sent, on its own.
+    parts = normalize_pdf(str(path), str(tmp_path / "tiny"), 0, 75, NO_LIMIT, 1)
+    assert ranges(parts) == [(1, 1), (2, 2), (3, 3), (4, 4)]
+
+
+def test_split_file_is_sent_as_titled_parts(tmp_path):
+    config = dataclasses.replace(load_config(), pdf_image_max_px=0, pdf_max_part_pages=2,
+                                 pdf_max_part_bytes=NO_LIMIT)
+    file_id, _, _ = insert_file("scan.pdf", scan(tmp_path / "scan.pdf", 3, 100).read_bytes())
+    text_id, _, _ = insert_file("notes.txt", tmp_path.name.encode())
+    with ThreadPoolExecutor(1) as pool:
+        for fid in (file_id, text_id):
+            asyncio.run(normalize_file(pool, config, fid))
+
+    documents = get_documents([file_id, text_id], normalized=True)
+    assert sorted(title or "" for _, _, title in documents) == ["", "scan.pdf (Seiten 1-2)", "scan.pdf (Seiten 3-3)"]
+    originals = get_documents([file_id, text_id], normalized=False)
+    assert [title for _, _, title in originals] == [None, None]
+    # The text file has no variant and is sent as is either way.
+    assert [doc for doc in documents if doc[2] is None] == [doc for doc in originals if doc[0].endswith(".txt")]
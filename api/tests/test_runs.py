@@ -0,0 +1,106 @@
+import asyncio
+import dataclasses
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from config import load_config
+from database import insert_file, put_run_result, store_pages
+from runs import UnknownRunError, reevaluate, start_run
+
+# Only model and temperature are read before any model call (they are part of the item keys).
+CLIENT = SimpleNamespace(model="test-model", temperature=0.0)
+CONFIG = dataclasses.replace(load_config(), answer_cache_ttl_seconds=0, document_variant="original")
+
+Q1 = {"id": "q1", "text": "Wann endet die Angebotsfrist?"}
+Q2 = {"id": "q2", "text": "Wer ist der Auftraggeber?"}
+C1 = {"id": "c1", "text": "Nebenangebote sind zugelassen"}
+
+
+def stored_file(*pages: str) -> str:
+    """A stored file with the given page text already indexed."""
+    file_id, _, _ = insert_file(f"{uuid.uuid4().hex}.pdf", uuid.uuid4().bytes)
+    store_pages(file_id, list(pages))
+    return file_id
+
+
+def first_run(file_ids: list[str], questions: list[dict], conditions: list[dict]) -> str:
+    """Store version 1 of a checklist with a result for every item; returns its run ID."""
+
+    async def main():
+        payload = {"file_ids": file_ids, "questions": questions, "conditions": conditions}
+        record, run = await start_run(CLIENT, CONFIG, payload)
+        for kind, item in run.items:
+            event = {"type": f"{kind}_result", "id": item["id"], "raw": "{}"}
+            put_run_result(record["id"], item["id"], kind, run.item_key(kind, item), event)
+        return record["id"]
+
+    return asyncio.run(main())
+
+
+def diff_for(run_id: str, changes: dict) -> dict:
+    record, run, diff = asyncio.run(reevaluate(CLIENT, CONFIG, None, run_id, changes))
+    assert record["version"] == 2
+    assert set(run.reuse) == set(diff["reused"])
+    return diff
+
+
+@pytest.fixture
+def tender():
+    return stored_file("Auftraggeber ist die Stadt Musterstadt.", "Nebenangebote sind nicht zugelassen.")
+
+
+def test_unchanged_checklist_reuses_everything(tender):
+    run_id = first_run([tender], [Q1, Q2], [C1])
+    diff = diff_for(run_id, {})
+    assert diff["reused"] == ["q1", "q2", "c1"]
+    assert diff["recomputed"] == {}
+    assert diff["added_files"] == diff["removed_files"] == diff["removed_items"] == []
+
+
+def test_added_removed_and_edited_items(tender):
+    run_id = first_run([tender], [Q1, Q2], [C1])
+    diff = diff_for(run_id, {"questions": [Q1, {**Q2, "text": "Wer vergibt den Auftrag?"},
+                                           {"id": "q3", "text": "Gibt es Lose?"}],
+                             "conditions": []})
+    assert diff["reused"] == ["q1"]
+    assert diff["recomputed"] == {"q2": "changed", "q3": "new"}
+    assert diff["removed_items"] == ["c1"]
+
+
+def test_added_file_recomputes_only_matching_items(tender):
+    run_id = first_run([tender], [Q1, Q2], [C1])
+    added = stored_file("Die Angebotsfrist endet am 1. Mai um 12 Uhr.")
+    diff = diff_for(run_id, {"file_ids": [tender, added]})
+    assert diff["added_files"] == [added]
+    assert diff["recomputed"] == {"q1": "added_document_matches"}
+    assert diff["reused"] == ["q2", "c1"]
+
+
+def test_added_file_without_text_recomputes_everything(tender):
+    run_id = first_run([tender], [Q1], [C1])
+    scan = stored_file("")
+    diff = diff_for(run_id, {"file_ids": [tender, scan]})
+    assert diff["recomputed"] == {"q1": "documents_added", "c1": "documents_added"}
+    assert diff["reused"] == []
+
+
+def test_removed_file_recomputes_everything(tender):
+    other = stored_file("Die Angebotsfrist endet am 1. Mai.")
+    run_id = first_run([tender, other], [Q1], [C1])
+    diff = diff_for(run_id, {"file_ids": [tender]})
+    assert diff["removed_files"] == [other]
+    assert diff["recomputed"] == {"q1": "documents_removed", "c1": "documents_removed"}
+
+
+def test_full_recheck(tender):
+    run_id = first_run([tender], [Q1], [C1])
+    record, run, diff = asyncio.run(reevaluate(CLIENT, CONFIG, None, run_id, {"full_recheck": True}))
+    assert diff["recomputed"] == {"q1": "full_recheck", "c1": "full_recheck"}
+    assert run.bypass_cache and not run.reuse
+
+
+def test_unknown_run():
+    with pytest.raises(UnknownRunError):
+        asyncio.run(reevaluate(CLIENT, CONFIG, None, "no-such-run", {}))
@@ -0,0 +1,98 @@
+import asyncio
+
+import httpx
+import pytest
+
+from scheduler import Scheduler, is_retryable
+
+
+def status_error(status: int, headers: dict | None = None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://api.example/v1/messages")
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=response)
+
+
+def flaky(*errors: Exception, result="ok"):
+    """send() for Scheduler.call that raises the given errors in turn, then succeeds."""
+    attempts = []
+
+    async def send():
+        attempts.append(len(attempts))
+        if len(attempts) <= len(errors):
+            raise errors[len(attempts) - 1]
+        return result, None
+
+    return send, attempts
+
+
+def scheduler(**kwargs) -> Scheduler:
+    return Scheduler(4, **{"base_delay": 0.001, "max_delay": 0.01, **kwargs})
+
+
+def test_retries_transient_errors_until_success():
+    s = scheduler()
+    send, attempts = flaky(status_error(503), httpx.ConnectError("reset"), status_error(500))
+    assert asyncio.run(s.call(send, metered=False)) == "ok"
+    assert len(attempts) == 4
+    assert s.in_flight == 0
+
+
+def test_does_not_retry_client_errors():
+    s = scheduler()
+    send, attempts = flaky(status_error(400))
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(s.call(send, metered=False))
+    assert len(attempts) == 1
+    assert s.in_flight == 0
+
+
+def test_gives_up_after_max_retries():
+    s = scheduler(max_retries=2)
+    send, attempts = flaky(*[status_error(529)] * 5)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(s.call(send, metered=False))
+    assert len(attempts) == 3
+    assert s.in_flight == 0
+
+
+def test_can_retry_vetoes_retry():
+    s = scheduler()
+    send, attempts = flaky(status_error(503))
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(s.call(send, metered=False, can_retry=lambda: False))
+    assert len(attempts) == 1
+
+
+def test_can_retry_is_asked_on_every_failure():
+    s = scheduler()
+    answers = iter([True, False])
+    send, attempts = flaky(status_error(503), status_error(503))
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(s.call(send, metered=False, can_retry=lambda: next(answers)))
+    assert len(attempts) == 2
+
+
+def test_backoff_honours_retry_after():
+    s = scheduler()
+    assert s.backoff(0, httpx.Headers({"retry-after": "7"})) >= 7
+    # Unparseable or missing retry-after falls back to the exponential delay.
+    assert s.backoff(0, httpx.Headers({"retry-after": "soon"})) <= 0.001
+    assert s.backoff(0, None) <= 0.001
+    assert s.backoff(10, None) <= s.max_delay
+
+
+def test_throttling_halves_window_and_pauses_everyone():
+    s = scheduler()
+    send, attempts = flaky(status_error(429, {"retry-after": "0.05"}))
+    assert asyncio.run(s.call(send, metered=False)) == "ok"
+    assert len(attempts) == 2
+    assert s.window < 4
+    assert s.paused_until > 0
+
+
+def test_is_retryable():
+    assert is_retryable(status_error(429))
+    assert is_retryable(status_error(529))
+    assert is_retryable(httpx.ReadTimeout("slow"))
+    assert not is_retryable(status_error(404))
+    assert not is_retryable(ValueError("bad"))
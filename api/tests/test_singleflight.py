@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_result():
+    async def main():
+        flight, calls = SingleFlight(), []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "file-1"
+
+        results = await asyncio.gather(*(flight.do(("upload", "h"), fn) for _ in range(5)))
+        return results, calls, flight
+
+    results, calls, flight = asyncio.run(main())
+    assert results == ["file-1"] * 5
+    assert len(calls) == 1
+    assert flight.shared == 4
+
+
+def test_error_reaches_every_waiter_and_is_not_kept():
+    async def main():
+        flight, calls = SingleFlight(), []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+
+        async def working():
+            calls.append(1)
+            return "ok"
+
+        # Nothing is cached once the call has finished: the next caller runs afresh.
+        return results, await flight.do("k", working), calls
+
+    results, retried, calls = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) and str(r) == "upstream down" for r in results)
+    assert retried == "ok"
+    assert len(calls) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(flight.do("k", fn))
+        second = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_last_waiter_cancels_shared_call():
+    async def main():
+        flight, cancelled = SingleFlight(), asyncio.Event()
+
+        async def fn():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        task = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return cancelled.is_set()
+
+    assert asyncio.run(main())
@@ -0,0 +1,135 @@
+import asyncio
+import dataclasses
+import os
+import time
+import uuid
+
+import pytest
+
+from config import load_config
+from database import (
+    FILES_DIR,
+    create_job,
+    existing_file_ids,
+    get_conn,
+    insert_file,
+    set_job_status,
+    set_remote_file_id,
+    stored_bytes,
+    workspace_key,
+)
+from storage import StorageManager
+
+GRACE_SECONDS = 60
+
+
+class DeletingClient:
+    def __init__(self):
+        self.deleted = []
+
+    async def delete_file(self, file_id, tenant=None):
+        self.deleted.append(file_id)
+
+
+@pytest.fixture
+def manager():
+    config = dataclasses.replace(load_config(), api_key=uuid.uuid4().hex, storage_grace_seconds=GRACE_SECONDS,
+                                 storage_max_bytes=0, remote_max_files=0)
+    return StorageManager(DeletingClient(), config)
+
+
+@pytest.fixture
+def job():
+    """Creates unfinished jobs for the test and finishes them afterwards."""
+    ids = []
+
+    def create(payload: dict) -> str:
+        ids.append(create_job(payload, 1))
+        return ids[-1]
+
+    yield create
+    for job_id in ids:
+        set_job_status(job_id, "done")
+
+
+def stored_file(last_access: float) -> tuple[str, str]:
+    """(id, content hash) of a new stored file last accessed at last_access."""
+    content = uuid.uuid4().bytes * 100
+    file_id, _, _ = insert_file(f"{uuid.uuid4().hex}.pdf", content)
+    with get_conn() as c:
+        c.execute("UPDATE uploaded_files SET last_access = ? WHERE id = ?", (last_access, file_id))
+        content_hash = c.execute("SELECT content_hash FROM uploaded_files WHERE id = ?", (file_id,)).fetchone()[0]
+    return file_id, content_hash
+
+
+def remote_copy(manager: StorageManager, content_hash: str, last_access: float, ttl: float = 3600) -> str:
+    remote_id = "file_" + uuid.uuid4().hex
+    set_remote_file_id(content_hash, manager.workspace, remote_id, ttl)
+    with get_conn() as c:
+        c.execute("UPDATE remote_files SET last_access = ? WHERE remote_file_id = ?", (last_access, remote_id))
+    return remote_id
+
+
+def old(path):
+    past = time.time() - 2 * GRACE_SECONDS
+    os.utime(path, (past, past))
+
+
+def test_orphans_and_partial_uploads_are_removed(manager):
+    orphan, partial, fresh = (FILES_DIR / name for name in (f"{uuid.uuid4()}.pdf", f".{uuid.uuid4()}.part",
+                                                           f"{uuid.uuid4()}.pdf"))
+    for path in (orphan, partial, fresh):
+        path.write_bytes(b"x")
+    old(orphan)
+    old(partial)
+    kept_id, _ = stored_file(time.time())
+    with get_conn() as c:
+        old(c.execute("SELECT file_path FROM uploaded_files WHERE id = ?", (kept_id,)).fetchone()[0])
+
+    assert asyncio.run(manager.remove_orphans()) >= 2
+    assert not orphan.exists() and not partial.exists()
+    # Too young to tell from an upload that is just being moved into place.
+    assert fresh.exists()
+    assert existing_file_ids([kept_id]) == {kept_id}
+    fresh.unlink()
+
+
+def test_disk_quota_evicts_least_recently_used_unprotected_files(manager, job):
+    protected, _ = stored_file(1)
+    oldest, _ = stored_file(2)
+    older, _ = stored_file(3)
+    recent, _ = stored_file(time.time())
+    job({"file_ids": [protected], "questions": []})
+    with get_conn() as c:
+        size = c.execute("SELECT size_bytes FROM uploaded_files WHERE id = ?", (oldest,)).fetchone()[0]
+    manager.config = dataclasses.replace(manager.config, storage_max_bytes=stored_bytes() - 2 * size)
+
+    assert asyncio.run(manager.enforce_disk_quota()) == 2
+    assert existing_file_ids([protected, oldest, older, recent]) == {protected, recent}
+
+
+def test_stale_remote_copies_are_deleted_unless_a_batch_uses_them(manager, job):
+    _, gone_hash = stored_file(time.time())
+    batch_file, batch_hash = stored_file(time.time())
+    orphaned = remote_copy(manager, "no-longer-stored-" + gone_hash, time.time())
+    expired = remote_copy(manager, gone_hash, time.time(), ttl=-1)
+    in_batch = remote_copy(manager, batch_hash, time.time(), ttl=-1)
+    job({"mode": "message_batch", "file_ids": [batch_file], "questions": []})
+
+    assert asyncio.run(manager.enforce_remote_quota()) == 2
+    assert sorted(manager.client.deleted) == sorted([orphaned, expired])
+    assert in_batch not in manager.client.deleted
+
+
+def test_remote_quota_evicts_least_recently_used_unprotected_copies(manager, job):
+    files = [stored_file(time.time()) for _ in range(4)]
+    in_batch = remote_copy(manager, files[0][1], 1)
+    oldest = remote_copy(manager, files[1][1], 2)
+    older = remote_copy(manager, files[2][1], 3)
+    recent = remote_copy(manager, files[3][1], time.time())
+    job({"mode": "message_batch", "file_ids": [files[0][0]], "questions": []})
+    manager.config = dataclasses.replace(manager.config, remote_max_files=2)
+
+    assert asyncio.run(manager.enforce_remote_quota()) == 2
+    assert sorted(manager.client.deleted) == sorted([oldest, older])
+    assert in_batch not in manager.client.deleted and recent not in manager.client.deleted
@@ -0,0 +1,60 @@
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+from database import list_files
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("UPLOAD_MAX_REQUEST_BYTES", "100000")
+    monkeypatch.setenv("INGEST_WORKERS", "1")
+    monkeypatch.setenv("JOB_WORKERS", "1")
+    with TestClient(app_module.app, raise_server_exceptions=False) as c:
+        yield c
+
+
+def listed(tag: str) -> list[dict]:
+    return list_files(filename=tag)[0]
+
+
+def test_identical_files_in_one_upload_share_an_id(client):
+    tag, content = uuid.uuid4().hex, uuid.uuid4().bytes
+    r = client.post("/upload", files=[("files", (f"{tag}-a.pdf", content)), ("files", (f"{tag}-b.pdf", content))])
+    assert r.status_code == 200
+    ids = [f["id"] for f in r.json()["files"]]
+    assert len(set(ids)) == 1
+    assert [f["id"] for f in listed(tag)] == ids[:1]
+
+
+def test_rejected_file_stores_nothing(client):
+    tag = uuid.uuid4().hex
+    r = client.post("/upload", files=[("files", (f"{tag}-ok.pdf", uuid.uuid4().bytes)),
+                                      ("files", (f"{tag}-empty.pdf", b""))])
+    assert r.status_code == 400
+    assert listed(tag) == []
+
+
+def test_failed_store_removes_files_of_the_request(client, monkeypatch):
+    tag = uuid.uuid4().hex
+    insert_file = app_module.insert_file
+
+    def failing_insert(filename, content, max_bytes=None):
+        if filename.endswith("broken.pdf"):
+            raise OSError("disk full")
+        return insert_file(filename, content, max_bytes)
+
+    monkeypatch.setattr(app_module, "insert_file", failing_insert)
+    r = client.post("/upload", files=[("files", (f"{tag}-ok.pdf", uuid.uuid4().bytes)),
+                                      ("files", (f"{tag}-broken.pdf", uuid.uuid4().bytes))])
+    assert r.status_code == 500
+    assert listed(tag) == []
+
+
+def test_oversized_request_is_rejected_before_reading(client):
+    tag = uuid.uuid4().hex
+    r = client.post("/upload", files=[("files", (f"{tag}.pdf", b"x" * 200000))])
+    assert r.status_code == 413
+    assert listed(tag) == []
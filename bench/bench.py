@@ -0,0 +1,353 @@
+"""Benchmark /upload and /ask against a local fake Anthropic API.
+
+Starts scripts/fake_anthropic.py in-process and the API (uvicorn) as a subprocess with a
+throwaway data directory, uploads the PDFs, then drives /ask with the configured
+concurrency and checklist size. The report is printed and optionally written as JSON;
+pass an earlier report as --baseline to see the relative change.
+
+    python bench.py --runs 50 --concurrency 10 --questions 20 --conditions 5 \\
+        --latency lognormal:1.0,0.4 --output results/today.json --baseline results/main.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "scripts"))
+
+import fake_anthropic  # noqa: E402
+
+QUESTIONS = [
+    "In welcher Form sind die Angebote/Teilnahmeanträge einzureichen?",
+    "Wann ist die Frist für die Einreichung von Bieterfragen?",
+    "Wann endet die Angebotsfrist?",
+    "Welche Zuschlagskriterien werden angewendet und wie sind sie gewichtet?",
+    "Welche Nachweise zur Eignung sind mit dem Angebot vorzulegen?",
+    "Wie lange ist die Bindefrist des Angebots?",
+    "Ist die Bildung von Bietergemeinschaften zulässig?",
+    "Welche Mindestumsätze werden gefordert?",
+    "Wer ist der Auftraggeber?",
+    "Wie hoch ist die geforderte Berufshaftpflichtversicherung?",
+    "Welche Referenzen werden verlangt?",
+    "Sind Nebenangebote zugelassen?",
+    "Wie ist die Laufzeit des Vertrags?",
+    "Welche Vergabeart wird angewendet?",
+    "Ist eine Besichtigung vor Ort vorgesehen?",
+]
+CONDITIONS = [
+    "Ist die Abgabefrist vor dem 31.12.2025?",
+    "Ist eine elektronische Angebotsabgabe zwingend?",
+    "Sind Nebenangebote zugelassen?",
+    "Wird eine Eigenerklärung zur Tariftreue verlangt?",
+    "Ist der Auftrag in Lose aufgeteilt?",
+    "Ist eine Sicherheitsleistung erforderlich?",
+]
+RESULT_TYPES = ("question_result", "condition_result")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values: list[float]) -> dict:
+    """Nearest-rank p50/p95/p99 plus mean and max, in seconds."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+    return {
+        "p50": round(rank(50), 4),
+        "p95": round(rank(95), 4),
+        "p99": round(rank(99), 4),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    """Peak resident set size (VmHWM) of a process; Linux only."""
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return None
+    m = re.search(r"^VmHWM:\s+(\d+) kB", status, re.MULTILINE)
+    return round(int(m.group(1)) / 1024, 1) if m else None
+
+
+def checklist(run_index: int, n_questions: int, n_conditions: int, unique: bool) -> dict:
+    suffix = f" (Lauf {run_index})" if unique else ""
+    questions = [
+        {"id": f"q{i}", "text": QUESTIONS[i % len(QUESTIONS)] + (f" [{i // len(QUESTIONS)}]" if i >= len(QUESTIONS) else "") + suffix}
+        for i in range(n_questions)
+    ]
+    conditions = [
+        {"id": f"c{i}", "text": CONDITIONS[i % len(CONDITIONS)] + (f" [{i // len(CONDITIONS)}]" if i >= len(CONDITIONS) else "") + suffix}
+        for i in range(n_conditions)
+    ]
+    return {"questions": questions, "conditions": conditions}
+
+
+def start_api(port: int, fake_url: str, data_dir: str, env: dict, log_path: Path) -> subprocess.Popen:
+    full_env = {
+        **os.environ,
+        "ANTHROPIC_API_KEY": "bench",
+        "ANTHROPIC_BASE_URL": fake_url,
+        "API_DATA_DIR": data_dir,
+        **env,
+    }
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT / "api",
+        env=full_env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, base: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("API exited during startup, see the API log")
+        try:
+            if (await client.get(f"{base}/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API did not become ready")
+
+
+async def wait_for_indexing(client: httpx.AsyncClient, base: str, n_files: int, timeout: float = 120):
+    """Wait until text extraction and normalization have run for every upload.
+
+    Both run in the background after /upload; waiting keeps them from competing with
+    /ask and, with DOCUMENT_VARIANT=normalized, makes every request use the same documents.
+    """
+    deadline = time.monotonic() + timeout
+    stages = ("text_extraction", "normalization")
+    patterns = [re.compile(rf'^checklist_stage_seconds_count\{{stage="{stage}"\}} (\S+)$', re.MULTILINE)
+                for stage in stages]
+    while time.monotonic() < deadline:
+        text = (await client.get(f"{base}/metrics")).text
+        matches = [pattern.search(text) for pattern in patterns]
+        if all(m and float(m.group(1)) >= n_files for m in matches):
+            return
+        await asyncio.sleep(0.25)
+    raise RuntimeError("Uploads were not indexed and normalized in time, see the API log")
+
+
+async def upload(client: httpx.AsyncClient, base: str, paths: list[Path]) -> tuple[list[str], float]:
+    started = time.perf_counter()
+    handles = [open(p, "rb") for p in paths]
+    try:
+        resp = await client.post(
+            f"{base}/upload",
+            files=[("files", (p.name, f, "application/pdf")) for p, f in zip(paths, handles)],
+        )
+    finally:
+        for f in handles:
+            f.close()
+    resp.raise_for_status()
+    return [f["id"] for f in resp.json()["files"]], time.perf_counter() - started
+
+
+async def one_run(client: httpx.AsyncClient, base: str, payload: dict) -> dict:
+    started = time.perf_counter()
+    first_result = None
+    results = errors = 0
+    async with client.stream("POST", f"{base}/ask", json=payload) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] in RESULT_TYPES:
+                results += 1
+                if first_result is None:
+                    first_result = time.perf_counter() - started
+            elif event["type"] == "error":
+                errors += 1
+    return {"first_result": first_result, "done": time.perf_counter() - started, "results": results, "errors": errors}
+
+
+async def drive(client: httpx.AsyncClient, base: str, file_ids: list[str], args) -> tuple[list[dict], int, float]:
+    options = {
+        "file_ids": file_ids,
+        "order": args.order,
+        "batch": args.batch,
+        "stream_tokens": args.stream_tokens,
+        "retrieval": args.retrieval,
+        "bypass_cache": not args.cache,
+        "beleg": args.beleg,
+    }
+    for i in range(args.warmup):
+        await one_run(client, base, {**checklist(-1 - i, args.questions, args.conditions, args.unique), **options})
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failed = 0
+
+    async def bounded(i: int) -> dict | None:
+        nonlocal failed
+        async with semaphore:
+            try:
+                return await one_run(client, base, {**checklist(i, args.questions, args.conditions, args.unique), **options})
+            except httpx.HTTPError as e:
+                failed += 1
+                print(f"run {i} failed: {e}", file=sys.stderr)
+                return None
+
+    started = time.perf_counter()
+    runs = await asyncio.gather(*(bounded(i) for i in range(args.runs)))
+    return [r for r in runs if r is not None], failed, time.perf_counter() - started
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict):
+    rows = [
+        ("runs/sec", ("runs_per_sec",), True),
+        ("items/sec", ("items_per_sec",), True),
+        ("ttfr p50", ("time_to_first_result_s", "p50"), False),
+        ("ttfr p95", ("time_to_first_result_s", "p95"), False),
+        ("ttfr p99", ("time_to_first_result_s", "p99"), False),
+        ("done p50", ("time_to_done_s", "p50"), False),
+        ("done p95", ("time_to_done_s", "p95"), False),
+        ("done p99", ("time_to_done_s", "p99"), False),
+        ("peak RSS MB", ("api_peak_rss_mb",), False),
+    ]
+
+    def get(d: dict, path: tuple):
+        for key in path:
+            d = d.get(key) if isinstance(d, dict) else None
+        return d
+
+    print(f"\n{'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for label, path, higher_is_better in rows:
+        old, new = get(baseline, path), get(report, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = change >= 0 if higher_is_better else change <= 0
+        print(f"{label:<12} {old:>10} {new:>10} {change:>+7.1f}% {'' if abs(change) < 1 else ('better' if better else 'worse')}")
+
+
+async def main_async(args) -> dict:
+    random.seed(args.seed)
+    state = fake_anthropic.FakeAnthropic(
+        delta_seconds=args.delta_seconds,
+        rpm=args.rpm,
+        overload_rate=args.overload_rate,
+        error_rate=args.error_rate,
+        message_latency=fake_anthropic.parse_latency(args.latency),
+        upload_latency=fake_anthropic.parse_latency(args.upload_latency),
+    )
+    fake_server, fake_url = fake_anthropic.start(0, state)
+    env = dict(kv.split("=", 1) for kv in args.env)
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="forgent-bench-") as data_dir:
+        log_path = Path(data_dir) / "api.log"
+        proc = start_api(port, fake_url, data_dir, env, log_path)
+        try:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(args.timeout), limits=httpx.Limits(
+                    max_connections=args.concurrency + 4)) as client:
+                await wait_until_ready(client, base, proc)
+                paths = [Path(p) for p in args.files]
+                file_ids, upload_seconds = await upload(client, base, paths)
+                await wait_for_indexing(client, base, len(paths))
+                runs, failed, elapsed = await drive(client, base, file_ids, args)
+            rss = peak_rss_mb(proc.pid)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+            fake_server.shutdown()
+        if proc.returncode not in (0, -15) and args.verbose:
+            print(log_path.read_text(), file=sys.stderr)
+
+    items = sum(r["results"] for r in runs)
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "verbose")},
+        "runs": len(runs),
+        "failed_runs": failed,
+        "item_errors": sum(r["errors"] for r in runs),
+        "items": items,
+        "duration_s": round(elapsed, 3),
+        "runs_per_sec": round(len(runs) / elapsed, 3) if elapsed else None,
+        "items_per_sec": round(items / elapsed, 3) if elapsed else None,
+        "upload_s": round(upload_seconds, 3),
+        "time_to_first_result_s": percentiles([r["first_result"] for r in runs if r["first_result"] is not None]),
+        "time_to_done_s": percentiles([r["done"] for r in runs]),
+        "api_peak_rss_mb": rss,
+        "upstream": dict(state.counts),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=20, help="measured /ask runs")
+    ap.add_argument("--warmup", type=int, default=1, help="unmeasured /ask runs before (uploads files to the fake)")
+    ap.add_argument("--concurrency", type=int, default=4, help="concurrent /ask runs")
+    ap.add_argument("--questions", type=int, default=10)
+    ap.add_argument("--conditions", type=int, default=3)
+    ap.add_argument("--files", nargs="+", default=sorted(str(p) for p in (ROOT / "data").glob("*.pdf")))
+    ap.add_argument("--unique", action="store_true", help="make every run's item texts unique (no coalescing)")
+    ap.add_argument("--cache", action="store_true", help="allow answer cache hits (default: bypass_cache)")
+    ap.add_argument("--order", choices=("input", "completion"), default="input")
+    ap.add_argument("--batch", action="store_true")
+    ap.add_argument("--stream-tokens", action="store_true")
+    ap.add_argument("--retrieval", action="store_true")
+    ap.add_argument("--beleg", choices=("full", "terse", "none"), default="full")
+    ap.add_argument("--latency", default="lognormal:0.5,0.3", help='fake /v1/messages latency, e.g. "fixed:0.2"')
+    ap.add_argument("--upload-latency", default="fixed:0.05", help="fake /v1/files latency")
+    ap.add_argument("--delta-seconds", type=float, default=0.0, help="pause between streamed deltas")
+    ap.add_argument("--rpm", type=int, default=None, help="fake requests/minute limit (429 above)")
+    ap.add_argument("--overload-rate", type=float, default=0.0, help="fraction of fake 529 responses")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake 500 responses")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra API environment, repeatable")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--timeout", type=float, default=300.0, help="per-request timeout in seconds")
+    ap.add_argument("--output", type=Path, help="write the JSON report here")
+    ap.add_argument("--baseline", type=Path, help="earlier JSON report to compare against")
+    ap.add_argument("--verbose", action="store_true", help="print the API log if it did not exit cleanly")
+    args = ap.parse_args()
+
+    report = asyncio.run(main_async(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    if args.baseline:
+        compare(report, json.loads(args.baseline.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -148,6 +148,7 @@ export default function Home() {
         questions: questions.map(q => ({ id: q.id, text: q.text })),
         conditions: conditions.map(c => ({ id: c.id, text: c.text })),
         file_ids: files.map(file => file.id),
+        order: "completion",
       });
       const res = await fetch(`${API_BASE}/ask`, {
         method: "POST",
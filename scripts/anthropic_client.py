@@ -3,36 +3,42 @@ import httpx
 from typing import List
 from anthropic import Anthropic
 
+FILES_BETA = "files-api-2025-04-14"
+
 class AnthropicClient:
-    def __init__(self, api_key: str, model: str, temperature: float, max_tokens: int, system: str | None = None):
+    def __init__(self, api_key: str, model: str, temperature: float, max_tokens: int, system: str | None = None,
+                 base_url: str = "https://api.anthropic.com", max_retries: int = 2):
         self.api_key = api_key
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.system = system
+        self.base_url = base_url.rstrip("/")
         self.client = Anthropic(
             api_key=api_key,
+            base_url=self.base_url,
             default_headers={
-                "anthropic-beta": "files-api-2025-04-14",
+                "anthropic-beta": FILES_BETA,
             },
+            max_retries=max_retries,
         )
 
-    def upload_files(self, paths: List[str]) -> List[str]:
-        file_ids = []
+    def upload_file(self, path: str) -> str:
         headers = {
             "x-api-key": self.api_key,
             "anthropic-version": "2023-06-01",
             "anthropic-beta": FILES_BETA,
         }
-        url = "https://api.anthropic.com/v1/files"
-        for p in paths:
-            with open(p, "rb") as f:
-                resp = httpx.post(url, headers=headers, files={"file": (os.path.basename(p), f)})
-            resp.raise_for_status()
-            file_ids.append(resp.json()["id"])
-        return file_ids
+        with open(path, "rb") as f:
+            resp = httpx.post(f"{self.base_url}/v1/files", headers=headers,
+                              files={"file": (os.path.basename(path), f)}, timeout=120)
+        resp.raise_for_status()
+        return resp.json()["id"]
 
-    def ask_with_files(self, prompts: List[dict], file_ids: List[str]) -> dict:
+    def upload_files(self, paths: List[str]) -> List[str]:
+        return [self.upload_file(p) for p in paths]
+
+    def message_params(self, prompts: List[dict], file_ids: List[str]) -> dict:
         content_blocks = []
         for pr in prompts:
             content_blocks.append({"type": "text", "text": pr["text"]})
@@ -47,6 +53,18 @@ class AnthropicClient:
         )
         if self.system:
             kwargs["system"] = self.system
+        return kwargs
 
-        msg = self.client.messages.create(**kwargs)
+    def ask_with_files(self, prompts: List[dict], file_ids: List[str]) -> dict:
+        msg = self.client.messages.create(**self.message_params(prompts, file_ids))
         return msg
+
+    def create_message_batch(self, requests: List[dict]):
+        """Submit {"custom_id", "params"} requests to the Message Batches API."""
+        return self.client.messages.batches.create(requests=requests)
+
+    def retrieve_message_batch(self, batch_id: str):
+        return self.client.messages.batches.retrieve(batch_id)
+
+    def message_batch_results(self, batch_id: str):
+        return self.client.messages.batches.results(batch_id)
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 @dataclass(frozen=True)
 class Config:
     api_key: str
+    base_url: str
     model: str
     max_output_tokens: int
     temperature: float
@@ -14,6 +15,7 @@ def load_config() -> Config:
     load_dotenv()
     return Config(
         api_key=os.getenv("ANTHROPIC_API_KEY", ""),
+        base_url=os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com"),
         model=os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-latest"),
         max_output_tokens=int(os.getenv("ANTHROPIC_MAX_TOKENS", "1024")),
         temperature=float(os.getenv("ANTHROPIC_TEMP", "0")),
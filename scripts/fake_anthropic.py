@@ -0,0 +1,368 @@
+"""Local stand-in for the Anthropic Files, Messages and Message Batches endpoints.
+
+Answers are canned JSON derived from the prompt, so the checklist code paths (single
+items, batched items, streamed items, Message Batches) can be exercised without API quota:
+
+    python fake_anthropic.py --port 8089 --batch-seconds 5
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 python main.py --bulk ...
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+BATCH_ITEM_RE = re.compile(r'- id "([^"]+)" \((Frage|Bedingung)\)')
+
+
+def parse_latency(spec: str | None) -> Callable[[], float] | None:
+    """Latency sampler from "fixed:S", "uniform:LO,HI", "normal:MEAN,SD" or "lognormal:MEDIAN,SIGMA" (seconds)."""
+    if not spec:
+        return None
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(*values)
+    if kind == "normal" and len(values) == 2:
+        return lambda: max(0.0, random.gauss(*values))
+    if kind == "lognormal" and len(values) == 2:
+        median, sigma = values
+        return lambda: median * math.exp(random.gauss(0, sigma))
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def iso(ts: float | None) -> str | None:
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def prompt_text(params: dict) -> str:
+    """Text of the last text block of the last user message."""
+    content = params["messages"][-1]["content"]
+    if isinstance(content, str):
+        return content
+    texts = [blk.get("text", "") for blk in content if blk.get("type") == "text"]
+    return texts[-1] if texts else ""
+
+
+def canned_answer(text: str, beleg: bool = True):
+    """Answer object (an array for batched items) for the item(s) in a prompt."""
+    extra = {"beleg": "Stub, Seite 1"} if beleg else {}
+    batch_items = BATCH_ITEM_RE.findall(text)
+    if batch_items:
+        return [
+            {"id": item_id, "antwort": "Stub-Antwort", **extra} if label == "Frage"
+            else {"id": item_id, "result": True, **extra}
+            for item_id, label in batch_items
+        ]
+    if "Bedingung:" in text:
+        return {"result": True, **extra}
+    return {"antwort": "Stub-Antwort", **extra}
+
+
+def pick_tool(tools: list[dict], answer) -> dict | None:
+    """The tool whose input schema fits the answer: an items array, a result or an antwort."""
+    wanted = "items" if isinstance(answer, list) else "result" if "result" in answer else "antwort"
+    for tool in tools:
+        if wanted in tool.get("input_schema", {}).get("properties", {}):
+            return tool
+    return None
+
+
+def fake_message(params: dict) -> dict:
+    text = prompt_text(params)
+    tool = None
+    if params.get("tools"):
+        tool = pick_tool(params["tools"], canned_answer(text))
+    if tool is not None:
+        properties = tool["input_schema"]["properties"]
+        item_properties = properties.get("items", {}).get("items", {}).get("properties", properties)
+        answer = canned_answer(text, beleg="beleg" in item_properties)
+        tool_input = {"items": answer} if isinstance(answer, list) else answer
+        content = {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": tool["name"], "input": tool_input}
+        output = json.dumps(tool_input, ensure_ascii=False)
+        stop_reason = "tool_use"
+    else:
+        output = json.dumps(canned_answer(text, beleg='"beleg"' in text), ensure_ascii=False)
+        content = {"type": "text", "text": output}
+        stop_reason = "end_turn"
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "stub"),
+        "content": [content],
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": len(json.dumps(params)) // 4,
+            "output_tokens": len(output) // 4,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        },
+    }
+
+
+def stream_events(message: dict, chunk_chars: int = 8):
+    """Server-sent events of a streamed message, with its text (or tool input) split into small deltas."""
+    block = message["content"][0]
+    if block["type"] == "tool_use":
+        text = json.dumps(block["input"], ensure_ascii=False)
+        first, delta_type, field = {**block, "input": {}}, "input_json_delta", "partial_json"
+    else:
+        text = block["text"]
+        first, delta_type, field = {"type": "text", "text": ""}, "text_delta", "text"
+    start = {**message, "content": [], "stop_reason": None, "usage": {**message["usage"], "output_tokens": 1}}
+    yield "message_start", {"type": "message_start", "message": start}
+    yield "content_block_start", {"type": "content_block_start", "index": 0, "content_block": first}
+    for i in range(0, len(text), chunk_chars):
+        yield "content_block_delta", {
+            "type": "content_block_delta", "index": 0, "delta": {"type": delta_type, field: text[i:i + chunk_chars]},
+        }
+    yield "content_block_stop", {"type": "content_block_stop", "index": 0}
+    yield "message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]},
+    }
+    yield "message_stop", {"type": "message_stop"}
+
+
+class FakeAnthropic:
+    """In-memory state shared by all request handlers."""
+
+    def __init__(self, batch_seconds: float = 2.0, delta_seconds: float = 0.0, rpm: int | None = None,
+                 overload_rate: float = 0.0, error_rate: float = 0.0,
+                 message_latency: Callable[[], float] | None = None,
+                 upload_latency: Callable[[], float] | None = None):
+        self.batch_seconds = batch_seconds
+        self.delta_seconds = delta_seconds
+        self.rpm = rpm
+        self.overload_rate = overload_rate
+        self.error_rate = error_rate
+        self.message_latency = message_latency
+        self.upload_latency = upload_latency
+        self.counts = {"files": 0, "messages": 0, "batches": 0, "errors": 0}
+        self.lock = threading.Lock()
+        self.files: dict[str, int] = {}
+        self.batches: dict[str, dict] = {}
+        self.message_times: list[float] = []
+        self.throttled = 0
+
+    def admit_message(self) -> tuple[int, dict]:
+        """Status and rate-limit headers for a new /v1/messages call (sliding one-minute window)."""
+        now = time.time()
+        with self.lock:
+            self.message_times = [t for t in self.message_times if t > now - 60]
+            self.counts["messages"] += 1
+            if self.overload_rate and random.random() < self.overload_rate:
+                self.counts["errors"] += 1
+                return 529, {}
+            if self.error_rate and random.random() < self.error_rate:
+                self.counts["errors"] += 1
+                return 500, {}
+            if self.rpm is None:
+                return 200, {}
+            status = 200
+            if len(self.message_times) >= self.rpm:
+                status = 429
+                self.throttled += 1
+            else:
+                self.message_times.append(now)
+            reset = (self.message_times[0] if self.message_times else now) + 60
+            headers = {
+                "anthropic-ratelimit-requests-limit": str(self.rpm),
+                "anthropic-ratelimit-requests-remaining": str(self.rpm - len(self.message_times)),
+                "anthropic-ratelimit-requests-reset": iso(reset),
+            }
+            if status == 429:
+                headers["retry-after"] = str(max(1, int(reset - now)))
+                self.counts["errors"] += 1
+            return status, headers
+
+    def batch_object(self, batch_id: str, base_url: str) -> dict:
+        batch = self.batches[batch_id]
+        ended = time.time() - batch["created_at"] >= self.batch_seconds
+        n = len(batch["requests"])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else n,
+                "succeeded": n if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": iso(batch["created_at"]),
+            "expires_at": iso(batch["created_at"] + 24 * 3600),
+            "ended_at": iso(batch["created_at"] + self.batch_seconds) if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{base_url}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+
+def make_handler(state: FakeAnthropic):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def base_url(self) -> str:
+            return f"http://{self.headers.get('Host', '%s:%d' % self.server.server_address)}"
+
+        def body(self) -> bytes:
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    chunk = self.rfile.read(size)
+                    self.rfile.readline()
+                    if size == 0:
+                        return b"".join(chunks)
+                    chunks.append(chunk)
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def send(self, status: int, payload, content_type: str = "application/json", headers: dict | None = None):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_stream(self, message: dict, headers: dict):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for name, data in stream_events(message):
+                    self.wfile.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+                    self.wfile.flush()
+                    if name == "content_block_delta" and state.delta_seconds:
+                        time.sleep(state.delta_seconds)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def not_found(self):
+            self.send(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            body = self.body()
+            if path == "/v1/files":
+                if state.upload_latency:
+                    time.sleep(state.upload_latency())
+                file_id = f"file_{uuid.uuid4().hex[:24]}"
+                with state.lock:
+                    state.files[file_id] = len(body)
+                    state.counts["files"] += 1
+                self.send(200, {"id": file_id, "type": "file", "size_bytes": len(body)})
+            elif path == "/v1/messages":
+                params = json.loads(body)
+                status, headers = state.admit_message()
+                if state.message_latency:
+                    time.sleep(state.message_latency())
+                if status == 429:
+                    self.send(429, {"type": "error", "error": {"type": "rate_limit_error", "message": "rpm"}},
+                              headers=headers)
+                elif status == 529:
+                    self.send(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+                elif status == 500:
+                    self.send(500, {"type": "error", "error": {"type": "api_error", "message": "Internal error"}})
+                elif params.get("stream"):
+                    self.send_stream(fake_message(params), headers)
+                else:
+                    self.send(200, fake_message(params), headers=headers)
+            elif path == "/v1/messages/batches":
+                batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+                with state.lock:
+                    state.batches[batch_id] = {"requests": json.loads(body)["requests"], "created_at": time.time()}
+                    state.counts["batches"] += 1
+                self.send(200, state.batch_object(batch_id, self.base_url()))
+            else:
+                self.not_found()
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            m = re.fullmatch(r"/v1/messages/batches/([^/]+)(/results)?", path)
+            if not m or m.group(1) not in state.batches:
+                return self.not_found()
+            batch_id = m.group(1)
+            if not m.group(2):
+                return self.send(200, state.batch_object(batch_id, self.base_url()))
+            lines = [
+                json.dumps({
+                    "custom_id": req["custom_id"],
+                    "result": {"type": "succeeded", "message": fake_message(req["params"])},
+                }, ensure_ascii=False)
+                for req in state.batches[batch_id]["requests"]
+            ]
+            self.send(200, ("\n".join(lines) + "\n").encode(), "application/x-jsonl")
+
+        def do_DELETE(self):
+            m = re.fullmatch(r"/v1/files/([^/]+)", self.path.split("?")[0])
+            with state.lock:
+                found = m is not None and state.files.pop(m.group(1), None) is not None
+            if not found:
+                return self.not_found()
+            self.send(200, {"id": m.group(1), "type": "file_deleted"})
+
+    return Handler
+
+
+def start(port: int = 0, state: FakeAnthropic | None = None) -> tuple[ThreadingHTTPServer, str]:
+    """Serve in a background thread; returns the server and its base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state or FakeAnthropic()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--batch-seconds", type=float, default=2.0, help="time until a message batch has ended")
+    ap.add_argument("--delta-seconds", type=float, default=0.0, help="pause between streamed text deltas")
+    ap.add_argument("--rpm", type=int, default=None, help="answer /v1/messages with 429 above this many requests/minute")
+    ap.add_argument("--overload-rate", type=float, default=0.0, help="fraction of /v1/messages answered with 529")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of /v1/messages answered with 500")
+    ap.add_argument("--latency", default=None, help='/v1/messages latency, e.g. "lognormal:1.5,0.5" (see parse_latency)')
+    ap.add_argument("--upload-latency", default=None, help="/v1/files latency, same format")
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+    random.seed(args.seed)
+    state = FakeAnthropic(
+        batch_seconds=args.batch_seconds,
+        delta_seconds=args.delta_seconds,
+        rpm=args.rpm,
+        overload_rate=args.overload_rate,
+        error_rate=args.error_rate,
+        message_latency=parse_latency(args.latency),
+        upload_latency=parse_latency(args.upload_latency),
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(state))
+    print(f"Fake Anthropic API on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,66 @@
-import argparse, json, sys
+import argparse, json, random, sys, time
 from anthropic_client import AnthropicClient
 from config import load_config
-from prompts import (
-    DEFAULT_SYSTEM,
-    JSON_ENFORCEMENT_HINT,
-    build_question_prompt,
-    build_condition_prompt,
-)
+from packages import build_prompt, checklist_items, load_checklist, run_packages
+from parsing import extract_text_blocks, parse_question_answer, parse_condition_answer
+from prompts import DEFAULT_SYSTEM, JSON_ENFORCEMENT_HINT
+
+def wait_for_batch(client: AnthropicClient, batch_id: str, initial: float, maximum: float):
+    """Poll until the batch has ended, backing off exponentially with jitter."""
+    delay = initial
+    while True:
+        batch = client.retrieve_message_batch(batch_id)
+        if batch.processing_status == "ended":
+            return batch
+        print(f"Batch {batch_id}: {batch.processing_status}, {batch.request_counts.processing} processing", file=sys.stderr)
+        time.sleep(delay * random.uniform(0.8, 1.2))
+        delay = min(delay * 2, maximum)
+
+
+def run_bulk(client: AnthropicClient, prompts: list[str], file_ids: list[str],
+             initial: float = 10.0, maximum: float = 300.0) -> dict:
+    """Answer all prompts through one Message Batches submission; returns {index: message}."""
+    requests = [
+        {"custom_id": f"item-{i}", "params": client.message_params([{"text": prompt}], file_ids)}
+        for i, prompt in enumerate(prompts)
+    ]
+    batch = client.create_message_batch(requests)
+    print(f"Submitted batch {batch.id} with {len(requests)} requests", file=sys.stderr)
+    wait_for_batch(client, batch.id, initial, maximum)
+    messages = {}
+    for entry in client.message_batch_results(batch.id):
+        i = int(entry.custom_id.split("-", 1)[1])
+        if entry.result.type == "succeeded":
+            messages[i] = entry.result.message
+        else:
+            print(f"Item {i}: batch request {entry.result.type}", file=sys.stderr)
+    return messages
+
 
 def main():
     config = load_config()
     
     ap = argparse.ArgumentParser()
-    ap.add_argument("--files", nargs="+", required=True)
+    ap.add_argument("--files", nargs="+")
+    ap.add_argument("--dir", help="directory of tender packages (one subdirectory or PDF each), see packages.py")
+    ap.add_argument("--checklist", help="JSON/YAML file with 'questions' and 'conditions' (strings or {id, text})")
     ap.add_argument("--model", default=config.model)
     ap.add_argument("--temp", type=float, default=config.temperature)
     ap.add_argument("--max-tokens", type=int, default=config.max_output_tokens)
     ap.add_argument("--questions", nargs="*", default=[])
     ap.add_argument("--conditions", nargs="*", default=[])
+    ap.add_argument("--bulk", action="store_true", help="submit all items as one Message Batch (50%% cheaper, asynchronous)")
+    ap.add_argument("--poll-initial", type=float, default=10.0, help="first --bulk poll interval in seconds")
+    ap.add_argument("--poll-max", type=float, default=300.0, help="longest --bulk poll interval in seconds")
+    ap.add_argument("--workers", type=int, default=8, help="--dir: concurrent model calls")
+    ap.add_argument("--output", default="results.jsonl", help="--dir: JSONL results, resumed if it exists")
+    ap.add_argument("--upload-cache", default=".uploads.json", help="--dir: remembered file IDs by content hash")
+    ap.add_argument("--max-retries", type=int, default=2, help="SDK retries per call (rate limits, overload)")
     args = ap.parse_args()
+    if bool(args.files) == bool(args.dir):
+        ap.error("pass either --files or --dir")
+    if args.dir and args.bulk:
+        ap.error("--bulk is not supported with --dir")
 
     system_prompt = DEFAULT_SYSTEM + "\n" + JSON_ENFORCEMENT_HINT
     client = AnthropicClient(
@@ -27,74 +69,60 @@ def main():
         temperature=args.temp,
         max_tokens=args.max_tokens,
         system=system_prompt,
+        base_url=config.base_url,
+        max_retries=args.max_retries,
     )
-    fids = client.upload_files(args.files)
 
     questions = list(args.questions or [])
     conditions = list(args.conditions or [])
+    if args.checklist:
+        checklist = load_checklist(args.checklist)
+        questions += checklist["questions"]
+        conditions += checklist["conditions"]
+    if args.dir:
+        items = checklist_items(questions, conditions)
+        if not items:
+            print("No questions or conditions provided.", file=sys.stderr)
+            return
+        failed = run_packages(client, args.dir, items, args.output, args.upload_cache, args.workers)
+        sys.exit(1 if failed else 0)
+
+    questions = [q["text"] if isinstance(q, dict) else q for q in questions]
+    conditions = [c["text"] if isinstance(c, dict) else c for c in conditions]
+    fids = client.upload_files(args.files)
     print(questions, conditions, fids)
     if not questions and not conditions:
         print("No questions or conditions provided.", file=sys.stderr)
         return
 
-    def extract_text_blocks(msg) -> str:
-        raw = "\n".join([
-            (getattr(blk, "text", None).text if hasattr(getattr(blk, "text", None), "text") else getattr(blk, "text", None))
-            for blk in getattr(msg, "content", [])
-            if getattr(blk, "type", None) == "text"
-        ]).strip()
-        if raw.startswith("```"):
-            lines = raw.splitlines()
-            if lines[0].startswith("```"):
-                lines = lines[1:]
-            if lines and lines[-1].strip().startswith("```"):
-                lines = lines[:-1]
-            raw = "\n".join(lines).strip()
-        if raw.lower().startswith("json\n"):
-            raw = raw[5:].strip()
-        return raw
+    items = [("question", q) for q in questions] + [("condition", c) for c in conditions]
+    prompts = [build_prompt(kind, text) for kind, text in items]
 
     question_results = []
     condition_results = []
     last_msg_meta = {"model": None, "stop_reason": None}
-    for q in questions:
-        print("Processing question: ", q)
-        prompt = build_question_prompt(q) + "\nNur das JSON Objekt. Keine Erklärungen, KEINE Backticks."
-        res_msg = client.ask_with_files([{"text": prompt}], fids)
-        last_msg_meta["model"] = getattr(res_msg, "model", None)
-        last_msg_meta["stop_reason"] = getattr(res_msg, "stop_reason", None)
-        text_output = extract_text_blocks(res_msg)
-        answer_text = "Unklar"
-        try:
-            parsed = json.loads(text_output)
-            if isinstance(parsed, dict):
-                val = parsed.get("antwort") if "antwort" in parsed else parsed.get("answer")
-                if isinstance(val, str) and val.strip():
-                    answer_text = val.strip()
-        except Exception as e:
-            print(e)
-        print("Processed: ", {"question": q, "answer": answer_text})
-        question_results.append({"question": q, "answer": answer_text})
+    if args.bulk:
+        messages = run_bulk(client, prompts, fids, args.poll_initial, args.poll_max)
+    else:
+        messages = {}
+        for i, ((kind, text), prompt) in enumerate(zip(items, prompts)):
+            print(f"Processing {kind}: ", text)
+            messages[i] = client.ask_with_files([{"text": prompt}], fids)
 
-    for c in conditions:
-        print("Processing condition: ", c)
-        prompt = build_condition_prompt(c) + "\nNur das JSON Objekt. Keine Erklärungen, KEINE Backticks."
-        res_msg = client.ask_with_files([{"text": prompt}], fids)
-        last_msg_meta["model"] = getattr(res_msg, "model", None)
-        last_msg_meta["stop_reason"] = getattr(res_msg, "stop_reason", None)
-        text_output = extract_text_blocks(res_msg)
-        bool_answer: bool = False
-        try:
-            parsed = json.loads(text_output)
-            if isinstance(parsed, dict):
-                if isinstance(parsed.get("result"), bool):
-                    bool_answer = parsed["result"]
-                elif isinstance(parsed.get("answer"), bool):
-                    bool_answer = parsed["answer"]
-        except Exception as e:
-            print(e)
-        print("Processed: ", {"condition": c, "answer": bool_answer})
-        condition_results.append({"condition": c, "result": bool_answer})
+    for i, (kind, text) in enumerate(items):
+        res_msg = messages.get(i)
+        if res_msg is not None:
+            last_msg_meta["model"] = getattr(res_msg, "model", None)
+            last_msg_meta["stop_reason"] = getattr(res_msg, "stop_reason", None)
+        text_output = extract_text_blocks(res_msg) if res_msg is not None else ""
+        if kind == "question":
+            answer_text = parse_question_answer(text_output)
+            print("Processed: ", {"question": text, "answer": answer_text})
+            question_results.append({"question": text, "answer": answer_text})
+        else:
+            bool_answer = parse_condition_answer(text_output)
+            print("Processed: ", {"condition": text, "answer": bool_answer})
+            condition_results.append({"condition": text, "result": bool_answer})
 
     output = {
         "questions": question_results,
@@ -0,0 +1,239 @@
+"""Run one checklist over a directory of tender packages (main.py --dir).
+
+Every subdirectory of the root is one package (all PDFs below it); PDFs directly in
+the root are a package each. All items of all packages share one pool of worker
+threads. Each result is appended to a JSONL file as soon as it is known, and items
+already in that file are skipped on the next run, so an interrupted run is resumed by
+starting it again with the same arguments. Uploaded files are remembered by content
+hash, so a file is sent to the Files API only once per API key and base URL.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import anthropic
+
+from anthropic_client import AnthropicClient
+from parsing import extract_text_blocks, parse_condition_answer, parse_question_answer
+from prompts import build_condition_prompt, build_question_prompt
+
+JSON_ONLY_SUFFIX = "\nNur das JSON Objekt. Keine Erklärungen, KEINE Backticks."
+
+
+def build_prompt(kind: str, text: str) -> str:
+    return (build_question_prompt(text) if kind == "question" else build_condition_prompt(text)) + JSON_ONLY_SUFFIX
+
+
+def checklist_items(questions: list, conditions: list) -> list[dict]:
+    """Normalize questions/conditions (strings or {"id", "text"}) to [{"kind", "id", "text"}]."""
+    items = []
+    for kind, prefix, entries in (("question", "q", questions), ("condition", "c", conditions)):
+        for i, entry in enumerate(entries, start=1):
+            if isinstance(entry, str):
+                entry = {"text": entry}
+            text = str(entry.get("text", "")).strip()
+            if text:
+                items.append({"kind": kind, "id": str(entry.get("id") or f"{prefix}{i}"), "text": text})
+    return items
+
+
+def load_checklist(path: str) -> dict:
+    """Read {"questions": [...], "conditions": [...]} from a .json or .yaml/.yml file."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                sys.exit("YAML checklists need PyYAML: pip install pyyaml")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        sys.exit(f"{path}: expected an object with 'questions' and/or 'conditions'")
+    return {"questions": data.get("questions") or [], "conditions": data.get("conditions") or []}
+
+
+def find_packages(root: str) -> dict[str, list[Path]]:
+    """{package name: sorted PDF paths} for a directory of tender packages."""
+    packages = {}
+    for entry in sorted(Path(root).iterdir()):
+        if entry.is_dir():
+            pdfs = sorted(p for p in entry.rglob("*") if p.is_file() and p.suffix.lower() == ".pdf")
+            if pdfs:
+                packages[entry.name] = pdfs
+        elif entry.suffix.lower() == ".pdf":
+            packages[entry.name] = [entry]
+    return packages
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class UploadCache:
+    """Remote file IDs by content hash, persisted as JSON and scoped to API key and base URL."""
+
+    def __init__(self, path: str, api_key: str, base_url: str):
+        self.path = path
+        self.scope = hashlib.sha256(f"{base_url}|{api_key}".encode()).hexdigest()[:16]
+        self.lock = threading.Lock()
+        self.file_locks: dict[str, threading.Lock] = {}
+        self.hashes: dict[Path, str] = {}
+        self.data: dict[str, dict[str, str]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+        self.ids = self.data.setdefault(self.scope, {})
+        self.uploads = 0
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _hash(self, path: Path) -> str:
+        with self.lock:
+            sha = self.hashes.get(path)
+        if sha is None:
+            sha = file_sha256(path)
+            with self.lock:
+                self.hashes[path] = sha
+        return sha
+
+    def file_id(self, client: AnthropicClient, path: Path) -> str:
+        sha = self._hash(path)
+        with self.lock:
+            file_lock = self.file_locks.setdefault(sha, threading.Lock())
+        # One upload per content, even when several items of a package start at once.
+        with file_lock:
+            with self.lock:
+                fid = self.ids.get(sha)
+            if fid is None:
+                fid = client.upload_file(str(path))
+                with self.lock:
+                    self.ids[sha] = fid
+                    self.uploads += 1
+                    self._save()
+        return fid
+
+    def file_ids(self, client: AnthropicClient, paths: list[Path]) -> list[str]:
+        return [self.file_id(client, p) for p in paths]
+
+    def forget(self, file_ids: list[str]):
+        """Drop IDs the API no longer knows, so they are uploaded again."""
+        with self.lock:
+            for sha, fid in list(self.ids.items()):
+                if fid in file_ids:
+                    del self.ids[sha]
+            self._save()
+
+
+class ResultLog:
+    """Append-only JSONL of item results; lines without "error" count as done."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done: set[tuple] = set()
+        needs_newline = False
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    needs_newline = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # cut off by an interruption
+                    if "error" not in record:
+                        self.done.add(self.key(record["package"], record))
+        self.file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self.file.write("\n")
+
+    @staticmethod
+    def key(package: str, item: dict) -> tuple:
+        return package, item["kind"], item["id"], item["text"]
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def answer_item(client: AnthropicClient, cache: UploadCache, package: str, files: list[Path], item: dict) -> dict:
+    record = {"package": package, **item}
+    fids = cache.file_ids(client, files)
+    prompts = [{"text": build_prompt(item["kind"], item["text"])}]
+    try:
+        msg = client.ask_with_files(prompts, fids)
+    except anthropic.NotFoundError:
+        # Uploaded earlier but deleted remotely since; upload again once.
+        cache.forget(fids)
+        msg = client.ask_with_files(prompts, cache.file_ids(client, files))
+    raw = extract_text_blocks(msg)
+    if item["kind"] == "question":
+        record["answer"] = parse_question_answer(raw)
+    else:
+        record["result"] = parse_condition_answer(raw)
+    usage = getattr(msg, "usage", None)
+    record.update(
+        model=getattr(msg, "model", None),
+        stop_reason=getattr(msg, "stop_reason", None),
+        usage={"input_tokens": getattr(usage, "input_tokens", None),
+               "output_tokens": getattr(usage, "output_tokens", None)} if usage else None,
+    )
+    return record
+
+
+def run_packages(client: AnthropicClient, root: str, items: list[dict], output: str, upload_cache: str,
+                 workers: int) -> int:
+    """Answer every item for every package under root; returns the number of failed items."""
+    packages = find_packages(root)
+    log = ResultLog(output)
+    cache = UploadCache(upload_cache, client.api_key, client.base_url)
+    tasks = [(name, files, item) for name, files in packages.items() for item in items
+             if ResultLog.key(name, item) not in log.done]
+    print(f"{len(packages)} packages x {len(items)} items, {len(log.done)} already in {output}, "
+          f"{len(tasks)} to do with {workers} workers", file=sys.stderr)
+
+    failed = finished = 0
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        # Submitted package by package, so packages complete one after another rather than all at the end.
+        futures = {pool.submit(answer_item, client, cache, name, files, item): (name, item)
+                   for name, files, item in tasks}
+        for fut in as_completed(futures):
+            name, item = futures[fut]
+            finished += 1
+            try:
+                record = fut.result()
+            except Exception as e:
+                failed += 1
+                record = {"package": name, **item, "error": f"{type(e).__name__}: {e}"}
+                print(f"[{finished}/{len(tasks)}] {name} {item['id']} failed: {e}", file=sys.stderr)
+            else:
+                print(f"[{finished}/{len(tasks)}] {name} {item['id']}", file=sys.stderr)
+            log.write(record)
+    except KeyboardInterrupt:
+        print("Interrupted; run again with the same --output to resume.", file=sys.stderr)
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    finally:
+        pool.shutdown(wait=True)
+        log.close()
+    print(f"Done: {finished - failed} answered, {failed} failed (retried on the next run), "
+          f"{cache.uploads} files uploaded", file=sys.stderr)
+    return failed
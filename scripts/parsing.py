@@ -0,0 +1,44 @@
+import json
+
+def extract_text_blocks(msg) -> str:
+    raw = "\n".join([
+        (getattr(blk, "text", None).text if hasattr(getattr(blk, "text", None), "text") else getattr(blk, "text", None))
+        for blk in getattr(msg, "content", [])
+        if getattr(blk, "type", None) == "text"
+    ]).strip()
+    if raw.startswith("```"):
+        lines = raw.splitlines()
+        if lines[0].startswith("```"):
+            lines = lines[1:]
+        if lines and lines[-1].strip().startswith("```"):
+            lines = lines[:-1]
+        raw = "\n".join(lines).strip()
+    if raw.lower().startswith("json\n"):
+        raw = raw[5:].strip()
+    return raw
+
+
+def parse_question_answer(raw: str) -> str:
+    """Extract the 'antwort' field if JSON, else fallback."""
+    try:
+        parsed = json.loads(raw)
+        if isinstance(parsed, dict):
+            val = parsed.get("antwort") if "antwort" in parsed else parsed.get("answer")
+            if isinstance(val, str) and val.strip():
+                return val.strip()
+    except Exception as e:
+        print(e)
+    return "Unklar"
+
+
+def parse_condition_answer(raw: str) -> bool:
+    try:
+        parsed = json.loads(raw)
+        if isinstance(parsed, dict):
+            if isinstance(parsed.get("result"), bool):
+                return parsed["result"]
+            if isinstance(parsed.get("answer"), bool):
+                return parsed["answer"]
+    except Exception as e:
+        print(e)
+    return False